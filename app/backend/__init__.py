@@ -1,2 +1,2 @@
 # backend package initializer
-from .app import app, db  # expose for imports
+from .app import app, create_app, db  # expose for imports
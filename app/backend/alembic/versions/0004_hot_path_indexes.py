@@ -0,0 +1,86 @@
+"""add secondary indexes for hot read paths and uniqueness for badges/streaks
+
+Revision ID: 0004_hot_path_indexes
+Revises: 0003_add_user_fields
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004_hot_path_indexes'
+down_revision = '0003_add_user_fields'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, unique)
+INDEXES = [
+    ('ix_users_xp_total', 'users', ['xp_total'], False),                   # leaderboard sort / rebuild
+    ('ix_xp_events_user_created', 'xp_events', ['user_id', 'created_at'], False),  # recent events
+    ('ix_jobs_user_created', 'jobs', ['user_id', 'created_at'], False),     # list_jobs
+    ('uq_user_badges_user_badge', 'user_badges', ['user_id', 'badge_id'], True),
+    ('uq_streaks_user_id', 'streaks', ['user_id'], True),
+]
+
+
+def _create_jobs_table_if_missing():
+    # `jobs` was only ever created by db.create_all(); create it here so migrated DBs match.
+    # Offline (--sql) runs cannot inspect the schema and assume the table exists.
+    if op.get_context().as_sql or 'jobs' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('language', sa.String(50), nullable=True),
+        sa.Column('payload', sa.JSON, nullable=True),
+        sa.Column('status', sa.String(40), nullable=True),
+        sa.Column('created_at', sa.DateTime, nullable=True),
+        sa.Column('started_at', sa.DateTime, nullable=True),
+        sa.Column('finished_at', sa.DateTime, nullable=True),
+        sa.Column('output', sa.Text, nullable=True),
+    )
+
+
+def _remove_duplicates():
+    # unique indexes cannot be built over existing duplicates; keep the oldest row of each group
+    op.execute(
+        """
+        DELETE FROM user_badges WHERE id NOT IN (
+            SELECT MIN(id) FROM user_badges GROUP BY user_id, badge_id
+        )
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM streaks WHERE id NOT IN (
+            SELECT MIN(id) FROM streaks GROUP BY user_id
+        )
+        """
+    )
+
+
+def upgrade():
+    _create_jobs_table_if_missing()
+    _remove_duplicates()
+    if op.get_bind().dialect.name == 'postgresql':
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction. If a build is interrupted
+        # it leaves an INVALID index behind: drop it before re-running this revision.
+        with op.get_context().autocommit_block():
+            for name, table, columns, unique in INDEXES:
+                op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True,
+                                if_not_exists=True)
+    else:
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique, if_not_exists=True)
+
+
+def downgrade():
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    if concurrently:
+        with op.get_context().autocommit_block():
+            for name, table, _columns, _unique in reversed(INDEXES):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    else:
+        for name, table, _columns, _unique in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,37 @@
+"""add xp_rollups table for period leaderboards and per-source summaries
+
+Revision ID: 0005_xp_rollups
+Revises: 0004_hot_path_indexes
+Create Date: 2026-10-18 00:00:00.000000
+
+Populate it afterwards with `python backend/scripts/backfill_xp_rollups.py`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0005_xp_rollups'
+down_revision = '0004_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'xp_rollups',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('period', sa.String(10), nullable=False),
+        sa.Column('bucket_start', sa.Date, nullable=False),
+        sa.Column('source', sa.String(50), nullable=False),
+        sa.Column('amount', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('event_count', sa.Integer, nullable=False, server_default='0'),
+    )
+    op.create_index('uq_xp_rollups_key', 'xp_rollups', ['user_id', 'period', 'bucket_start', 'source'], unique=True)
+    op.create_index('ix_xp_rollups_board', 'xp_rollups', ['period', 'bucket_start', 'source', 'amount'])
+
+
+def downgrade():
+    op.drop_index('ix_xp_rollups_board', table_name='xp_rollups')
+    op.drop_index('uq_xp_rollups_key', table_name='xp_rollups')
+    op.drop_table('xp_rollups')
@@ -0,0 +1,29 @@
+"""add xp_events.pending for async XP ingestion
+
+Revision ID: 0006_xp_events_pending
+Revises: 0005_xp_rollups
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0006_xp_events_pending'
+down_revision = '0005_xp_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing events are already folded into users.xp_total
+    with op.batch_alter_table('xp_events') as batch:
+        batch.add_column(sa.Column('pending', sa.Boolean, nullable=False, server_default=sa.false()))
+    # partial index: only unapplied events, in the order the consumer reads them
+    op.create_index('ix_xp_events_pending', 'xp_events', ['id'],
+                    postgresql_where=sa.text('pending'), sqlite_where=sa.text('pending'))
+
+
+def downgrade():
+    op.drop_index('ix_xp_events_pending', table_name='xp_events')
+    with op.batch_alter_table('xp_events') as batch:
+        batch.drop_column('pending')
@@ -0,0 +1,36 @@
+"""add transactional outbox and relay offsets
+
+Revision ID: 0007_outbox
+Revises: 0006_xp_events_pending
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0007_outbox'
+down_revision = '0006_xp_events_pending'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'outbox_events',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('topic', sa.String(50), nullable=False),
+        sa.Column('key', sa.String(200), nullable=True),
+        sa.Column('payload', sa.JSON, nullable=True),
+        sa.Column('created_at', sa.DateTime, nullable=True),
+    )
+    op.create_table(
+        'outbox_offsets',
+        sa.Column('consumer', sa.String(100), primary_key=True),
+        sa.Column('last_id', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime, nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('outbox_offsets')
+    op.drop_table('outbox_events')
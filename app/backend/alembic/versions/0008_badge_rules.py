@@ -0,0 +1,26 @@
+"""add badges.rule for automatic, rule-driven awards
+
+Revision ID: 0008_badge_rules
+Revises: 0007_outbox
+Create Date: 2026-10-18 00:00:00.000000
+
+Award historical badges afterwards with `python backend/scripts/backfill_badges.py`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0008_badge_rules'
+down_revision = '0007_outbox'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('badges') as batch:
+        batch.add_column(sa.Column('rule', sa.JSON, nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('badges') as batch:
+        batch.drop_column('rule')
@@ -0,0 +1,28 @@
+"""add job_output_chunks for streamed job output
+
+Revision ID: 0009_job_output_chunks
+Revises: 0008_badge_rules
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0009_job_output_chunks'
+down_revision = '0008_badge_rules'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job_output_chunks',
+        sa.Column('job_id', sa.Integer, sa.ForeignKey('jobs.id'), primary_key=True),
+        sa.Column('seq', sa.Integer, primary_key=True),
+        sa.Column('data', sa.Text, nullable=False),
+        sa.Column('created_at', sa.DateTime, nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('job_output_chunks')
@@ -0,0 +1,33 @@
+"""add job priority, attempts and lease columns for the DB-backed scheduler
+
+Revision ID: 0010_job_scheduling
+Revises: 0009_job_output_chunks
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0010_job_scheduling'
+down_revision = '0009_job_output_chunks'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('jobs') as batch:
+        batch.add_column(sa.Column('priority', sa.Integer, nullable=False, server_default='0'))
+        batch.add_column(sa.Column('attempts', sa.Integer, nullable=False, server_default='0'))
+        batch.add_column(sa.Column('lease_owner', sa.String(100), nullable=True))
+        batch.add_column(sa.Column('lease_expires_at', sa.DateTime, nullable=True))
+    # serves the per-user candidate scan of queued jobs and the running-job counts
+    op.create_index('ix_jobs_status_user_priority', 'jobs', ['status', 'user_id', 'priority', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_jobs_status_user_priority', table_name='jobs')
+    with op.batch_alter_table('jobs') as batch:
+        batch.drop_column('lease_expires_at')
+        batch.drop_column('lease_owner')
+        batch.drop_column('attempts')
+        batch.drop_column('priority')
@@ -0,0 +1,34 @@
+"""backfill and require created_at on jobs and xp_events (keyset pagination cursors)
+
+Revision ID: 0011_created_at_not_null
+Revises: 0010_job_scheduling
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0011_created_at_not_null'
+down_revision = '0010_job_scheduling'
+branch_labels = None
+depends_on = None
+
+EPOCH = '1970-01-01 00:00:00'
+
+
+def upgrade():
+    # legacy rows without a timestamp sort as the oldest; a job falls back to when it ran
+    op.execute(sa.text("UPDATE jobs SET created_at = COALESCE(started_at, finished_at, :epoch) "
+                       "WHERE created_at IS NULL").bindparams(epoch=EPOCH))
+    op.execute(sa.text("UPDATE xp_events SET created_at = :epoch WHERE created_at IS NULL").bindparams(epoch=EPOCH))
+    with op.batch_alter_table('jobs') as batch:
+        batch.alter_column('created_at', existing_type=sa.DateTime, nullable=False)
+    with op.batch_alter_table('xp_events') as batch:
+        batch.alter_column('created_at', existing_type=sa.DateTime, nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('xp_events') as batch:
+        batch.alter_column('created_at', existing_type=sa.DateTime, nullable=True)
+    with op.batch_alter_table('jobs') as batch:
+        batch.alter_column('created_at', existing_type=sa.DateTime, nullable=True)
@@ -1,32 +1,135 @@
+import json
 import os
+import threading
+
 from flask import Flask, jsonify
-from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 
 # Configure app and DB
 app = Flask(__name__)
-CORS(app)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///./dev.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret')
 app.config['ALLOW_DEV_LOGIN'] = os.getenv('ALLOW_DEV_LOGIN', '1') in ('1', 'true', 'True')
+# per-process connection pool; size it against the server's max_connections / worker count
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', '5'))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', '10'))
 
-# initialize DB without binding to app so tests can override `app.config` before init
+# initialize DB without binding to app so callers can override `app.config` before create_app()
 db = SQLAlchemy()
 
-# import models and blueprints (registered below to avoid circular imports)
 from backend import models  # noqa: E402
-from backend.routes.xp import xp_bp
-from backend.routes.users import users_bp
-from backend.routes.badges import badges_bp
-from backend.routes.auth import auth_bp
-from backend.routes.jobs import jobs_bp
-
-app.register_blueprint(xp_bp)
-app.register_blueprint(users_bp)
-app.register_blueprint(badges_bp)
-app.register_blueprint(auth_bp)
-app.register_blueprint(jobs_bp)
+
+_created = False
+_create_lock = threading.Lock()
+
+
+def _flag(value: str) -> bool:
+    return value in ('1', 'true', 'True')
+
+
+# settings create_app() reads from the environment: name -> parser for the string value
+ENV_SETTINGS = {
+    # rate limits, the leaderboard, RQ dispatch and cancellation use Redis when this is set
+    'REDIS_URL': str,
+    'LEADERBOARD_BACKEND': str,
+    'LEADERBOARD_REDIS_KEY': str,
+    'LEADERBOARD_REFRESH_SECONDS': float,
+    'LEADERBOARD_REBUILD_CHUNK': int,
+    'LEADERBOARD_STREAM_SIZE': int,
+    'LEADERBOARD_STREAM_POLL_SECONDS': float,
+    'LEADERBOARD_STREAM_HEARTBEAT_SECONDS': float,
+    'XP_INGEST_MODE': str,
+    'XP_INGEST_CONSUMER': str,
+    'XP_INGEST_BATCH_SIZE': int,
+    'XP_INGEST_POLL_SECONDS': float,
+    'XP_INGEST_LINGER_SECONDS': float,
+    'XP_INGEST_READ_YOUR_WRITES': _flag,
+    # job execution (backend.scripts.worker, backend.runner_pool)
+    'JOB_DISPATCH': str,
+    'JOB_RUN_TIMEOUT': int,
+    'JOB_RUN_MEMORY': str,
+    'JOB_CANCEL_POLL_SECONDS': float,
+    'JOB_OUTPUT_CHUNK_BYTES': int,
+    'JOB_OUTPUT_MAX_BYTES': int,
+    'JOB_OUTPUT_PREVIEW_BYTES': int,
+    'JOB_OUTPUT_FLUSH_SECONDS': float,
+    'USE_RUNNER_POOL': _flag,
+    'USE_CONTAINER_RUNNER': _flag,
+    'DOCKER_RUNNER_IMAGE': str,
+    'RUNNER_BACKEND': str,
+    'RUNNER_POOL_SIZE': int,
+    'RUNNER_MAX_JOBS': int,
+    'RUNNER_MEMORY_WATERMARK_BYTES': int,
+    'RUNNER_JOB_UID': int,
+    'RUNNER_IMAGES': json.loads,
+}
+
+
+def env_config(environ=None) -> dict:
+    """The ENV_SETTINGS present (and non-empty) in `environ`, parsed."""
+    environ = os.environ if environ is None else environ
+    return {name: parse(environ[name]) for name, parse in ENV_SETTINGS.items() if environ.get(name)}
+
+
+def _engine_options(cfg) -> dict:
+    """Pool settings from DB_* config; explicit SQLALCHEMY_ENGINE_OPTIONS win."""
+    opts = {
+        # drop connections the server closed while they sat in the pool
+        'pool_pre_ping': bool(cfg.get('DB_POOL_PRE_PING', True)),
+        # compiled statements cached per engine
+        'query_cache_size': int(cfg.get('DB_STATEMENT_CACHE_SIZE', 500)),
+    }
+    if not cfg['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        opts.update(
+            pool_size=int(cfg.get('DB_POOL_SIZE', 5)),
+            max_overflow=int(cfg.get('DB_MAX_OVERFLOW', 10)),
+            pool_recycle=int(cfg.get('DB_POOL_RECYCLE', 1800)),
+            pool_timeout=float(cfg.get('DB_POOL_TIMEOUT', 30)),
+        )
+    opts.update(cfg.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return opts
+
+
+def _register_blueprints(flask_app) -> None:
+    # imported here: the routes pull in most of the backend, which plain `import backend`
+    # (scripts, RQ workers, tooling) does not need
+    from flask_cors import CORS
+    from backend.routes.auth import auth_bp
+    from backend.routes.badges import badges_bp
+    from backend.routes.jobs import jobs_bp
+    from backend.routes.users import users_bp
+    from backend.routes.xp import xp_bp
+
+    CORS(flask_app)
+    flask_app.register_blueprint(xp_bp)
+    flask_app.register_blueprint(users_bp)
+    flask_app.register_blueprint(badges_bp)
+    flask_app.register_blueprint(auth_bp)
+    flask_app.register_blueprint(jobs_bp)
+
+
+def create_app(config: dict = None):
+    """Apply `config`, then bind the database and register the blueprints (once per
+    process) and return the app.
+
+    ENV_SETTINGS are taken from the environment unless `config` or earlier writes to
+    `app.config` already set them. Engine settings (SQLALCHEMY_DATABASE_URI, DB_POOL_*, SQLALCHEMY_ENGINE_OPTIONS) take
+    effect on the first call only; later calls just update the config.
+    """
+    global _created
+    with _create_lock:
+        if config:
+            app.config.update(config)
+        for name, value in env_config().items():
+            app.config.setdefault(name, value)
+        if not _created:
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = _engine_options(app.config)
+            db.init_app(app)
+            _register_blueprints(app)
+            _created = True
+    return app
+
 
 @app.route('/health')
 def health():
@@ -36,10 +139,19 @@ def health():
 def ping():
     return jsonify({'ok': True, 'message': 'pong'})
 
+@app.route('/api/v1/cache/stats')
+def cache_stats():
+    from backend import auth, cache
+    return jsonify({'ok': True, 'cache': cache.stats(), 'auth_tokens': auth.stats()})
+
 if __name__ == '__main__':
+    # development server only; production runs `python -m backend.serve`
     # create all tables in dev mode
     # bind DB from app config then create tables
-    db.init_app(app)
+    create_app()
     with app.app_context():
         db.create_all()
-    app.run(host='0.0.0.0', port=5000, debug=True)
+        # warm the leaderboard index with one bulk scan of `users`
+        from backend import leaderboard
+        leaderboard.rebuild(db.session)
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_DEBUG', '1') in ('1', 'true', 'True'))
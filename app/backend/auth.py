@@ -1,10 +1,74 @@
+"""JWT issue and verification.
+
+Tokens are HS256-signed with one of several keys identified by the `kid` header, so a
+new key can be rolled out while tokens signed with the previous one stay valid:
+JWT_KEYS is a JSON object {kid: secret} and JWT_ACTIVE_KID picks the key new tokens
+are signed with. SECRET_KEY verifies tokens without a `kid` (issued before key
+rotation) only while JWT_KEYS is empty or JWT_ACCEPT_LEGACY=1, so once those tokens have
+expired the old secret can be retired. `load_keys` replaces the key set at runtime.
+
+Verified tokens are kept in a bounded LRU (AUTH_TOKEN_CACHE_SIZE entries) keyed by the
+SHA-256 of the token, so repeat requests skip the HMAC and claim checks; an entry is
+only used until the token's `exp` and while the same secret is loaded under its kid. Within one request
+the result is memoized on `flask.g`. `stats()` reports cache hits and verification cost.
+"""
+import hashlib
+import json
+import logging
 import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
 import jwt
 from datetime import datetime, timedelta, timezone
-from flask import request, jsonify
+from flask import g, request, jsonify
 
 SECRET = os.getenv('SECRET_KEY', 'dev-secret')
 ALGORITHM = 'HS256'
+LEGACY_KID = None  # tokens issued without a kid header
+
+logger = logging.getLogger(__name__)
+
+_keys = {}  # kid -> (secret, fingerprint)
+_active_kid = None
+_cache = OrderedDict()  # sha256(token) -> (user_id, exp, kid, fingerprint)
+_cache_size = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', '10000'))
+_stats = {'cache_hits': 0, 'cache_misses': 0, 'verifications': 0, 'verify_seconds': 0.0, 'failures': {}}
+_lock = Lock()
+
+
+def _fingerprint(secret: str) -> str:
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()[:16]
+
+
+def load_keys(keys: dict, active_kid: str = None, accept_legacy: bool = None) -> None:
+    """Replace the verification keys ({kid: secret}) and the kid used for new tokens.
+
+    SECRET_KEY stays loaded for tokens without a kid only when `keys` is empty or
+    `accept_legacy` (default: JWT_ACCEPT_LEGACY) is set. Without an `active_kid`, a single
+    key signs new tokens; with several keys and SECRET_KEY retired, ValueError. Cached
+    tokens whose kid is no longer loaded, or now maps to another secret, stop verifying
+    at once.
+    """
+    global _keys, _active_kid
+    if active_kid is not None and active_kid not in keys:
+        raise ValueError(f'active kid {active_kid!r} is not among the loaded keys')
+    if accept_legacy is None:
+        accept_legacy = os.getenv('JWT_ACCEPT_LEGACY', '0') in ('1', 'true', 'True')
+    if keys and active_kid is None and not accept_legacy:
+        if len(keys) > 1:
+            raise ValueError('JWT_ACTIVE_KID must name the key that signs new tokens')
+        (active_kid,) = keys
+    secrets = dict(keys)
+    if not keys or accept_legacy:
+        secrets[LEGACY_KID] = SECRET
+    with _lock:
+        _keys = {kid: (secret, _fingerprint(secret)) for kid, secret in secrets.items()}
+        _active_kid = active_kid
+
+
+load_keys(json.loads(os.getenv('JWT_KEYS', '{}')), os.getenv('JWT_ACTIVE_KID') or None)
 
 
 def create_token(user_id: int, expires_minutes: int = 60 * 24 * 7) -> str:
@@ -14,26 +78,100 @@ def create_token(user_id: int, expires_minutes: int = 60 * 24 * 7) -> str:
         'exp': datetime.now(timezone.utc) + timedelta(minutes=expires_minutes),
         'iat': datetime.now(timezone.utc),
     }
-    return jwt.encode(payload, SECRET, algorithm=ALGORITHM)
+    kid = _active_kid
+    headers = {'kid': kid} if kid is not None else None
+    return jwt.encode(payload, _keys[kid][0], algorithm=ALGORITHM, headers=headers)
 
 
-def decode_token(token: str):
+def _fail(reason: str) -> None:
+    with _lock:
+        _stats['failures'][reason] = _stats['failures'].get(reason, 0) + 1
+    logger.debug('token rejected: %s', reason)
+
+
+def _verify(token: str):
+    """Full verification; returns (user_id, exp, kid, fingerprint) or None."""
+    started = time.perf_counter()
     try:
-        data = jwt.decode(token, SECRET, algorithms=[ALGORITHM])
-        return int(data.get('sub'))
-    except Exception:
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = _keys.get(kid)
+        if key is None:
+            _fail('unknown_kid')
+            return None
+        secret, fingerprint = key
+        data = jwt.decode(token, secret, algorithms=[ALGORITHM])
+        return int(data.get('sub')), data.get('exp'), kid, fingerprint
+    except jwt.ExpiredSignatureError:
+        _fail('expired')
+    except jwt.InvalidTokenError as e:
+        _fail(type(e).__name__)
+    except (TypeError, ValueError):
+        _fail('invalid_subject')
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            _stats['verifications'] += 1
+            _stats['verify_seconds'] += elapsed
+    return None
+
+
+def decode_token(token: str):
+    """Return the user id for a valid token, else None."""
+    digest = hashlib.sha256(token.encode('utf-8')).digest()
+    now = time.time()
+    with _lock:
+        entry = _cache.get(digest)
+        if entry is not None:
+            user_id, exp, kid, fingerprint = entry
+            key = _keys.get(kid)
+            if (exp is None or exp > now) and key is not None and key[1] == fingerprint:
+                _cache.move_to_end(digest)
+                _stats['cache_hits'] += 1
+                return user_id
+            del _cache[digest]
+        _stats['cache_misses'] += 1
+    verified = _verify(token)
+    if verified is None:
         return None
+    with _lock:
+        _cache[digest] = verified
+        _cache.move_to_end(digest)
+        while len(_cache) > _cache_size:
+            _cache.popitem(last=False)
+    return verified[0]
 
 
 def get_auth_user_id():
+    """The authenticated user id for the current request, or None (memoized on `g`)."""
     auth = request.headers.get('Authorization')
+    # keyed by the header: an app context (and its `g`) can outlive one request
+    memo = g.get('auth_context')
+    if memo is not None and memo[0] == auth:
+        return memo[1]
     if not auth:
-        return None
-    if auth.startswith('Bearer '):
-        token = auth.split(' ', 1)[1]
+        uid = None
     else:
-        token = auth
-    return decode_token(token)
+        if auth.startswith('Bearer '):
+            token = auth.split(' ', 1)[1]
+        else:
+            token = auth
+        uid = decode_token(token)
+    g.auth_context = (auth, uid)
+    return uid
+
+
+def stats() -> dict:
+    with _lock:
+        s = {**_stats, 'failures': dict(_stats['failures'])}
+        s['cache_size'] = len(_cache)
+        s['keys'] = len(_keys)
+    s['verify_avg_seconds'] = s['verify_seconds'] / (s['verifications'] or 1)
+    return s
+
+
+def clear_cache() -> None:
+    with _lock:
+        _cache.clear()
 
 
 def require_auth_or_payload_user(payload_user_key: str = 'user_id'):
@@ -0,0 +1,199 @@
+"""Rule-driven automatic badge awards.
+
+A badge may carry a declarative `rule` (JSON on `badges.rule`):
+
+  {"type": "xp_total", "min": 1000}                   xp_total >= 1000
+  {"type": "streak", "min": 7}                        current check-in streak >= 7
+  {"type": "source_events", "source": "lab", "min": 10}  10 applied XP events from source "lab"
+  {"type": "jobs_finished", "min": 1}                 first finished job
+
+Rules are compiled once per badge-catalog load and indexed by the event topics that can
+change their outcome (the same topics the outbox uses), with source rules further keyed by
+source. Writers call `evaluate([(topic, user_id, facts), ...])` in the transaction of the
+change; only the rules indexed under those topics are checked, rules on badges the user
+already holds are skipped, and the remaining counts are fetched with one grouped query
+per rule type. Qualifying badges are inserted in one INSERT ... ON CONFLICT DO NOTHING
+against uq_user_badges_user_badge, so concurrent evaluations award each badge once.
+
+`backfill` evaluates every rule for every user in set-based passes, one
+INSERT ... SELECT per rule.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import exists, func, insert, literal, select, tuple_
+
+from backend import cache, outbox, profiles
+from backend.app import db
+from backend.db_helpers import insert_ignore_many
+from backend.models import JobRecord, Streak, User, UserBadge, XPEvent
+
+# rule type -> topics whose events can make the rule true
+TRIGGERS = {
+    'xp_total': ('xp.awarded', 'streak.checkin'),
+    'streak': ('streak.checkin',),
+    'source_events': ('xp.awarded', 'streak.checkin'),
+    'jobs_finished': ('job.status',),
+}
+
+
+class Rule:
+    __slots__ = ('badge_id', 'code', 'type', 'min', 'source')
+
+    def __init__(self, badge_id: int, code: str, spec: dict):
+        self.badge_id = badge_id
+        self.code = code
+        self.type = spec['type']
+        self.min = int(spec.get('min', 1))
+        self.source = spec.get('source')
+
+
+def compile_rules(badges) -> dict:
+    """Build {topic: [Rule]} from catalog rows; source rules are keyed (topic, source).
+
+    Rows without a rule, or with an unknown rule type, are ignored.
+    """
+    index = defaultdict(list)
+    for b in badges:
+        spec = b.get('rule')
+        if not isinstance(spec, dict) or spec.get('type') not in TRIGGERS:
+            continue
+        if spec['type'] == 'source_events' and not spec.get('source'):
+            continue
+        rule = Rule(b['id'], b['code'], spec)
+        for topic in TRIGGERS[rule.type]:
+            index[(topic, rule.source) if rule.source else topic].append(rule)
+    return dict(index)
+
+
+def rule_index() -> dict:
+    from backend.routes.badges import get_badge_catalog
+    return get_badge_catalog()['rules']
+
+
+def _candidates(index, items):
+    """{(user_id, badge_id): (rule, facts)} for rules the given events could satisfy."""
+    found = {}
+    for topic, user_id, facts in items:
+        rules = list(index.get(topic, ()))
+        if facts.get('source'):
+            rules += index.get((topic, facts['source']), ())
+        for rule in rules:
+            # later events for the same user carry newer facts
+            found[(user_id, rule.badge_id)] = (rule, facts)
+    return found
+
+
+def _counts(pairs, stmt_for):
+    """Run one grouped count query for a set of keys; returns {key: count}."""
+    if not pairs:
+        return {}
+    return {tuple(r[:-1]): r[-1] for r in db.session.execute(stmt_for(list(pairs)))}
+
+
+def _qualifies(candidates):
+    """Return the (user_id, rule) pairs whose condition holds, with at most one count query
+    per rule type."""
+    source_keys = {(uid, r.source) for (uid, _b), (r, _f) in candidates.items() if r.type == 'source_events'}
+    job_users = {(uid,) for (uid, _b), (r, _f) in candidates.items() if r.type == 'jobs_finished'}
+    source_counts = _counts(source_keys, lambda keys: (
+        select(XPEvent.user_id, XPEvent.source, func.count())
+        .where(tuple_(XPEvent.user_id, XPEvent.source).in_(keys), XPEvent.pending.is_(False))
+        .group_by(XPEvent.user_id, XPEvent.source)))
+    job_counts = _counts(job_users, lambda keys: (
+        select(JobRecord.user_id, func.count())
+        .where(JobRecord.user_id.in_([k[0] for k in keys]), JobRecord.status == 'finished')
+        .group_by(JobRecord.user_id)))
+
+    hits = []
+    for (user_id, _badge_id), (rule, facts) in candidates.items():
+        if rule.type == 'xp_total':
+            value = facts.get('xp_total') or 0
+        elif rule.type == 'streak':
+            value = facts.get('streak') or 0
+        elif rule.type == 'source_events':
+            value = source_counts.get((user_id, rule.source), 0)
+        else:
+            value = job_counts.get((user_id,), 0)
+        if value >= rule.min:
+            hits.append((user_id, rule))
+    return hits
+
+
+def evaluate(items) -> list:
+    """Award every badge whose rule the given events satisfy, in the current transaction.
+
+    `items` are (topic, user_id, facts) tuples where facts may hold `xp_total`, `streak`,
+    `source` and `status`. Returns the newly awarded (user_id, badge_id, code) tuples and
+    emits a `badge.awarded` outbox event for each. Does not commit; call
+    `invalidate(awarded)` after committing.
+    """
+    index = rule_index()
+    if not index:
+        return []
+    items = [i for i in items if i[0] != 'job.status' or i[2].get('status') == 'finished']
+    candidates = _candidates(index, items)
+    if not candidates:
+        return []
+    held = db.session.execute(
+        select(UserBadge.user_id, UserBadge.badge_id).where(tuple_(UserBadge.user_id, UserBadge.badge_id).in_(list(candidates)))
+    ).all()
+    for key in held:
+        candidates.pop(tuple(key), None)
+    hits = _qualifies(candidates)
+    if not hits:
+        return []
+    now = datetime.now(timezone.utc)
+    inserted = insert_ignore_many(
+        UserBadge, [{'user_id': uid, 'badge_id': r.badge_id, 'earned_at': now} for uid, r in hits], ('user_id', 'badge_id'))
+    codes = {r.badge_id: r.code for _uid, r in hits}
+    awarded = [(uid, badge_id, codes[badge_id]) for uid, badge_id in inserted]
+    for uid, badge_id, code in awarded:
+        outbox.emit('badge.awarded', uid, {'user_id': uid, 'badge_id': badge_id, 'code': code, 'rule': True})
+    return awarded
+
+
+def invalidate(awarded) -> None:
+    for user_id in {a[0] for a in awarded}:
+        profiles.invalidate_user(user_id)
+
+
+def _qualifying_users(rule):
+    """A select of user ids satisfying `rule` over the whole history."""
+    if rule.type == 'xp_total':
+        return select(User.id.label('user_id')).where(User.xp_total >= rule.min)
+    if rule.type == 'streak':
+        return select(Streak.user_id).where(Streak.current_streak >= rule.min)
+    if rule.type == 'source_events':
+        return (select(XPEvent.user_id).where(XPEvent.source == rule.source, XPEvent.pending.is_(False))
+                .group_by(XPEvent.user_id).having(func.count() >= rule.min))
+    return (select(JobRecord.user_id).where(JobRecord.status == 'finished', JobRecord.user_id.isnot(None))
+            .group_by(JobRecord.user_id).having(func.count() >= rule.min))
+
+
+def backfill(session, dry_run: bool = False, progress=print) -> dict:
+    """Evaluate every rule for every user with one INSERT ... SELECT per rule.
+
+    Returns {badge code: users awarded (or, with `dry_run`, users that would be)}. Does not
+    emit outbox events, so a backfill does not notify users about historical badges.
+    Does not commit.
+    """
+    rules = {r.badge_id: r for rules in rule_index().values() for r in rules}
+    result = {}
+    now = datetime.now(timezone.utc)
+    for rule in rules.values():
+        q = _qualifying_users(rule).subquery()
+        missing = select(q.c.user_id, literal(rule.badge_id).label('badge_id'), literal(now).label('earned_at')).where(
+            ~exists().where(UserBadge.user_id == q.c.user_id, UserBadge.badge_id == rule.badge_id))
+        if dry_run:
+            count = session.execute(select(func.count()).select_from(missing.subquery())).scalar_one()
+        else:
+            stmt = insert(UserBadge).from_select(['user_id', 'badge_id', 'earned_at'], missing)
+            count = session.execute(stmt).rowcount
+        result[rule.code] = count
+        if progress:
+            progress(f'  {rule.code}: {count} users')
+    if not dry_run and any(result.values()):
+        for namespace in profiles.PROFILE_CACHE_NAMESPACES:
+            cache.invalidate(namespace)
+    return result
@@ -0,0 +1,142 @@
+"""In-process read-through cache with TTL, explicit invalidation and hit/miss counters.
+
+Entries live in a bounded LRU keyed by (namespace, key). Writers invalidate what they
+change; the TTL bounds staleness for writes made by other processes, which this cache
+does not see. JSON payloads are cached pre-serialized together with an ETag so hits skip
+both the queries and the encoding, and clients can revalidate with If-None-Match.
+
+Every invalidation takes the next number of a sequence. A read-through load notes the
+sequence when it starts and its result is only stored if its key (or namespace) was not
+invalidated meanwhile, so a load that raced a write cannot put the stale payload back
+after the writer's invalidation.
+"""
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from flask import current_app, request
+
+_store = OrderedDict()  # (namespace, key) -> (expires_at, value)
+_counters = {}
+_lock = Lock()
+_seq = 0  # numbers invalidations
+# (namespace, key), or (namespace, None) for the whole namespace -> seq of its last invalidation
+_invalidated = OrderedDict()
+_forgotten = 0  # newest seq dropped from `_invalidated`
+MAX_INVALIDATIONS = 10000  # keys whose last invalidation is remembered
+
+
+def _count(namespace: str, field: str) -> None:
+    c = _counters.get(namespace)
+    if c is None:
+        c = _counters[namespace] = {'hits': 0, 'misses': 0, 'invalidations': 0, 'stale_loads': 0}
+    c[field] += 1
+
+
+def get(namespace: str, key):
+    """Return the cached value or None (counts a hit or miss)."""
+    now = monotonic()
+    with _lock:
+        entry = _store.get((namespace, key))
+        if entry is not None and entry[0] > now:
+            _store.move_to_end((namespace, key))
+            _count(namespace, 'hits')
+            return entry[1]
+        if entry is not None:
+            del _store[(namespace, key)]
+        _count(namespace, 'misses')
+        return None
+
+
+def _invalidated_since(namespace: str, key, since: int) -> bool:
+    return (_forgotten > since or _invalidated.get((namespace, key), 0) > since
+            or _invalidated.get((namespace, None), 0) > since)
+
+
+def put(namespace: str, key, value, ttl: float, since: int = None) -> None:
+    """Store `value`. With `since` (a `sequence()` taken before loading it) the put is
+    skipped if the key was invalidated after that point."""
+    max_entries = int(current_app.config.get('CACHE_MAX_ENTRIES', 10000))
+    with _lock:
+        if since is not None and _invalidated_since(namespace, key, since):
+            _count(namespace, 'stale_loads')
+            return
+        _store[(namespace, key)] = (monotonic() + ttl, value)
+        _store.move_to_end((namespace, key))
+        while len(_store) > max_entries:
+            _store.popitem(last=False)
+
+
+def sequence() -> int:
+    """The current invalidation number, to pass to `put(since=...)`."""
+    with _lock:
+        return _seq
+
+
+def get_or_load(namespace: str, key, loader, ttl: float):
+    """Read-through: return the cached value, or call `loader()` and cache its result
+    unless the key was invalidated while it ran."""
+    value = get(namespace, key)
+    if value is None:
+        since = sequence()
+        value = loader()
+        if value is not None:
+            put(namespace, key, value, ttl, since=since)
+    return value
+
+
+def invalidate(namespace: str, key=None) -> None:
+    """Drop one key, or the whole namespace when `key` is None."""
+    global _seq, _forgotten
+    with _lock:
+        if key is None:
+            for k in [k for k in _store if k[0] == namespace]:
+                del _store[k]
+        else:
+            _store.pop((namespace, key), None)
+        _seq += 1
+        _invalidated[(namespace, key)] = _seq
+        _invalidated.move_to_end((namespace, key))
+        while len(_invalidated) > MAX_INVALIDATIONS:
+            # loads that started before a forgotten invalidation are not stored
+            _forgotten = _invalidated.popitem(last=False)[1]
+        _count(namespace, 'invalidations')
+
+
+def stats() -> dict:
+    with _lock:
+        sizes = {}
+        for ns, _key in _store:
+            sizes[ns] = sizes.get(ns, 0) + 1
+        return {
+            'entries': len(_store),
+            'namespaces': {ns: {**c, 'size': sizes.get(ns, 0)} for ns, c in _counters.items()},
+        }
+
+
+def clear() -> None:
+    global _forgotten
+    with _lock:
+        _store.clear()
+        _counters.clear()
+        _invalidated.clear()
+        _forgotten = _seq
+
+
+def encode_json(payload) -> tuple:
+    """Serialize a payload once; returns (body bytes, etag) suitable for caching."""
+    body = current_app.json.dumps(payload).encode('utf-8') + b'\n'
+    return body, hashlib.sha1(body).hexdigest()
+
+
+def json_response(encoded, status: int = 200):
+    """Build a JSON response from encode_json() output, answering 304 when the client's
+    If-None-Match already has this ETag."""
+    body, etag = encoded
+    if status == 200 and request.if_none_match.contains(etag):
+        resp = current_app.response_class(status=304)
+    else:
+        resp = current_app.response_class(body, status=status, mimetype='application/json')
+    resp.set_etag(etag)
+    return resp
@@ -0,0 +1,122 @@
+"""Small dialect-aware SQL helpers shared by routes and scripts."""
+from sqlalchemy.exc import IntegrityError
+
+from backend.app import db
+
+
+def insert_ignore(model, values: dict, conflict_columns) -> bool:
+    """INSERT a row unless it violates the unique index on `conflict_columns`.
+
+    Uses INSERT ... ON CONFLICT DO NOTHING on PostgreSQL and SQLite so the check and the
+    insert are one atomic statement; other dialects fall back to a savepoint. Returns True
+    if a row was inserted. Does not commit.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        try:
+            with db.session.begin_nested():
+                db.session.add(model(**values))
+            return True
+        except IntegrityError:
+            return False
+    stmt = insert(model).values(**values).on_conflict_do_nothing(index_elements=list(conflict_columns))
+    return db.session.execute(stmt).rowcount == 1
+
+
+def upsert_increment(model, rows, conflict_columns, increment_columns) -> None:
+    """INSERT `rows`, adding `increment_columns` onto any existing row with the same
+    `conflict_columns` instead of failing.
+
+    PostgreSQL and SQLite get a single multi-row INSERT ... ON CONFLICT DO UPDATE; other
+    dialects lock and update (or insert) row by row. Does not commit.
+    """
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(model).values(rows)
+        table = model.__table__
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(conflict_columns),
+            set_={c: table.c[c] + stmt.excluded[c] for c in increment_columns},
+        )
+        db.session.execute(stmt)
+        return
+    from sqlalchemy import select
+    for values in rows:
+        match = [getattr(model, c) == values[c] for c in conflict_columns]
+        existing = db.session.execute(select(model).where(*match).with_for_update()).scalar_one_or_none()
+        if existing is None:
+            db.session.add(model(**values))
+            db.session.flush()
+        else:
+            for c in increment_columns:
+                setattr(existing, c, getattr(existing, c) + values[c])
+
+
+def insert_ignore_many(model, rows, conflict_columns) -> list:
+    """Multi-row insert_ignore. Returns the `conflict_columns` tuples actually inserted.
+
+    PostgreSQL and SQLite use one INSERT ... ON CONFLICT DO NOTHING RETURNING statement;
+    other dialects insert row by row inside savepoints. Does not commit.
+    """
+    if not rows:
+        return []
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        table = model.__table__
+        stmt = (
+            insert(model).values(rows)
+            .on_conflict_do_nothing(index_elements=list(conflict_columns))
+            .returning(*[table.c[c] for c in conflict_columns])
+        )
+        return [tuple(r) for r in db.session.execute(stmt)]
+    inserted = []
+    for values in rows:
+        if insert_ignore(model, values, conflict_columns):
+            inserted.append(tuple(values[c] for c in conflict_columns))
+    return inserted
+
+
+def upsert_returning(model, values: dict, conflict_columns, update_columns=(), returning=('id',)):
+    """INSERT a row or, if one with the same `conflict_columns` exists, update
+    `update_columns` on it; returns the `returning` columns of the resulting row.
+
+    One INSERT ... ON CONFLICT DO UPDATE ... RETURNING on PostgreSQL and SQLite (with no
+    `update_columns` the update is a no-op that only makes the row visible to RETURNING);
+    other dialects lock and update, or insert, the row. Does not commit.
+    """
+    dialect = db.session.get_bind().dialect.name
+    table = model.__table__
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(model).values(**values)
+        set_ = {c: stmt.excluded[c] for c in (update_columns or list(conflict_columns)[:1])}
+        stmt = stmt.on_conflict_do_update(index_elements=list(conflict_columns), set_=set_)
+        return tuple(db.session.execute(stmt.returning(*[table.c[c] for c in returning])).one())
+    from sqlalchemy import select
+    match = [getattr(model, c) == values[c] for c in conflict_columns]
+    row = db.session.execute(select(model).where(*match).with_for_update()).scalar_one_or_none()
+    if row is None:
+        row = model(**values)
+        db.session.add(row)
+    else:
+        for c in update_columns:
+            setattr(row, c, values[c])
+    db.session.flush()
+    return tuple(getattr(row, c) for c in returning)
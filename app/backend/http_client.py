@@ -0,0 +1,67 @@
+"""Shared client for outbound HTTP calls (GitHub OAuth today).
+
+One `requests.Session` per process keeps up to HTTP_POOL_SIZE connections per host alive,
+so calls skip the TCP and TLS handshakes. Every request gets a (connect, read) timeout of
+HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT seconds unless the caller passes one, so a slow
+upstream cannot hold a web worker indefinitely.
+
+Failed connections are retried up to HTTP_RETRIES times for any method; nothing has
+been sent yet, so this is safe. Read errors and 502/503/504 responses are retried for
+idempotent methods only. Between attempts the client backs off exponentially from
+HTTP_BACKOFF_SECONDS, with random jitter so clients do not retry in lockstep.
+
+`requests` is imported when the session is first built, not at app start-up.
+"""
+import threading
+
+from flask import current_app
+
+_session = None
+_lock = threading.Lock()
+
+
+def _retry(retries: int, backoff: float):
+    from urllib3.util.retry import Retry
+    options = dict(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                   status_forcelist=(502, 503, 504), allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS'}),
+                   raise_on_status=False)
+    try:
+        return Retry(backoff_jitter=backoff, **options)
+    except TypeError:
+        # urllib3 < 2 has no jitter
+        return Retry(**options)
+
+
+def get_session():
+    """The shared `requests.Session`."""
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            cfg = current_app.config
+            size = int(cfg.get('HTTP_POOL_SIZE', 10))
+            adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size,
+                                  max_retries=_retry(int(cfg.get('HTTP_RETRIES', 2)),
+                                                     float(cfg.get('HTTP_BACKOFF_SECONDS', 0.2))))
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def request(method: str, url: str, **kwargs):
+    """`requests.request` on the shared session with the default timeouts."""
+    cfg = current_app.config
+    kwargs.setdefault('timeout', (float(cfg.get('HTTP_CONNECT_TIMEOUT', 3.05)), float(cfg.get('HTTP_READ_TIMEOUT', 10))))
+    return get_session().request(method, url, **kwargs)
+
+
+def reset() -> None:
+    """Close the shared session; the next request builds one from the current config."""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
@@ -0,0 +1,160 @@
+"""Asynchronous XP ingestion with write-behind user totals.
+
+In the default synchronous mode every award locks its user row (SELECT ... FOR UPDATE)
+until commit, so concurrent awards to one hot user serialize on that lock. With
+XP_INGEST_MODE = 'async' an award only inserts its XPEvent with `pending = true` and
+answers 202; the insert is durable and still deduplicated by the xp_events unique
+constraints, and no user row is locked.
+
+A consumer then folds pending events into `users.xp_total` / `level` (and the XP
+rollups) in micro-batches of up to XP_INGEST_BATCH_SIZE events: the users in a batch are
+locked once, in id order, and updated with one UPDATE per user however many of their
+events the batch holds. By default the consumer is a daemon thread started by the first
+async award in each process and woken as soon as an event is queued; set
+XP_INGEST_CONSUMER = 'external' to run `scripts/xp_ingest_consumer.py` instead. On
+PostgreSQL several consumers can run side by side (FOR UPDATE SKIP LOCKED).
+
+XP_INGEST_READ_YOUR_WRITES (default True) makes the 202 response include the awarding
+user's projected totals: the committed xp_total plus their still-pending events.
+"""
+import time
+from collections import defaultdict
+from threading import Event, Lock, Thread
+from types import SimpleNamespace
+
+from flask import current_app
+from sqlalchemy import bindparam, func, select, update
+
+from backend import badge_rules, leaderboard, outbox, profiles, rollups
+from backend.app import db
+from backend.models import User, XPEvent
+from backend.schemas import compute_levels
+
+# set by enqueue() so the in-process consumer picks new events up without waiting for a poll
+_wake = Event()
+_consumer = None
+_lock = Lock()
+
+
+def enabled() -> bool:
+    return current_app.config.get('XP_INGEST_MODE', 'sync') == 'async'
+
+
+def enqueue(user_id: int, amount: int, source=None, source_id=None, meta=None, idempotency_key=None):
+    """Durably queue one XP event and commit; returns its id. Raises IntegrityError on a
+    duplicate key."""
+    event = XPEvent(user_id=user_id, amount=amount, source=source, source_id=source_id, meta=meta,
+                    idempotency_key=idempotency_key, pending=True)
+    db.session.add(event)
+    db.session.flush()
+    event_id = event.id
+    db.session.commit()
+    _wake.set()
+    return event_id
+
+
+def projected_total(user) -> int:
+    """The user's committed xp_total plus XP from their events not yet applied."""
+    pending = db.session.execute(
+        select(func.coalesce(func.sum(XPEvent.amount), 0)).where(XPEvent.pending.is_(True), XPEvent.user_id == user.id)
+    ).scalar_one()
+    return (user.xp_total or 0) + int(pending)
+
+
+def read_your_writes() -> bool:
+    return bool(current_app.config.get('XP_INGEST_READ_YOUR_WRITES', True))
+
+
+def apply_pending(session, limit: int = None) -> int:
+    """Fold up to `limit` pending events into user totals in one transaction.
+
+    Returns the number of events applied (0 when nothing is pending).
+    """
+    limit = limit or int(current_app.config.get('XP_INGEST_BATCH_SIZE', 500))
+    stmt = select(XPEvent).where(XPEvent.pending.is_(True)).order_by(XPEvent.id).limit(limit)
+    if session.get_bind().dialect.name == 'postgresql':
+        # concurrent consumers take disjoint batches instead of queueing behind each other
+        stmt = stmt.with_for_update(skip_locked=True)
+    events = session.execute(stmt).scalars().all()
+    if not events:
+        session.rollback()
+        return 0
+
+    deltas = defaultdict(int)
+    for e in events:
+        deltas[e.user_id] += e.amount
+    users = session.execute(
+        select(User).where(User.id.in_(sorted(deltas))).order_by(User.id).with_for_update()
+    ).scalars().all()
+    totals = [(u.xp_total or 0) + deltas[u.id] for u in users]
+    applied = [SimpleNamespace(id=u.id, display_name=u.display_name, xp_total=total, level=level)
+               for u, total, level in zip(users, totals, compute_levels(totals))]
+    # one UPDATE per user per batch, sent as a single executemany
+    session.execute(
+        update(User.__table__).where(User.__table__.c.id == bindparam('uid')),
+        [{'uid': u.id, 'xp_total': u.xp_total, 'level': u.level} for u in applied],
+    )
+    session.execute(
+        update(XPEvent).where(XPEvent.id.in_([e.id for e in events])).values(pending=False),
+        execution_options={'synchronize_session': False},
+    )
+    rollups.record_events(events)
+    by_id = {u.id: (u, old) for u, old in zip(applied, users)}
+    for e in events:
+        u, old = by_id[e.user_id]
+        outbox.emit('xp.awarded', e.user_id, {
+            'user_id': e.user_id, 'amount': e.amount, 'source': e.source, 'source_id': e.source_id,
+            'idempotency_key': e.idempotency_key, 'new_xp': u.xp_total, 'new_level': u.level,
+            'leveled_up': u.level > (old.level or 1),
+        })
+    badge_rules.evaluate([('xp.awarded', e.user_id, {'xp_total': by_id[e.user_id][0].xp_total, 'source': e.source})
+                          for e in events])
+    session.commit()
+
+    leaderboard.record_users(applied)
+    for u in applied:
+        profiles.invalidate_user(u.id)
+    return len(events)
+
+
+def drain(session, limit: int = None) -> int:
+    """Apply micro-batches until nothing is pending. Returns the number of events applied."""
+    applied = 0
+    while True:
+        n = apply_pending(session, limit)
+        applied += n
+        if n == 0:
+            return applied
+
+
+def run_consumer(app, stop: Event = None) -> None:
+    """Consumer loop: wait for a wake-up (or XP_INGEST_POLL_SECONDS, for events queued by
+    other processes), linger briefly so a burst lands in one batch, then drain."""
+    with app.app_context():
+        poll = float(app.config.get('XP_INGEST_POLL_SECONDS', 1))
+        linger = float(app.config.get('XP_INGEST_LINGER_SECONDS', 0.005))
+        while stop is None or not stop.is_set():
+            _wake.wait(poll)
+            _wake.clear()
+            if linger:
+                time.sleep(linger)
+            try:
+                drain(db.session)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('xp ingest consumer failed')
+                time.sleep(poll)
+            finally:
+                db.session.remove()
+
+
+def ensure_started(app) -> None:
+    """Start the in-process consumer thread unless XP_INGEST_CONSUMER is 'external'."""
+    global _consumer
+    if app.config.get('XP_INGEST_CONSUMER', 'thread') != 'thread':
+        return
+    with _lock:
+        if _consumer is not None and _consumer.is_alive():
+            return
+        _consumer = Thread(target=run_consumer, args=(app,), name='xp-ingest', daemon=True)
+        _consumer.start()
@@ -0,0 +1,123 @@
+"""Incrementally persisted job output.
+
+The worker streams a job's stdout through an OutputWriter, which stores it as numbered
+rows in `job_output_chunks` (at most JOB_OUTPUT_CHUNK_BYTES each, flushed at least every
+JOB_OUTPUT_FLUSH_SECONDS while the job runs). Output beyond JOB_OUTPUT_MAX_BYTES is
+dropped after a truncation marker chunk, so a noisy job never sits fully in worker
+memory or in one huge row. `JobRecord.output` keeps only the last
+JOB_OUTPUT_PREVIEW_BYTES as a preview.
+
+Clients read new output with `GET /api/v1/jobs/<id>/output?after=<seq>` or tail it over
+SSE; both are a primary-key range scan on (job_id, seq).
+"""
+import codecs
+import time
+
+from sqlalchemy import select
+
+from backend.models import JobOutputChunk
+
+DEFAULT_CHUNK_BYTES = 16 * 1024
+DEFAULT_MAX_BYTES = 1024 * 1024
+DEFAULT_PREVIEW_BYTES = 4096
+DEFAULT_FLUSH_SECONDS = 0.5
+
+
+def _cut(data: bytes, n: int) -> int:
+    """Largest cut point <= n that does not split a UTF-8 sequence."""
+    if n >= len(data):
+        return len(data)
+    while n > 0 and (data[n] & 0xC0) == 0x80:
+        n -= 1
+    return n
+
+
+class OutputWriter:
+    """Buffer output for one job and write it as sequenced chunks. Commits on each flush."""
+
+    def __init__(self, session, job_id: int, chunk_bytes: int = DEFAULT_CHUNK_BYTES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 preview_bytes: int = DEFAULT_PREVIEW_BYTES, flush_seconds: float = DEFAULT_FLUSH_SECONDS):
+        self.session = session
+        self.job_id = job_id
+        self.chunk_bytes = chunk_bytes
+        self.max_bytes = max_bytes
+        self.preview_bytes = preview_bytes
+        self.flush_seconds = flush_seconds
+        self.seq = 0
+        self.total_bytes = 0   # bytes produced by the job, including dropped ones
+        self.stored_bytes = 0
+        self.truncated = False
+        self._buf = []
+        self._buf_bytes = 0
+        self._tail = b''
+        self._last_flush = time.monotonic()
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def write_bytes(self, data: bytes) -> None:
+        self.write(self._decoder.decode(data))
+
+    def write(self, text: str) -> None:
+        if not text:
+            return
+        data = text.encode('utf-8')
+        self.total_bytes += len(data)
+        self._tail = (self._tail + data)[-self.preview_bytes:]
+        if self.truncated:
+            return
+        room = self.max_bytes - self.stored_bytes - self._buf_bytes
+        if len(data) > room:
+            data = data[:_cut(data, max(room, 0))]
+            self.truncated = True
+        while data:
+            take = data[:_cut(data, self.chunk_bytes - self._buf_bytes)]
+            if not take:
+                # not even one character fits: close this chunk and retry in an empty one
+                self._flush_buffer()
+                continue
+            data = data[len(take):]
+            self._buf.append(take)
+            self._buf_bytes += len(take)
+            if self._buf_bytes >= self.chunk_bytes:
+                self._flush_buffer()
+        if self.truncated:
+            self._flush_buffer()
+            self._add(f'\n[output truncated at {self.max_bytes} bytes]\n'.encode('utf-8'))
+            self.session.commit()
+        elif time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def _add(self, data: bytes) -> None:
+        self.seq += 1
+        self.session.add(JobOutputChunk(job_id=self.job_id, seq=self.seq, data=data.decode('utf-8', errors='replace')))
+
+    def _flush_buffer(self) -> None:
+        if self._buf:
+            data = b''.join(self._buf)
+            self._add(data)
+            self.stored_bytes += len(data)
+            self._buf = []
+            self._buf_bytes = 0
+
+    def flush(self) -> None:
+        self._flush_buffer()
+        self.session.commit()
+        self._last_flush = time.monotonic()
+
+    def close(self) -> str:
+        """Flush what is left; returns the preview (tail) for JobRecord.output. Does not commit
+        the preview, so the caller can store it together with the final status."""
+        self.write(self._decoder.decode(b'', final=True))
+        self._flush_buffer()
+        preview = self._tail.decode('utf-8', errors='ignore')
+        if self.truncated:
+            preview += f'\n[output truncated at {self.max_bytes} bytes; {self.total_bytes} bytes produced]'
+        return preview
+
+
+def read_chunks(session, job_id: int, after: int = 0, limit: int = 100):
+    return session.execute(
+        select(JobOutputChunk.seq, JobOutputChunk.data)
+        .where(JobOutputChunk.job_id == job_id, JobOutputChunk.seq > after)
+        .order_by(JobOutputChunk.seq)
+        .limit(limit)
+    ).all()
@@ -0,0 +1,460 @@
+"""Ranked leaderboard index.
+
+Keeps users ordered by (xp desc, user_id desc) so top-N pages, cursor pagination and
+"what rank is user X" are answered without querying the `users` table. Writers call
+`record_user` after committing an XP change. Once the last refresh is older than
+LEADERBOARD_REFRESH_SECONDS (default 60, 0 disables) a background thread rebuilds the
+index from `users` with one bulk scan, so changes made by other processes (other web
+workers, scripts, the ingest consumer) show up within that bound without a request
+thread paying for the scan.
+
+When `REDIS_URL` is configured (or LEADERBOARD_BACKEND=redis) a Redis sorted set is the
+shared index for all processes. One process per refresh interval rebuilds it (the
+`built` marker expires) into scratch keys and swaps them in atomically; users written
+to the live set meanwhile are recorded in a `touched` set and carried over by the swap,
+so the rebuild never reverts a newer write. Users whose Redis write failed, or was
+skipped while `redis_client` backed off, are re-sent from the in-process index on a
+later call. In Redis mode the in-process index only holds this process's writes until a
+call has to fall back to it (Redis unavailable, mirroring `rate_limiter`); it is then
+loaded from `users` and refreshed like the memory backend.
+"""
+import base64
+import json
+from bisect import bisect_left, bisect_right, insort
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from flask import current_app
+from sqlalchemy import select
+
+from backend import redis_client
+
+# in-process index: _keys is sorted by (-xp, -user_id); _entries maps user_id -> row data
+_keys = []
+_entries = {}
+_built = False
+_built_at = 0.0  # when the in-process index was last loaded from `users`
+_refreshed_at = 0.0  # when the last refresh (of whichever index is in use) finished
+_refreshing = False
+_lock = Lock()
+_build_lock = Lock()  # one scan of `users` into the in-process index at a time
+# while that scan runs: ids recorded meanwhile, whose entries are newer than their rows
+_scan_writes = None
+# user ids whose latest row has not reached the Redis set yet
+_redis_dirty = set()
+
+# set whenever a write lands so listeners (the SSE broadcaster) can recompute without
+# polling; writes from other processes arrive through `changes_channel`
+changed = Event()
+
+# zero-padded members make Redis' reverse-lexicographic tie order match user_id desc
+_MEMBER_WIDTH = 12
+
+
+def _member(user_id: int) -> str:
+    return str(user_id).zfill(_MEMBER_WIDTH)
+
+
+def _key(xp: int, user_id: int):
+    return (-xp, -user_id)
+
+
+def encode_cursor(xp: int, user_id: int) -> str:
+    return base64.urlsafe_b64encode(f'{xp}:{user_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """Return (xp, user_id) for an opaque cursor, raising ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        xp, user_id = raw.split(':')
+        return int(xp), int(user_id)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def _redis_enabled() -> bool:
+    backend = current_app.config.get('LEADERBOARD_BACKEND')
+    if backend == 'memory' or (backend != 'redis' and not current_app.config.get('REDIS_URL')):
+        return False
+    return redis_client.available()
+
+
+def _get_redis():
+    """Return the shared Redis client when the Redis backend is enabled, else None.
+
+    Also None while `redis_client` backs off after a failed call (from any caller)."""
+    if not _redis_enabled():
+        return None
+    return redis_client.get_redis(current_app.config.get('REDIS_URL'))
+
+
+def _redis_failed() -> None:
+    """Back off the shared client after an error, as `rate_limiter` does, so the calls
+    that follow use the in-process index instead of each waiting out the socket timeout."""
+    redis_client.mark_failed(current_app.config.get('REDIS_URL'),
+                             float(current_app.config.get('RATE_LIMIT_REDIS_BACKOFF_SECONDS', 5)))
+
+
+def _redis_keys():
+    prefix = current_app.config.get('LEADERBOARD_REDIS_KEY', 'leaderboard')
+    return f'{prefix}:z', f'{prefix}:meta', f'{prefix}:built', f'{prefix}:touched'
+
+
+def changes_channel() -> str:
+    """Redis pub/sub channel every write to the shared set is announced on, so processes
+    serving the live stream hear about writes made elsewhere (see leaderboard_stream)."""
+    return current_app.config.get('LEADERBOARD_REDIS_KEY', 'leaderboard') + ':changes'
+
+
+# --- in-process index -------------------------------------------------------
+
+def _memory_set(user_id: int, xp: int, display_name, level) -> None:
+    old = _entries.get(user_id)
+    if old is not None:
+        i = bisect_left(_keys, _key(old['xp'], user_id))
+        if i < len(_keys) and _keys[i] == _key(old['xp'], user_id):
+            del _keys[i]
+    _entries[user_id] = {'xp': xp, 'display_name': display_name, 'level': level}
+    insort(_keys, _key(xp, user_id))
+
+
+def _memory_row(rank: int, key) -> dict:
+    user_id = -key[1]
+    e = _entries[user_id]
+    return {'rank': rank, 'user_id': user_id, 'display_name': e['display_name'], 'xp': e['xp'], 'level': e['level']}
+
+
+def _memory_page(limit: int, after):
+    with _lock:
+        start = bisect_right(_keys, _key(*after)) if after else 0
+        return [_memory_row(start + i + 1, k) for i, k in enumerate(_keys[start:start + limit])]
+
+
+def _memory_rank(user_id: int, neighbours: int):
+    with _lock:
+        e = _entries.get(user_id)
+        if e is None:
+            return None
+        pos = bisect_left(_keys, _key(e['xp'], user_id))
+        lo = max(0, pos - neighbours)
+        rows = [_memory_row(lo + i + 1, k) for i, k in enumerate(_keys[lo:pos + neighbours + 1])]
+        return pos + 1, rows
+
+
+# --- Redis sorted set ---------------------------------------------------------
+
+def _redis_row(rank: int, member, score, meta) -> dict:
+    user_id = int(member)
+    info = json.loads(meta) if meta else {}
+    return {'rank': rank, 'user_id': user_id, 'display_name': info.get('display_name'),
+            'xp': int(score), 'level': info.get('level')}
+
+
+def _redis_rows(r, start: int, stop: int):
+    zkey, hkey, _, _ = _redis_keys()
+    members = r.zrevrange(zkey, start, stop, withscores=True)
+    if not members:
+        return []
+    metas = r.hmget(hkey, [m for m, _s in members])
+    return [_redis_row(start + i + 1, m, s, meta) for i, ((m, s), meta) in enumerate(zip(members, metas))]
+
+
+def _redis_page(r, limit: int, after):
+    zkey, _, _, _ = _redis_keys()
+    start = 0
+    if after:
+        xp, user_id = after
+        pipe = r.pipeline()
+        pipe.zscore(zkey, _member(user_id))
+        pipe.zrevrank(zkey, _member(user_id))
+        score, rank = pipe.execute()
+        if score is not None and int(score) == xp:
+            start = rank + 1
+        else:
+            # the anchor moved since the cursor was issued: resume after everyone above its old score
+            start = r.zcount(zkey, f'({xp}', '+inf')
+    return _redis_rows(r, start, start + limit - 1)
+
+
+def _redis_rank(r, user_id: int, neighbours: int):
+    zkey, _, _, _ = _redis_keys()
+    pos = r.zrevrank(zkey, _member(user_id))
+    if pos is None:
+        return None
+    lo = max(0, pos - neighbours)
+    return pos + 1, _redis_rows(r, lo, pos + neighbours)
+
+
+def _redis_set_many(r, rows, zkey: str = None, hkey: str = None) -> None:
+    """Write rows to the live set (and mark them touched for `_rebuild_shared`), or to
+    the given scratch keys."""
+    touched = None
+    if zkey is None:
+        zkey, hkey, _, touched = _redis_keys()
+    pipe = r.pipeline(transaction=False)
+    for user_id, xp, display_name, level in rows:
+        pipe.zadd(zkey, {_member(user_id): xp})
+        pipe.hset(hkey, _member(user_id), json.dumps({'display_name': display_name, 'level': level}))
+    if touched and rows:
+        pipe.sadd(touched, *[_member(row[0]) for row in rows])
+        pipe.publish(changes_channel(), len(rows))
+    pipe.execute()
+
+
+# Swaps the rebuilt scratch keys in. Members written to the live set since the rebuild
+# started (the `touched` set) are newer than their scanned rows, so their live score and
+# meta are copied over first; being one script, no write can land in between.
+# KEYS: live zset, live meta, scratch zset, scratch meta, touched, built marker
+# ARGV: marker ttl, changes channel
+_SWAP_LUA = """
+for _, m in ipairs(redis.call('SMEMBERS', KEYS[5])) do
+  local score = redis.call('ZSCORE', KEYS[1], m)
+  if score then
+    redis.call('ZADD', KEYS[3], score, m)
+    local meta = redis.call('HGET', KEYS[2], m)
+    if meta then redis.call('HSET', KEYS[4], m, meta) end
+  end
+end
+for i = 1, 2 do
+  if redis.call('EXISTS', KEYS[i + 2]) == 1 then
+    redis.call('RENAME', KEYS[i + 2], KEYS[i])
+  else
+    redis.call('DEL', KEYS[i])
+  end
+end
+redis.call('DEL', KEYS[5])
+if tonumber(ARGV[1]) > 0 then
+  redis.call('SET', KEYS[6], 1, 'EX', ARGV[1])
+else
+  redis.call('SET', KEYS[6], 1)
+end
+redis.call('PUBLISH', ARGV[2], 0)
+return 1
+"""
+
+
+# --- public API ---------------------------------------------------------------
+
+def _scan_users(session):
+    from backend.models import User
+    stmt = select(User.id, User.xp_total, User.display_name, User.level)
+    return [(r.id, r.xp_total or 0, r.display_name, r.level or 1) for r in session.execute(stmt)]
+
+
+def _refresh_seconds() -> float:
+    return float(current_app.config.get('LEADERBOARD_REFRESH_SECONDS', 60))
+
+
+def _load_memory(session, max_age: float = None) -> int:
+    """(Re)load the in-process index with one scan of `users`. Skipped when another thread
+    loaded it less than `max_age` seconds ago. Entries recorded while the scan ran are
+    newer than their scanned rows and are kept."""
+    global _built, _built_at, _refreshed_at, _scan_writes
+    with _build_lock:
+        with _lock:
+            if max_age is not None and _built and monotonic() - _built_at < max_age:
+                return len(_entries)
+            _scan_writes = set()
+        try:
+            rows = _scan_users(session)
+        finally:
+            with _lock:
+                written, _scan_writes = _scan_writes, None
+        with _lock:
+            kept = {uid: _entries[uid] for uid in written if uid in _entries}
+            _entries.clear()
+            for user_id, xp, display_name, level in rows:
+                _entries[user_id] = {'xp': xp, 'display_name': display_name, 'level': level}
+            _entries.update(kept)
+            _keys[:] = sorted(_key(e['xp'], uid) for uid, e in _entries.items())
+            _built = True
+            _built_at = _refreshed_at = monotonic()
+    return len(rows)
+
+
+def _ensure_memory() -> None:
+    """Load the in-process index the first time a call has to be answered from it."""
+    if not _built:
+        from backend.app import db
+        _load_memory(db.session, max_age=float('inf'))
+
+
+def _rebuild_shared(session, r) -> int:
+    zkey, hkey, built_key, touched = _redis_keys()
+    # fill scratch keys and swap them in, so readers never see a partial set
+    tmp_z, tmp_h = f'{zkey}:rebuild', f'{hkey}:rebuild'
+    # cleared before the scan: whatever is written from here on may be missing from it
+    r.delete(tmp_z, tmp_h, touched)
+    with _lock:
+        failed_before = set(_redis_dirty)
+    rows = _scan_users(session)
+    chunk = int(current_app.config.get('LEADERBOARD_REBUILD_CHUNK', 5000))
+    for i in range(0, len(rows), chunk):
+        _redis_set_many(r, rows[i:i + chunk], tmp_z, tmp_h)
+    r.eval(_SWAP_LUA, 6, zkey, hkey, tmp_z, tmp_h, touched, built_key, int(_refresh_seconds()), changes_channel())
+    with _lock:
+        # committed before the scan started, so the scan carried them
+        _redis_dirty.difference_update(failed_before)
+    return len(rows)
+
+
+def rebuild(session) -> int:
+    """Rebuild the index from `users` with a single bulk scan. Returns the row count.
+
+    With Redis in use only the shared set is rebuilt: the in-process index is then just
+    the fallback, loaded when first needed. Otherwise (or if Redis fails) the in-process
+    index is reloaded.
+    """
+    r = _get_redis()
+    if r is not None:
+        try:
+            return _rebuild_shared(session, r)
+        except Exception:
+            _redis_failed()
+            current_app.logger.exception('failed to rebuild Redis leaderboard; using in-process index')
+    return _load_memory(session)
+
+
+def _refresh(app) -> None:
+    """Background refresh started by `_ensure_built`."""
+    global _refreshing, _refreshed_at
+    from backend.app import db
+    with app.app_context():
+        try:
+            r = _get_redis()
+            if r is None:
+                _load_memory(db.session, max_age=_refresh_seconds())
+            else:
+                # the first process to find the marker expired rebuilds the shared set
+                try:
+                    claimed = r.set(_redis_keys()[2], 1, nx=True, ex=int(_refresh_seconds()) or None)
+                except Exception:
+                    _redis_failed()
+                    claimed = False
+                if claimed:
+                    rebuild(db.session)
+        except Exception:
+            app.logger.exception('leaderboard refresh failed')
+        finally:
+            db.session.remove()
+            with _lock:
+                _refreshing = False
+                _refreshed_at = monotonic()
+
+
+def _resync_redis(r) -> None:
+    """Re-send users whose earlier Redis write failed, from the in-process index."""
+    with _lock:
+        ids = list(_redis_dirty)
+        _redis_dirty.clear()
+        rows = [(uid, e['xp'], e['display_name'], e['level']) for uid, e in
+                ((uid, _entries.get(uid)) for uid in ids) if e is not None]
+    try:
+        _redis_set_many(r, rows)
+    except Exception:
+        with _lock:
+            _redis_dirty.update(ids)
+        raise
+
+
+def _ensure_built() -> None:
+    """Upkeep run by every read and write, off the request's critical path: the
+    in-process index is loaded on first use when it is the index in use, a refresh is
+    started in the background once the last one is older than
+    LEADERBOARD_REFRESH_SECONDS, and failed Redis writes are replayed."""
+    global _refreshing
+    if _get_redis() is None:
+        _ensure_memory()
+    refresh = _refresh_seconds()
+    with _lock:
+        due = bool(refresh) and not _refreshing and monotonic() - _refreshed_at >= refresh
+        if due:
+            _refreshing = True
+        dirty = bool(_redis_dirty)
+    if due:
+        Thread(target=_refresh, args=(current_app._get_current_object(),),
+                         name='leaderboard-refresh', daemon=True).start()
+    if dirty:
+        try:
+            r = _get_redis()
+            if r is not None:
+                _resync_redis(r)
+        except Exception:
+            _redis_failed()
+            current_app.logger.exception('failed to resync Redis leaderboard')
+
+
+def record_user(user) -> None:
+    """Record a user's committed xp_total/level. Call after the transaction commits."""
+    record_users([user])
+
+
+def record_users(users) -> None:
+    _ensure_built()
+    rows = [(u.id, u.xp_total or 0, u.display_name, u.level or 1) for u in users]
+    with _lock:
+        for user_id, xp, display_name, level in rows:
+            _memory_set(user_id, xp, display_name, level)
+        if _scan_writes is not None:
+            _scan_writes.update(row[0] for row in rows)
+    try:
+        r = _get_redis()
+        if r is not None:
+            _redis_set_many(r, rows)
+        elif _redis_enabled():
+            # backing off: replayed by `_ensure_built` once a client is handed out again
+            with _lock:
+                _redis_dirty.update(row[0] for row in rows)
+    except Exception:
+        with _lock:
+            _redis_dirty.update(row[0] for row in rows)
+        _redis_failed()
+        current_app.logger.exception('failed to update Redis leaderboard; will resync')
+    changed.set()
+
+
+def top(limit: int, cursor: str = None):
+    """Return (rows, next_cursor) for one page of the leaderboard."""
+    _ensure_built()
+    after = decode_cursor(cursor) if cursor else None
+    rows = None
+    try:
+        r = _get_redis()
+        if r is not None:
+            rows = _redis_page(r, limit, after)
+    except Exception:
+        _redis_failed()
+        rows = None
+    if rows is None:
+        _ensure_memory()
+        rows = _memory_page(limit, after)
+    next_cursor = encode_cursor(rows[-1]['xp'], rows[-1]['user_id']) if len(rows) == limit else None
+    return rows, next_cursor
+
+
+def rank(user_id: int, neighbours: int = 0):
+    """Return (rank, rows) where rows are the user and up to `neighbours` on each side.
+
+    Returns None if the user is not in the index.
+    """
+    _ensure_built()
+    try:
+        r = _get_redis()
+        if r is not None:
+            return _redis_rank(r, user_id, neighbours)
+    except Exception:
+        _redis_failed()
+    _ensure_memory()
+    return _memory_rank(user_id, neighbours)
+
+
+def reset() -> None:
+    """Drop the in-process index so the next call rebuilds it (used by tests and scripts)."""
+    global _built, _refreshed_at
+    with _lock:
+        _keys.clear()
+        _entries.clear()
+        _redis_dirty.clear()
+        _built = False
+        _refreshed_at = 0.0
@@ -0,0 +1,134 @@
+"""Shared SSE fan-out for the live leaderboard.
+
+One producer thread per process recomputes the top rows from the leaderboard index when
+it changes (or at the latest every LEADERBOARD_STREAM_POLL_SECONDS) and encodes a single
+SSE frame. With the Redis backend a listener thread subscribes to the leaderboard's
+changes channel, so writes made by other processes (the web workers, for the `stream`
+serve role) wake the producer as promptly as local ones. Every subscriber yields that same
+pre-encoded frame, so the work done per change is constant no matter how many clients are
+connected, and the database is never queried by the stream.
+
+Each frame carries the full snapshot, so resuming with `Last-Event-ID` only needs to know
+whether the client already has the latest frame. Frame ids include a per-process epoch so
+ids from before a restart never match.
+"""
+import json
+import time
+from threading import Condition, Thread
+
+from backend import leaderboard
+
+HEARTBEAT_FRAME = b': heartbeat\n\n'
+
+_cond = Condition()
+_epoch = format(int(time.time()), 'x')
+_seq = 0
+_latest_id = None
+_latest_frame = None
+_subscribers = 0
+_producer = None
+_listener = None
+
+
+def _encode(event_id: str, payload: str) -> bytes:
+    return f'id: {event_id}\nevent: leaderboard\ndata: {payload}\n\n'.encode('utf-8')
+
+
+def publish(payload: str) -> str:
+    """Store a new snapshot frame and wake all subscribers. Returns the frame id."""
+    global _seq, _latest_id, _latest_frame
+    with _cond:
+        _seq += 1
+        _latest_id = f'{_epoch}-{_seq}'
+        _latest_frame = _encode(_latest_id, payload)
+        _cond.notify_all()
+        return _latest_id
+
+
+def _run_producer(app) -> None:
+    from backend.app import db
+    with app.app_context():
+        size = int(app.config.get('LEADERBOARD_STREAM_SIZE', 50))
+        poll = float(app.config.get('LEADERBOARD_STREAM_POLL_SECONDS', 2))
+        last_payload = None
+        while True:
+            leaderboard.changed.clear()
+            try:
+                rows, _cursor = leaderboard.top(size)
+                payload = json.dumps({'rows': rows})
+                if payload != last_payload:
+                    publish(payload)
+                    last_payload = payload
+            except Exception:
+                app.logger.exception('leaderboard stream producer failed')
+            finally:
+                # the index only touches the DB on its first build; release that connection
+                db.session.remove()
+            leaderboard.changed.wait(poll)
+
+
+def _run_listener(app, stop=None) -> None:
+    """Set `leaderboard.changed` for every write announced on the Redis changes channel,
+    until `stop` is set. Returns at once when the leaderboard does not use Redis."""
+    with app.app_context():
+        poll = float(app.config.get('LEADERBOARD_STREAM_POLL_SECONDS', 2))
+        if not leaderboard._redis_enabled():
+            return
+        while not (stop and stop.is_set()):
+            r = leaderboard._get_redis()
+            if r is None:
+                # backing off; the producer's poll covers the gap
+                time.sleep(poll)
+                continue
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(leaderboard.changes_channel())
+                while not (stop and stop.is_set()):
+                    if pubsub.get_message(timeout=poll) is not None:
+                        leaderboard.changed.set()
+            except Exception:
+                leaderboard._redis_failed()
+                app.logger.warning('leaderboard changes subscription failed; retrying', exc_info=True)
+            finally:
+                pubsub.close()
+
+
+def ensure_started(app) -> None:
+    """Start the per-process producer (and changes listener) threads if not running yet."""
+    global _producer, _listener
+    with _cond:
+        if _producer is None or not _producer.is_alive():
+            _producer = Thread(target=_run_producer, args=(app,), name='leaderboard-stream', daemon=True)
+            _producer.start()
+        if _listener is None:
+            _listener = Thread(target=_run_listener, args=(app,), name='leaderboard-changes', daemon=True)
+            _listener.start()
+
+
+def subscriber_count() -> int:
+    return _subscribers
+
+
+def subscribe(last_event_id: str = None, heartbeat: float = 15.0):
+    """Yield SSE frames for one client: the latest snapshot, then each change, with
+    heartbeat comments while idle. Skips the initial snapshot if the client's
+    `last_event_id` is already the latest frame."""
+    global _subscribers
+    seen = last_event_id
+    with _cond:
+        _subscribers += 1
+    try:
+        yield f'retry: {int(heartbeat * 1000)}\n\n'.encode('utf-8')
+        while True:
+            with _cond:
+                if _latest_id is None or _latest_id == seen:
+                    _cond.wait(heartbeat)
+                frame_id, frame = _latest_id, _latest_frame
+            if frame is not None and frame_id != seen:
+                seen = frame_id
+                yield frame
+            else:
+                yield HEARTBEAT_FRAME
+    finally:
+        with _cond:
+            _subscribers -= 1
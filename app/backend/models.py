@@ -12,6 +12,10 @@ class User(db.Model):
     xp_total = db.Column(db.Integer, default=0)
     level = db.Column(db.Integer, default=1)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # indexes mirror alembic revision 0004_hot_path_indexes
+    __table_args__ = (
+        db.Index('ix_users_xp_total', 'xp_total'),
+    )
 
     def to_dict(self):
         return {
@@ -34,6 +38,9 @@ class XPEvent(db.Model):
     meta = db.Column(db.JSON, nullable=True)
     # optional idempotency key provided by clients to prevent duplicate awards
     idempotency_key = db.Column(db.String(200), nullable=True)
+    # True while an event accepted in async ingestion mode is not yet folded into
+    # users.xp_total (see backend.ingest)
+    pending = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     # Note: SQLAlchemy will reflect __table_args__ when creating tables. Alembic migration
     # already provides the constraints for existing DBs; keeping __table_args__ here
     # ensures the ORM knows about uniqueness for new DBs created with db.create_all().
@@ -41,8 +48,27 @@ class XPEvent(db.Model):
         # prevent accidental duplicate events for same user+source+source_id
         db.UniqueConstraint('user_id', 'source', 'source_id', name='uq_user_source_sourceid'),
         db.UniqueConstraint('user_id', 'idempotency_key', name='uq_user_idempotency_key'),
+        db.Index('ix_xp_events_user_created', 'user_id', 'created_at'),
+        # partial: only the (few) unapplied events are indexed, in consumer order
+        db.Index('ix_xp_events_pending', 'id', postgresql_where=db.text('pending'), sqlite_where=db.text('pending')),
+    )
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+class XPRollup(db.Model):
+    """XP summed per user, period bucket and source; maintained by backend.rollups."""
+    __tablename__ = 'xp_rollups'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    period = db.Column(db.String(10), nullable=False)  # day | week | month
+    bucket_start = db.Column(db.Date, nullable=False)
+    source = db.Column(db.String(50), nullable=False)  # '' for events without a source, '*' for all
+    amount = db.Column(db.Integer, nullable=False, default=0)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    # mirror alembic revision 0005_xp_rollups
+    __table_args__ = (
+        db.Index('uq_xp_rollups_key', 'user_id', 'period', 'bucket_start', 'source', unique=True),
+        db.Index('ix_xp_rollups_board', 'period', 'bucket_start', 'source', 'amount'),
     )
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
 class Badge(db.Model):
     __tablename__ = 'badges'
@@ -51,6 +77,8 @@ class Badge(db.Model):
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.String(500), nullable=True)
     icon = db.Column(db.String(500), nullable=True)
+    # optional automatic-award rule, e.g. {"type": "xp_total", "min": 1000} (see backend.badge_rules)
+    rule = db.Column(db.JSON, nullable=True)
 
 class UserBadge(db.Model):
     __tablename__ = 'user_badges'
@@ -58,6 +86,9 @@ class UserBadge(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     badge_id = db.Column(db.Integer, db.ForeignKey('badges.id'), nullable=False)
     earned_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    __table_args__ = (
+        db.Index('uq_user_badges_user_badge', 'user_id', 'badge_id', unique=True),
+    )
 
 class Streak(db.Model):
     __tablename__ = 'streaks'
@@ -65,6 +96,9 @@ class Streak(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     current_streak = db.Column(db.Integer, default=0)
     last_checkin_date = db.Column(db.Date)
+    __table_args__ = (
+        db.Index('uq_streaks_user_id', 'user_id', unique=True),
+    )
 
 
 class JobRecord(db.Model):
@@ -74,7 +108,44 @@ class JobRecord(db.Model):
     language = db.Column(db.String(50), default='python')
     payload = db.Column(db.JSON, nullable=True)
     status = db.Column(db.String(40), default='queued')
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
     started_at = db.Column(db.DateTime, nullable=True)
     finished_at = db.Column(db.DateTime, nullable=True)
     output = db.Column(db.Text, nullable=True)
+    # scheduling (see backend.scheduler)
+    priority = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (
+        db.Index('ix_jobs_user_created', 'user_id', 'created_at'),
+        db.Index('ix_jobs_status_user_priority', 'status', 'user_id', 'priority', 'id'),
+    )
+
+
+class JobOutputChunk(db.Model):
+    """One sequenced slice of a job's output (see backend.job_output)."""
+    __tablename__ = 'job_output_chunks'
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class OutboxEvent(db.Model):
+    """Domain event written in the same transaction as the change it describes; published
+    by the outbox relay (see backend.outbox)."""
+    __tablename__ = 'outbox_events'
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(50), nullable=False)
+    key = db.Column(db.String(200), nullable=True)  # partition key, e.g. the user id
+    payload = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class OutboxOffset(db.Model):
+    """Last outbox event id a relay consumer has delivered."""
+    __tablename__ = 'outbox_offsets'
+    consumer = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,241 @@
+"""Transactional outbox for domain events (XP awards, check-ins, badges, job status).
+
+Writers call `emit(topic, key, payload)` before committing their own change, so the
+outbox row commits or rolls back together with it. A relay (`scripts/outbox_relay.py`)
+reads committed rows in id order and publishes them in batches to a sink: a Redis
+stream, a JSON-lines file, or a callback (tests, in-process consumers). Downstream
+services consume the sink instead of polling the primary database.
+
+Delivery is at-least-once. Each relay consumer keeps its position in `outbox_offsets`
+and advances it only after the sink accepted the whole batch, so a crash between
+publish and commit re-sends that batch; consumers deduplicate on the event `id`.
+
+Ids are assigned at insert but transactions may commit out of order, so a missing id
+can still appear. The relay stops at such a gap until it can tell the id was rolled back:
+- PostgreSQL: `emit` makes sure its transaction has an xid before the row draws its id,
+  so whichever transaction holds the missing id was already running when the relay first
+  saw the gap. The relay remembers the snapshot's xmax at that point and passes the gap
+  once no other transaction below it is still running, however long that takes.
+- SQLite: writers are serialized, so a gap below a committed id is always a rollback.
+- Other databases fall back to waiting OUTBOX_GAP_GRACE_SECONDS.
+
+A sink applies backpressure through `ready()`: while it returns False (e.g. a Redis
+consumer group lags by more than `max_lag` entries) the relay publishes nothing and
+backs off.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, text
+
+from backend.app import db
+from backend.models import OutboxEvent, OutboxOffset
+
+
+def emit(topic: str, key, payload: dict) -> None:
+    """Add an event to the current transaction. Does not commit."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # take the transaction's xid before the insert draws the event id (see module docstring)
+        db.session.execute(text('SELECT pg_current_xact_id()'))
+    db.session.add(OutboxEvent(topic=topic, key=str(key) if key is not None else None, payload=payload))
+
+
+def event_dict(e) -> dict:
+    return {'id': e.id, 'topic': e.topic, 'key': e.key, 'payload': e.payload, 'created_at': e.created_at.isoformat()}
+
+
+# --- sinks --------------------------------------------------------------------
+
+class CallbackSink:
+    """Hands each batch to `callback(events)`; `ready` is an optional backpressure probe."""
+
+    def __init__(self, callback, ready=None):
+        self.callback = callback
+        self._ready = ready
+
+    def ready(self) -> bool:
+        return self._ready() if self._ready else True
+
+    def publish(self, events) -> None:
+        self.callback(events)
+
+
+class FileSink:
+    """Appends one JSON object per line and fsyncs before the batch counts as delivered."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def ready(self) -> bool:
+        return True
+
+    def publish(self, events) -> None:
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for e in events:
+                f.write(json.dumps(e) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class RedisStreamSink:
+    """XADDs each event to `stream` in one pipeline.
+
+    With `max_lag`, `ready()` reports backpressure while any consumer group on the stream
+    is more than `max_lag` entries behind. `maxlen` caps the stream length (approximate
+    trimming) so an abandoned stream cannot grow without bound.
+    """
+
+    def __init__(self, client, stream: str = 'outbox', maxlen: int = None, max_lag: int = None):
+        self.client = client
+        self.stream = stream
+        self.maxlen = maxlen
+        self.max_lag = max_lag
+
+    def ready(self) -> bool:
+        if not self.max_lag:
+            return True
+        try:
+            groups = self.client.xinfo_groups(self.stream)
+        except Exception:
+            return True  # stream not created yet
+        for g in groups:
+            lag = g.get('lag') if isinstance(g, dict) else None
+            if lag is not None and lag > self.max_lag:
+                return False
+        return True
+
+    def publish(self, events) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for e in events:
+            fields = {'id': e['id'], 'topic': e['topic'], 'key': e['key'] or '', 'payload': json.dumps(e['payload']),
+                      'created_at': e['created_at']}
+            pipe.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+        pipe.execute()
+
+
+# --- relay ----------------------------------------------------------------------
+
+def _lock_offset(session, consumer: str):
+    """Return the consumer's offset row, locked (one relay per consumer at a time)."""
+    row = session.execute(select(OutboxOffset).where(OutboxOffset.consumer == consumer).with_for_update()).scalar_one_or_none()
+    if row is None:
+        session.add(OutboxOffset(consumer=consumer, last_id=0))
+        session.flush()
+        row = session.execute(select(OutboxOffset).where(OutboxOffset.consumer == consumer).with_for_update()).scalar_one()
+    return row
+
+
+# consumer -> (first gap id, snapshot xmax when the relay first saw it)
+_gaps = {}
+_gaps_lock = threading.Lock()
+
+_PG_RUNNING = text(
+    'SELECT pg_snapshot_xmax(s)::text::bigint, '
+    '(SELECT min(x::text::bigint) FROM pg_snapshot_xip(s) x WHERE x IS DISTINCT FROM pg_current_xact_id_if_assigned()) '
+    'FROM pg_current_snapshot() s')
+
+
+def _gap_resolved(session, consumer: str, gap_id: int, created, grace_seconds: float) -> bool:
+    """Whether the missing id `gap_id` can no longer be committed by anyone."""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return True
+    if dialect != 'postgresql':
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=grace_seconds)
+        return (created.replace(tzinfo=None) if created.tzinfo else created) <= cutoff
+    xmax, oldest = session.execute(_PG_RUNNING).one()
+    with _gaps_lock:
+        seen = _gaps.get(consumer)
+        if seen is None or seen[0] != gap_id:
+            seen = _gaps[consumer] = (gap_id, xmax)
+    # the holder of gap_id had its xid before seen[1]; once nothing below that runs, it is gone
+    if oldest is None or oldest >= seen[1]:
+        with _gaps_lock:
+            _gaps.pop(consumer, None)
+        return True
+    return False
+
+
+def _contiguous(session, rows, last_id: int, consumer: str, grace_seconds: float):
+    """Cut the batch at the first id gap that may still be an in-flight commit."""
+    expected = last_id + 1
+    for i, r in enumerate(rows):
+        if r.id != expected and not _gap_resolved(session, consumer, expected, r.created_at, grace_seconds):
+            return rows[:i]
+        expected = r.id + 1
+    return rows
+
+
+def relay_once(session, sink, consumer: str = 'default', batch_size: int = 500, gap_grace_seconds: float = 5.0):
+    """Publish the next batch after `consumer`'s offset to `sink` and advance the offset.
+
+    Returns the number of events published, or None if the sink signalled backpressure.
+    If publishing raises, the transaction is rolled back and the offset stays put.
+    """
+    if not sink.ready():
+        return None
+    offset = _lock_offset(session, consumer)
+    rows = session.execute(
+        select(OutboxEvent).where(OutboxEvent.id > offset.last_id).order_by(OutboxEvent.id).limit(batch_size)
+    ).scalars().all()
+    rows = _contiguous(session, rows, offset.last_id, consumer, gap_grace_seconds)
+    if not rows:
+        session.rollback()
+        return 0
+    try:
+        sink.publish([event_dict(e) for e in rows])
+    except Exception:
+        session.rollback()
+        raise
+    offset.last_id = rows[-1].id
+    offset.updated_at = datetime.now(timezone.utc)
+    session.commit()
+    return len(rows)
+
+
+def prune(session, retention_seconds: float) -> int:
+    """Delete events every consumer has passed and that are older than the retention."""
+    low = session.execute(select(func.min(OutboxOffset.last_id))).scalar()
+    if not low:
+        return 0
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=retention_seconds)
+    deleted = session.query(OutboxEvent).filter(OutboxEvent.id <= low, OutboxEvent.created_at < cutoff).delete(
+        synchronize_session=False)
+    session.commit()
+    return deleted
+
+
+def run_relay(app, sink, consumer: str = 'default', stop=None) -> None:
+    """Relay loop: publish batches back to back while there is work, otherwise wait
+    OUTBOX_RELAY_POLL_SECONDS. Sink errors and backpressure back off exponentially up to
+    OUTBOX_RELAY_MAX_BACKOFF_SECONDS."""
+    with app.app_context():
+        cfg = app.config
+        batch_size = int(cfg.get('OUTBOX_RELAY_BATCH_SIZE', 500))
+        poll = float(cfg.get('OUTBOX_RELAY_POLL_SECONDS', 0.5))
+        max_backoff = float(cfg.get('OUTBOX_RELAY_MAX_BACKOFF_SECONDS', 30))
+        grace = float(cfg.get('OUTBOX_GAP_GRACE_SECONDS', 5))
+        retention = float(cfg.get('OUTBOX_RETENTION_SECONDS', 7 * 86400))
+        backoff = poll
+        while stop is None or not stop.is_set():
+            try:
+                n = relay_once(db.session, sink, consumer, batch_size, grace)
+            except Exception:
+                app.logger.exception('outbox relay: publish failed')
+                n = None
+            finally:
+                db.session.remove()
+            if n is None:
+                time.sleep(backoff)
+                backoff = min(max_backoff, backoff * 2)
+                continue
+            backoff = poll
+            if n == 0:
+                try:
+                    prune(db.session, retention)
+                finally:
+                    db.session.remove()
+                time.sleep(poll)
@@ -0,0 +1,53 @@
+"""Keyset (cursor) pagination on (created_at, id), newest first.
+
+Cursors are opaque to clients: base64 of the last row's created_at and id. The next page
+is everything strictly older than that pair, so the cost of a page does not depend on how
+deep the client has paged (unlike OFFSET). The created_at columns paged on are NOT NULL
+(alembic 0011 backfilled legacy rows), so every row yields a cursor.
+"""
+import base64
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f'{created_at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """Return (created_at, id) for an opaque cursor, raising ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created), int(row_id)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def parse_timestamp(value: str):
+    """Parse an ISO-8601 query parameter into the naive UTC datetimes stored in the DB."""
+    try:
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'invalid timestamp: {value}')
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def keyset_page(stmt, created_col, id_col, cursor=None, limit: int = 50):
+    """Apply newest-first ordering, the cursor predicate and limit to a select()."""
+    if cursor:
+        created_at, row_id = decode_cursor(cursor) if isinstance(cursor, str) else cursor
+        stmt = stmt.where(or_(created_col < created_at, and_(created_col == created_at, id_col < row_id)))
+    return stmt.order_by(created_col.desc(), id_col.desc()).limit(limit)
+
+
+def next_cursor(rows, limit: int, created_attr: str = 'created_at'):
+    """Cursor for the page after `rows`, or None when this was the last page."""
+    if len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(getattr(last, created_attr), last.id)
@@ -0,0 +1,150 @@
+"""Password hashing off the request threads.
+
+The KDF behind `generate_password_hash` / `check_password_hash` is deliberately slow
+(~100ms of CPU for the default scrypt). Run inline, a burst of logins holds every web
+worker busy and starves unrelated endpoints. Here hashes are computed in a process
+pool of PASSWORD_HASH_WORKERS processes. Requests wait for their result, but at most
+PASSWORD_HASH_QUEUE_LIMIT hashes may be queued or running at once; beyond that, or when
+a hash takes longer than PASSWORD_HASH_TIMEOUT, `HashBusy` is raised and the endpoint
+answers 503 right away instead of piling up. A slot is freed only when its hash has
+actually finished.
+
+The pool is per server process. By default each gets an equal share of the CPUs
+(CPU count / SERVE_WORKER_PROCESSES, at least one; `backend.serve` sets that variable),
+so all server workers together run about one KDF process per CPU.
+
+PASSWORD_HASH_METHOD is a werkzeug method string, e.g. `scrypt:32768:8:1` (default) or
+`pbkdf2:sha256:1000000`. A stored hash made with other parameters is still accepted,
+and `verify_password` returns a fresh hash for the caller to store, so changing the
+method upgrades users as they log in (skipped, not failed, when the pool is busy).
+
+PASSWORD_HASH_POOL = 'inline' hashes on the calling thread (tests, single-user tools).
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+class HashBusy(Exception):
+    """The hashing queue is full; retry shortly."""
+
+
+_pool = None
+_slots = None
+_lock = threading.Lock()
+_stats = {'hashes': 0, 'verifications': 0, 'rehashes': 0, 'rehashes_skipped': 0, 'rejected_busy': 0, 'timeouts': 0,
+          'in_flight': 0, 'in_flight_max': 0}
+
+
+@lru_cache(maxsize=8)
+def _canonical(method: str) -> str:
+    """The parameter prefix werkzeug writes for `method`, e.g. 'scrypt' -> 'scrypt:32768:8:1'."""
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def _method() -> str:
+    return current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+
+
+def default_workers() -> int:
+    """This process's share of the CPUs for hashing."""
+    servers = int(os.getenv('SERVE_WORKER_PROCESSES', '1')) or 1
+    return max(1, (os.cpu_count() or 1) // servers)
+
+
+def _get_pool():
+    global _pool, _slots
+    with _lock:
+        if _pool is None:
+            cfg = current_app.config
+            workers = int(cfg.get('PASSWORD_HASH_WORKERS', 0)) or default_workers()
+            # spawn: workers import only werkzeug, and forking a threaded server is unsafe
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            _slots = threading.BoundedSemaphore(int(cfg.get('PASSWORD_HASH_QUEUE_LIMIT', workers * 8)))
+        return _pool, _slots
+
+
+def _run(fn, *args):
+    if current_app.config.get('PASSWORD_HASH_POOL', 'process') == 'inline':
+        return fn(*args)
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        with _lock:
+            _stats['rejected_busy'] += 1
+        raise HashBusy('password hashing queue is full')
+    with _lock:
+        _stats['in_flight'] += 1
+        _stats['in_flight_max'] = max(_stats['in_flight_max'], _stats['in_flight'])
+
+    def done(_future=None):
+        # the slot stays taken until the KDF has really finished, even after a timeout
+        with _lock:
+            _stats['in_flight'] -= 1
+        slots.release()
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        done()
+        raise
+    future.add_done_callback(done)
+    try:
+        return future.result(timeout=float(current_app.config.get('PASSWORD_HASH_TIMEOUT', 30)))
+    except FutureTimeout:
+        future.cancel()
+        with _lock:
+            _stats['timeouts'] += 1
+        raise HashBusy('password hashing timed out')
+
+
+def hash_password(password: str) -> str:
+    """Hash with the configured method. Raises HashBusy when the queue is full."""
+    with _lock:
+        _stats['hashes'] += 1
+    return _run(generate_password_hash, password, _method())
+
+
+def needs_rehash(stored: str) -> bool:
+    return stored.split('$', 1)[0] != _canonical(_method())
+
+
+def verify_password(stored: str, password: str):
+    """Check `password` against `stored`. Returns (ok, new_hash): `new_hash` is set when
+    the password is right but `stored` uses outdated parameters. Raises HashBusy."""
+    with _lock:
+        _stats['verifications'] += 1
+    if not _run(check_password_hash, stored, password):
+        return False, None
+    if not needs_rehash(stored):
+        return True, None
+    try:
+        new_hash = hash_password(password)
+    except HashBusy:
+        # the password was right; upgrade the hash on a later login
+        with _lock:
+            _stats['rehashes_skipped'] += 1
+        return True, None
+    with _lock:
+        _stats['rehashes'] += 1
+    return True, new_hash
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats)
+
+
+def reset() -> None:
+    """Shut the pool down; the next hash starts a new one with the current config."""
+    global _pool, _slots
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _slots = None
@@ -0,0 +1,74 @@
+"""Read helpers for user profile payloads.
+
+`user_stats`, `list_user_badges` and `me_progress` all need the same pieces; these
+helpers fetch them with a fixed number of queries (badges are joined to `badges`
+instead of being looked up one by one), so the cost does not grow with badge count.
+
+The serialized `/users/<id>/stats` and `/me/progress` payloads are cached per user
+(PROFILE_CACHE_TTL_SECONDS); anything that changes a user's XP, streak or badges must
+call `invalidate_user` after committing.
+"""
+from flask import current_app
+from sqlalchemy import select
+
+from backend import cache
+from backend.app import db
+from backend.models import User, XPEvent, UserBadge, Badge, Streak
+
+RECENT_EVENTS_LIMIT = 10
+PROFILE_CACHE_NAMESPACES = ('user_stats', 'me_progress')
+
+
+def load_user(user_id: int, with_streak: bool = False):
+    """Return (user, streak) in one query; streak is None if absent or not requested."""
+    if not with_streak:
+        return db.session.get(User, user_id), None
+    row = db.session.execute(
+        select(User, Streak).outerjoin(Streak, Streak.user_id == User.id).where(User.id == user_id).limit(1)
+    ).first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+def recent_events(user_id: int, limit: int = RECENT_EVENTS_LIMIT):
+    events = db.session.execute(
+        select(XPEvent).where(XPEvent.user_id == user_id).order_by(XPEvent.created_at.desc()).limit(limit)
+    ).scalars()
+    return [{'id': e.id, 'amount': e.amount, 'source': e.source, 'created_at': e.created_at.isoformat()} for e in events]
+
+
+def user_badges(user_id: int, with_description: bool = False):
+    """Earned badges for a user, joined to the badge catalog in a single query."""
+    rows = db.session.execute(
+        select(Badge, UserBadge.earned_at)
+        .join(UserBadge, UserBadge.badge_id == Badge.id)
+        .where(UserBadge.user_id == user_id)
+        .order_by(UserBadge.id)
+    ).all()
+    badges = []
+    for b, earned_at in rows:
+        item = {'id': b.id, 'code': b.code, 'name': b.name}
+        if with_description:
+            item['description'] = b.description
+        item['earned_at'] = earned_at.isoformat()
+        badges.append(item)
+    return badges
+
+
+def streak_dict(streak):
+    if not streak:
+        return {}
+    return {
+        'current_streak': streak.current_streak,
+        'last_checkin_date': streak.last_checkin_date.isoformat() if streak.last_checkin_date else None,
+    }
+
+
+def cache_ttl() -> float:
+    return float(current_app.config.get('PROFILE_CACHE_TTL_SECONDS', 30))
+
+
+def invalidate_user(user_id: int) -> None:
+    for namespace in PROFILE_CACHE_NAMESPACES:
+        cache.invalidate(namespace, user_id)
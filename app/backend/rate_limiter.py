@@ -1,17 +1,89 @@
-from time import time
+"""Token-bucket rate limiter.
+
+A limit is configured as "max:seconds" (e.g. XP_RATE_LIMIT = '1000:60'): a bucket holds
+up to `max` tokens and refills continuously at max/seconds tokens per second. Unlike a
+fixed window this never lets 2x the limit through around a window edge.
+
+Backends:
+  - Redis: one atomic Lua script (EVALSHA) per check on the shared pooled client from
+    `backend.redis_client`, using the Redis server clock.
+  - In-memory fallback: per-process buckets in an LRU with a bounded number of keys;
+    buckets that have refilled completely are evicted since they carry no state.
+
+Callers use named policies (`check_policy('jobs', user_id)`); a policy can combine several
+limits, e.g. JOB_RATE_LIMIT = '10:60,200:86400', which are checked and charged together.
+
+RATE_LIMIT_BACKEND selects 'redis' or 'memory'; by default Redis is tried first and the
+in-memory buckets are used while it is unreachable.
+"""
+from collections import OrderedDict
+from math import ceil
 from threading import Lock
+from time import monotonic
+
 from flask import current_app
 
-# Try to use Redis if available; otherwise fallback to simple in-memory windowed counter.
-try:
-    import redis
-except Exception:
-    redis = None
+from backend import redis_client
 
-_store = {}
+# KEYS = one bucket per limit; ARGV = cost, then (capacity, refill rate in tokens/ms) per key.
+# The request is allowed only if every bucket has `cost` tokens, and then all are charged,
+# so a policy with several limits is checked atomically in one round trip.
+# Returns {allowed (0/1), min remaining tokens (string to keep fractions), retry_after_ms}.
+_TOKEN_BUCKET_LUA = """
+local cost = tonumber(ARGV[1])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local tokens = {}
+local allowed = 1
+local retry = 0
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 2])
+  local rate = tonumber(ARGV[i * 2 + 1])
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tk = tonumber(state[1])
+  local ts = tonumber(state[2])
+  if tk == nil then
+    tk = capacity
+    ts = now
+  end
+  tk = math.min(capacity, tk + math.max(0, now - ts) * rate)
+  if tk < cost then
+    allowed = 0
+    retry = math.max(retry, math.ceil((cost - tk) / rate))
+  end
+  tokens[i] = tk
+end
+local remaining = nil
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 2])
+  local rate = tonumber(ARGV[i * 2 + 1])
+  local tk = tokens[i]
+  if allowed == 1 then
+    tk = tk - cost
+  end
+  if remaining == nil or tk < remaining then
+    remaining = tk
+  end
+  redis.call('HSET', key, 'tokens', tostring(tk), 'ts', now)
+  redis.call('PEXPIRE', key, math.ceil((capacity - tk) / rate) + 1000)
+end
+return {allowed, tostring(remaining), retry}
+"""
+
+_scripts = {}
+_buckets = OrderedDict()  # key -> (tokens, last_refill, expires_at)
 _lock = Lock()
 
 
+# Named policies: config key holding "max:seconds[,max:seconds...]" and its default.
+# A policy may carry several limits (e.g. per-minute plus per-day); all must allow a request.
+POLICIES = {
+    'xp': ('XP_RATE_LIMIT', '1000:60'),
+    'jobs': ('JOB_RATE_LIMIT', None),
+    'auth': ('AUTH_RATE_LIMIT', '60:60'),
+}
+
+
 def _parse_config(cfg: str):
     # expects "max:seconds"
     try:
@@ -21,54 +93,117 @@ def _parse_config(cfg: str):
         return 1000, 60
 
 
-def _redis_check(key: str):
-    cfg = current_app.config.get('XP_RATE_LIMIT', '1000:60')
-    max_calls, window = _parse_config(cfg)
-    now = int(time())
-    window_start = now - (now % window)
-    rkey = f"rl:{key}:{window_start}"
-    r = None
+def _parse_limits(cfg: str):
+    return [_parse_config(part.strip()) for part in cfg.split(',') if part.strip()]
+
+
+def policy_limits(policy: str):
+    """Return [(max_calls, window_seconds), ...] for a named policy from app config."""
+    config_key, default = POLICIES[policy]
+    cfg = current_app.config.get(config_key, default)
+    if cfg is None and policy == 'jobs':
+        # legacy JOB_QUOTA_* settings; JOB_QUOTA_PER_DAY adds a second, daily limit
+        cfg = f"{current_app.config.get('JOB_QUOTA_PER_MINUTE', 10)}:{current_app.config.get('JOB_QUOTA_WINDOW_SECONDS', 60)}"
+        per_day = current_app.config.get('JOB_QUOTA_PER_DAY')
+        if per_day:
+            cfg += f',{per_day}:86400'
+    return _parse_limits(cfg)
+
+
+def _bucket_keys(key: str, limits):
+    return [f'rl:{key}:{max_calls}:{window}' for max_calls, window in limits]
+
+
+def _redis_url():
+    return current_app.config.get('REDIS_URL', redis_client.DEFAULT_URL)
+
+
+def _redis_check(key: str, limits, cost: int = 1):
+    url = _redis_url()
+    r = redis_client.get_redis(url)
+    if r is None:
+        return None
     try:
-        r = redis.from_url(current_app.config.get('REDIS_URL', 'redis://localhost:6379/0'))
-        val = r.incr(rkey)
-        if val == 1:
-            # set expiry to window seconds
-            r.expire(rkey, window)
-        remaining = max_calls - int(val)
-        allowed = int(val) <= max_calls
-        reset_seconds = window_start + window - now
-        return allowed, {'remaining': max(0, remaining), 'reset_seconds': reset_seconds}
+        script = _scripts.get(url)
+        if script is None:
+            script = _scripts[url] = r.register_script(_TOKEN_BUCKET_LUA)
+        args = [cost]
+        for max_calls, window in limits:
+            args.extend((max_calls, max_calls / (window * 1000.0)))
+        allowed, tokens, retry_ms = script(keys=_bucket_keys(key, limits), args=args)
+        return bool(allowed), {
+            'remaining': int(float(tokens)),
+            'reset_seconds': int(ceil(int(retry_ms) / 1000.0)),
+        }
     except Exception:
-        # Redis not available or failed; fallback to in-memory
+        # Redis not available or failed; back off and fall back to in-memory
+        redis_client.mark_failed(url, float(current_app.config.get('RATE_LIMIT_REDIS_BACKOFF_SECONDS', 5)))
         return None
 
 
-def _memory_check(key: str):
-    cfg = current_app.config.get('XP_RATE_LIMIT', '1000:60')
-    max_calls, window = _parse_config(cfg)
-    now = int(time())
-    window_start = now - (now % window)
+def _memory_check(key: str, limits, cost: int = 1):
+    max_keys = int(current_app.config.get('RATE_LIMIT_MAX_KEYS', 100000))
+    now = monotonic()
+    keys = _bucket_keys(key, limits)
     with _lock:
-        entry = _store.get(key)
-        if not entry or entry.get('window') != window_start:
-            # reset
-            _store[key] = {'count': 0, 'window': window_start}
-            entry = _store[key]
-        if entry['count'] < max_calls:
-            entry['count'] += 1
-            remaining = max_calls - entry['count']
-            return True, {'remaining': remaining, 'reset_seconds': window_start + window - now}
-        else:
-            return False, {'remaining': 0, 'reset_seconds': window_start + window - now}
-
-
-def check_rate_limit(key: str) -> tuple[bool, dict]:
-    """Return (allowed: bool, info dict)
-    info contains: remaining, reset_seconds
-    """
-    if redis is not None:
-        res = _redis_check(key)
+        # drop buckets that have refilled completely; the LRU order means the stalest
+        # entries are at the front, so this stops at the first live one
+        while _buckets:
+            oldest = next(iter(_buckets))
+            if _buckets[oldest][2] > now:
+                break
+            del _buckets[oldest]
+
+        tokens = []
+        retry = 0
+        for bkey, (max_calls, window) in zip(keys, limits):
+            rate = max_calls / float(window)
+            entry = _buckets.pop(bkey, None)
+            tk = max_calls if entry is None else min(max_calls, entry[0] + (now - entry[1]) * rate)
+            if tk < cost:
+                retry = max(retry, ceil((cost - tk) / rate))
+            tokens.append(tk)
+        allowed = retry == 0
+        for i, (bkey, (max_calls, window)) in enumerate(zip(keys, limits)):
+            if allowed:
+                tokens[i] -= cost
+            rate = max_calls / float(window)
+            # one fixed-size tuple per bucket, whatever the request rate
+            _buckets[bkey] = (tokens[i], now, now + (max_calls - tokens[i]) / rate)
+        while len(_buckets) > max_keys:
+            _buckets.popitem(last=False)
+
+    return allowed, {'remaining': int(min(tokens)), 'reset_seconds': retry}
+
+
+def _check(key: str, limits, cost: int):
+    if current_app.config.get('RATE_LIMIT_BACKEND') != 'memory':
+        res = _redis_check(key, limits, cost)
         if res is not None:
             return res
     # fallback
-    return _memory_check(key)
+    return _memory_check(key, limits, cost)
+
+
+def check_policy(policy: str, identity, cost: int = 1) -> tuple[bool, dict]:
+    """Check every limit of a named policy (see POLICIES) for `identity` atomically.
+
+    Returns the same (allowed, info) pair as check_rate_limit.
+    """
+    return _check(f'{policy}:{identity}', policy_limits(policy), cost)
+
+
+def check_rate_limit(key: str, limit: str = None, cost: int = 1) -> tuple[bool, dict]:
+    """Return (allowed: bool, info dict)
+    info contains: remaining, reset_seconds (seconds until the request would be allowed)
+
+    `limit` is a "max:seconds[,max:seconds...]" string; it defaults to the XP_RATE_LIMIT config.
+    """
+    cfg = limit or current_app.config.get('XP_RATE_LIMIT', '1000:60')
+    return _check(key, _parse_limits(cfg), cost)
+
+
+def reset() -> None:
+    """Clear in-memory buckets (tests)."""
+    with _lock:
+        _buckets.clear()
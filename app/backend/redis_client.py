@@ -0,0 +1,76 @@
+"""Process-wide pooled Redis clients.
+
+`redis.from_url` builds a fresh connection pool on every call; callers here share one
+client (and pool) per URL instead. A URL that just failed is skipped for a short back-off
+so request paths with an in-memory fallback don't pay a connect timeout on every call.
+
+`redis` itself is imported on the first `get_redis` call, keeping it out of app start-up
+for processes that never talk to Redis.
+"""
+from threading import Lock
+from time import monotonic
+
+DEFAULT_URL = 'redis://localhost:6379/0'
+
+_clients = {}
+_down_until = {}
+_lock = Lock()
+_redis = None  # the module once imported; False when it is not installed
+
+
+def _redis_module():
+    # callers fall back to in-process state when redis is not available
+    global _redis
+    if _redis is None:
+        try:
+            import redis
+        except Exception:
+            redis = False
+        _redis = redis
+    return _redis or None
+
+
+def available() -> bool:
+    """Whether the redis package is installed."""
+    return _redis_module() is not None
+
+
+def get_redis(url: str = None, max_connections: int = 50, socket_timeout: float = 0.5):
+    """Return the shared client for `url`, or None if redis is missing or `url` is backing off."""
+    redis = _redis_module()
+    if redis is None:
+        return None
+    url = url or DEFAULT_URL
+    if _down_until.get(url, 0) > monotonic():
+        return None
+    client = _clients.get(url)
+    if client is None:
+        with _lock:
+            client = _clients.get(url)
+            if client is None:
+                pool = redis.ConnectionPool.from_url(
+                    url,
+                    max_connections=max_connections,
+                    socket_timeout=socket_timeout,
+                    socket_connect_timeout=socket_timeout,
+                )
+                client = redis.Redis(connection_pool=pool)
+                _clients[url] = client
+    return client
+
+
+def mark_failed(url: str = None, backoff_seconds: float = 5.0) -> None:
+    """Skip `url` for `backoff_seconds` after a connection error."""
+    _down_until[url or DEFAULT_URL] = monotonic() + backoff_seconds
+
+
+def reset() -> None:
+    """Drop cached clients and back-off state (tests, forked workers)."""
+    with _lock:
+        for client in _clients.values():
+            try:
+                client.connection_pool.disconnect()
+            except Exception:
+                pass
+        _clients.clear()
+        _down_until.clear()
@@ -0,0 +1,192 @@
+"""Materialized XP aggregates per user, period bucket and source.
+
+`xp_rollups` holds one row per (user_id, period, bucket_start, source) with the summed XP
+and event count. Writers call `record_events` in the same transaction as the XP events
+they insert, so the rollups commit (or roll back) together with them. Period
+leaderboards and per-user summaries then read a handful of indexed rows instead of
+scanning `xp_events`.
+
+Buckets are UTC calendar days, ISO weeks (starting Monday) and calendar months. Besides a
+row per source, every bucket has a TOTAL_SOURCE row summing all sources, which is what
+the period leaderboards sort on. Events without a source are rolled up under ''. Awards
+may not use TOTAL_SOURCE as their source (schemas.RESERVED_SOURCES); an older event that
+does counts once, towards the total only.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import and_, delete, func, or_, select
+
+from backend.app import db
+from backend.db_helpers import upsert_increment
+from backend.models import User, XPEvent, XPRollup
+
+PERIODS = ('day', 'week', 'month')
+TOTAL_SOURCE = '*'  # also in schemas.RESERVED_SOURCES
+
+
+def bucket_start(period: str, ts=None) -> date:
+    """First day of the `period` bucket containing `ts` (a datetime or date, UTC; default now)."""
+    if ts is None:
+        ts = datetime.now(timezone.utc)
+    if isinstance(ts, datetime):
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc)
+        ts = ts.date()
+    if period == 'day':
+        return ts
+    if period == 'week':
+        return ts - timedelta(days=ts.weekday())
+    if period == 'month':
+        return ts.replace(day=1)
+    raise ValueError(f'invalid period: {period}')
+
+
+def previous_bucket(period: str, start: date) -> date:
+    if period == 'day':
+        return start - timedelta(days=1)
+    if period == 'week':
+        return start - timedelta(days=7)
+    return (start - timedelta(days=1)).replace(day=1)
+
+
+def _aggregate(events, acc=None):
+    """Fold (user_id, amount, source, created_at) tuples into {rollup key: [xp, count]}."""
+    acc = defaultdict(lambda: [0, 0]) if acc is None else acc
+    for user_id, amount, source, created_at in events:
+        sources = (TOTAL_SOURCE,) if source == TOTAL_SOURCE else (source or '', TOTAL_SOURCE)
+        for period in PERIODS:
+            start = bucket_start(period, created_at)
+            for src in sources:
+                row = acc[(user_id, period, start, src)]
+                row[0] += amount
+                row[1] += 1
+    return acc
+
+
+def _flush(acc) -> None:
+    if not acc:
+        return
+    rows = [
+        {'user_id': user_id, 'period': period, 'bucket_start': start, 'source': src,
+         'amount': amount, 'event_count': count}
+        for (user_id, period, start, src), (amount, count) in acc.items()
+    ]
+    upsert_increment(XPRollup, rows, ('user_id', 'period', 'bucket_start', 'source'), ('amount', 'event_count'))
+
+
+def record_events(events) -> None:
+    """Add XP events to their rollup rows in the current transaction. Does not commit.
+
+    `events` are XPEvent objects or (user_id, amount, source, created_at) tuples; an event
+    without created_at counts towards the current buckets. All rows touched by the call
+    are written with one multi-row upsert.
+    """
+    now = datetime.now(timezone.utc)
+    tuples = []
+    for e in events:
+        if isinstance(e, XPEvent):
+            e = (e.user_id, e.amount, e.source, e.created_at)
+        user_id, amount, source, created_at = e
+        tuples.append((user_id, amount, source, created_at or now))
+    _flush(_aggregate(tuples))
+
+
+def backfill(session, user_ids=None, chunk_size: int = 5000, progress=print) -> int:
+    """Rebuild rollups from `xp_events` (all users, or only `user_ids`). Returns rows written.
+
+    Existing rollup rows for the affected users are deleted first, so the result is exact
+    and the command can be re-run. Events are streamed in user_id order and flushed every
+    `chunk_size` users, so memory stays bounded by one chunk's aggregates. Does not commit.
+    """
+    clear = delete(XPRollup)
+    # pending (async-ingested) events are rolled up by the ingest consumer when applied
+    stmt = (
+        select(XPEvent.user_id, XPEvent.amount, XPEvent.source, XPEvent.created_at)
+        .where(XPEvent.pending.is_(False))
+        .order_by(XPEvent.user_id)
+    )
+    if user_ids is not None:
+        clear = clear.where(XPRollup.user_id.in_(list(user_ids)))
+        stmt = stmt.where(XPEvent.user_id.in_(list(user_ids)))
+    session.execute(clear)
+
+    written = 0
+    acc = defaultdict(lambda: [0, 0])
+    users_in_chunk = 0
+    last_user = None
+    for row in session.execute(stmt.execution_options(yield_per=chunk_size)):
+        if row.user_id != last_user:
+            if users_in_chunk >= chunk_size:
+                _flush(acc)
+                written += len(acc)
+                if progress:
+                    progress(f'  wrote {written:,} rollup rows (through user {last_user})')
+                acc = defaultdict(lambda: [0, 0])
+                users_in_chunk = 0
+            users_in_chunk += 1
+            last_user = row.user_id
+        _aggregate([tuple(row)], acc)
+    _flush(acc)
+    written += len(acc)
+    return written
+
+
+def top(period: str, limit: int, cursor: str = None, at=None):
+    """Return (rows, bucket_start, next_cursor) for one page of a period leaderboard.
+
+    Rows have the same shape as the all-time leaderboard, with `xp` being the XP earned in
+    the bucket containing `at` (default: now).
+    """
+    from backend import leaderboard
+    start = bucket_start(period, at)
+    board = and_(XPRollup.period == period, XPRollup.bucket_start == start, XPRollup.source == TOTAL_SOURCE)
+    stmt = (
+        select(XPRollup.user_id, XPRollup.amount, User.display_name, User.level)
+        .join(User, User.id == XPRollup.user_id)
+        .where(board)
+        .order_by(XPRollup.amount.desc(), XPRollup.user_id.desc())
+        .limit(limit)
+    )
+    offset = 0
+    if cursor:
+        xp, user_id = leaderboard.decode_cursor(cursor)
+        after = or_(XPRollup.amount < xp, and_(XPRollup.amount == xp, XPRollup.user_id < user_id))
+        stmt = stmt.where(after)
+        # rank of the first row = rows ahead of the cursor; an index range count, no row fetch
+        offset = db.session.execute(select(func.count()).select_from(XPRollup).where(board, ~after)).scalar_one()
+    rows = [
+        {'rank': offset + i + 1, 'user_id': r.user_id, 'display_name': r.display_name, 'xp': r.amount,
+         'level': r.level or 1}
+        for i, r in enumerate(db.session.execute(stmt))
+    ]
+    next_cursor = leaderboard.encode_cursor(rows[-1]['xp'], rows[-1]['user_id']) if len(rows) == limit else None
+    return rows, start, next_cursor
+
+
+def summary(user_id: int, period: str, buckets: int = 1, at=None):
+    """XP per bucket for the last `buckets` buckets of `period`, newest first, with a
+    per-source breakdown. Reads at most buckets x (sources + 1) rows from one index range."""
+    latest = bucket_start(period, at)
+    starts = [latest]
+    for _ in range(buckets - 1):
+        starts.append(previous_bucket(period, starts[-1]))
+    rows = db.session.execute(
+        select(XPRollup.bucket_start, XPRollup.source, XPRollup.amount, XPRollup.event_count).where(
+            XPRollup.user_id == user_id, XPRollup.period == period,
+            XPRollup.bucket_start >= starts[-1], XPRollup.bucket_start <= latest)
+    ).all()
+    by_bucket = {s: {'bucket_start': s.isoformat(), 'xp': 0, 'events': 0, 'by_source': {}} for s in starts}
+    for r in rows:
+        item = by_bucket[r.bucket_start]
+        if r.source == TOTAL_SOURCE:
+            item['xp'], item['events'] = r.amount, r.event_count
+        else:
+            item['by_source'][r.source or None] = r.amount
+    result = []
+    for s in starts:
+        item = by_bucket[s]
+        item['by_source'] = [{'source': src, 'xp': xp} for src, xp in
+                             sorted(item['by_source'].items(), key=lambda kv: -kv[1])]
+        result.append(item)
+    return result
@@ -1,14 +1,23 @@
 from flask import Blueprint, request, jsonify, current_app, redirect
 from backend.auth import create_token
+from backend.rate_limiter import check_policy
 from backend.app import db
 from backend.models import User
-from werkzeug.security import generate_password_hash, check_password_hash
+from backend import leaderboard as leaderboard_index
+from backend import http_client, passwords
+from backend.db_helpers import upsert_returning
+from sqlalchemy.exc import IntegrityError
 import os
-import requests
 
 auth_bp = Blueprint('auth', __name__)
 
 
+def _busy():
+    resp = jsonify({'ok': False, 'error': 'busy', 'retry_after': 1})
+    resp.headers['Retry-After'] = '1'
+    return resp, 503
+
+
 @auth_bp.route('/api/v1/auth/signup', methods=['POST'])
 def signup():
     data = request.get_json() or {}
@@ -18,6 +27,9 @@ def signup():
     email = data.get('email')
     if not username or not password:
         return jsonify({'ok': False, 'error': 'username and password required'}), 400
+    allowed, info = check_policy('auth', f'signup:{request.remote_addr}')
+    if not allowed:
+        return jsonify({'ok': False, 'error': 'rate_limited', 'retry_after': info.get('reset_seconds')}), 429
     # check uniqueness (avoid NULL matching where email is None)
     existing = db.session.query(User).filter(User.username == username).first()
     if existing:
@@ -25,10 +37,14 @@ def signup():
     if email:
         if db.session.query(User).filter(User.email == email).first():
             return jsonify({'ok': False, 'error': 'email already exists'}), 400
-    pw_hash = generate_password_hash(password)
+    try:
+        pw_hash = passwords.hash_password(password)
+    except passwords.HashBusy:
+        return _busy()
     user = User(username=username, display_name=display_name or username, email=email, password_hash=pw_hash)
     db.session.add(user)
     db.session.commit()
+    leaderboard_index.record_user(user)
     token = create_token(user.id)
     return jsonify({'ok': True, 'token': token, 'user': user.to_dict()}), 201
 
@@ -40,11 +56,23 @@ def login():
     password = data.get('password')
     if not username or not password:
         return jsonify({'ok': False, 'error': 'username and password required'}), 400
+    # throttle per account so password guessing is limited even across many IPs
+    allowed, info = check_policy('auth', f'login:{username}')
+    if not allowed:
+        return jsonify({'ok': False, 'error': 'rate_limited', 'retry_after': info.get('reset_seconds')}), 429
     user = db.session.query(User).filter_by(username=username).first()
     if not user or not user.password_hash:
         return jsonify({'ok': False, 'error': 'invalid credentials'}), 401
-    if not check_password_hash(user.password_hash, password):
+    try:
+        ok, new_hash = passwords.verify_password(user.password_hash, password)
+    except passwords.HashBusy:
+        return _busy()
+    if not ok:
         return jsonify({'ok': False, 'error': 'invalid credentials'}), 401
+    if new_hash:
+        # hashed with old parameters: store the upgraded hash
+        user.password_hash = new_hash
+        db.session.commit()
     token = create_token(user.id)
     return jsonify({'ok': True, 'token': token, 'user': user.to_dict()})
 
@@ -61,10 +89,19 @@ def github_oauth():
         'redirect_uri': redirect_uri,
         'scope': 'read:user user:email',
     }
-    url = 'https://github.com/login/oauth/authorize'
+    url = current_app.config.get('GITHUB_OAUTH_URL', 'https://github.com') + '/login/oauth/authorize'
     return redirect(f"{url}?client_id={client_id}&redirect_uri={redirect_uri}&scope=read:user user:email")
 
 
+def _github_profile(access_token: str):
+    """GitHub's /user for `access_token`, or None if GitHub refused it."""
+    # not cached: every code exchange yields a fresh token, so a token-keyed entry never hits
+    api = current_app.config.get('GITHUB_API_URL', 'https://api.github.com')
+    r = http_client.request('GET', f'{api}/user', headers={'Authorization': f'token {access_token}',
+                                                           'Accept': 'application/vnd.github+json'})
+    return r.json() if r.status_code == 200 else None
+
+
 @auth_bp.route('/api/v1/auth/github/callback', methods=['GET'])
 def github_callback():
     # exchange code for token and find/create user
@@ -73,27 +110,38 @@ def github_callback():
     client_secret = os.getenv('GITHUB_CLIENT_SECRET')
     if not client_id or not client_secret or not code:
         return jsonify({'ok': False, 'error': 'GitHub OAuth misconfigured or missing code'}), 400
-    token_url = 'https://github.com/login/oauth/access_token'
+    from requests import RequestException  # deferred with the rest of `requests` (see http_client)
+    token_url = current_app.config.get('GITHUB_OAUTH_URL', 'https://github.com') + '/login/oauth/access_token'
     headers = {'Accept': 'application/json'}
     data = {'client_id': client_id, 'client_secret': client_secret, 'code': code}
-    r = requests.post(token_url, data=data, headers=headers)
-    if r.status_code != 200:
-        return jsonify({'ok': False, 'error': 'failed to exchange code'}), 400
-    token_data = r.json()
-    access_token = token_data.get('access_token')
-    if not access_token:
-        return jsonify({'ok': False, 'error': 'no access token from GitHub'}), 400
-    # fetch user info
-    user_info = requests.get('https://api.github.com/user', headers={'Authorization': f'token {access_token}'}).json()
+    try:
+        r = http_client.request('POST', token_url, data=data, headers=headers)
+        if r.status_code != 200:
+            return jsonify({'ok': False, 'error': 'failed to exchange code'}), 400
+        access_token = r.json().get('access_token')
+        if not access_token:
+            return jsonify({'ok': False, 'error': 'no access token from GitHub'}), 400
+        user_info = _github_profile(access_token)
+    except (RequestException, ValueError):
+        current_app.logger.exception('GitHub OAuth request failed')
+        return jsonify({'ok': False, 'error': 'GitHub unavailable'}), 502
+    if not user_info or user_info.get('id') is None:
+        return jsonify({'ok': False, 'error': 'failed to fetch GitHub profile'}), 502
     github_id = str(user_info.get('id'))
     display_name = user_info.get('name') or user_info.get('login')
     email = user_info.get('email')
-    user = db.session.query(User).filter_by(github_id=github_id).first()
-    if not user:
-        # create new user
-        user = User(display_name=display_name or github_id, email=email, github_id=github_id)
-        db.session.add(user)
+    # find-or-create in one statement; an existing user's profile is left as is
+    values = {'github_id': github_id, 'display_name': display_name or github_id, 'email': email}
+    try:
+        (user_id,) = upsert_returning(User, values, ('github_id',))
+        db.session.commit()
+    except IntegrityError:
+        # the email already belongs to another account
+        db.session.rollback()
+        (user_id,) = upsert_returning(User, {**values, 'email': None}, ('github_id',))
         db.session.commit()
+    user = db.session.get(User, user_id)
+    leaderboard_index.record_user(user)
     token = create_token(user.id)
     return jsonify({'ok': True, 'token': token, 'user': user.to_dict()})
 
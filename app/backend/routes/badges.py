@@ -1,16 +1,48 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from backend.app import db
 from backend.models import Badge, UserBadge, User
 from backend.auth import get_auth_user_id
+from backend import badge_rules, cache, outbox, profiles
+from backend.db_helpers import insert_ignore
 
 badges_bp = Blueprint('badges', __name__)
 
 
+def _load_badge_catalog():
+    badges = Badge.query.order_by(Badge.id).all()
+    rows = [{'id': x.id, 'code': x.code, 'name': x.name, 'description': x.description, 'icon': x.icon,
+             'rule': x.rule} for x in badges]
+    return {
+        'by_code': {r['code']: r for r in rows},
+        'by_id': {r['id']: r for r in rows},
+        'rules': badge_rules.compile_rules(rows),
+        'response': cache.encode_json({'ok': True, 'badges': rows}),
+    }
+
+
+def get_badge_catalog():
+    """Badge catalog keyed by code and id plus the compiled award rules, cached for
+    BADGE_CACHE_TTL_SECONDS."""
+    ttl = float(current_app.config.get('BADGE_CACHE_TTL_SECONDS', 300))
+    return cache.get_or_load('badges', 'catalog', _load_badge_catalog, ttl)
+
+
+def invalidate_badge_catalog():
+    cache.invalidate('badges')
+
+
+def find_badge(code: str):
+    """Return the catalog row for `code`, refreshing the catalog if it was added since."""
+    row = get_badge_catalog()['by_code'].get(code)
+    if row is None and Badge.query.filter_by(code=code).first() is not None:
+        invalidate_badge_catalog()
+        row = get_badge_catalog()['by_code'].get(code)
+    return row
+
+
 @badges_bp.route('/api/v1/badges', methods=['GET'])
 def list_badges():
-    b = Badge.query.all()
-    rows = [{'id': x.id, 'code': x.code, 'name': x.name, 'description': x.description, 'icon': x.icon} for x in b]
-    return jsonify({'ok': True, 'badges': rows})
+    return cache.json_response(get_badge_catalog()['response'])
 
 
 @badges_bp.route('/api/v1/users/<int:user_id>/badges', methods=['POST'])
@@ -28,14 +60,15 @@ def award_badge(user_id):
     user = db.session.get(User, user_id)
     if not user:
         return jsonify({'ok': False, 'error': 'user not found'}), 404
-    badge = Badge.query.filter_by(code=badge_code).first()
+    badge = find_badge(badge_code)
     if not badge:
         return jsonify({'ok': False, 'error': 'badge not found'}), 404
-    # avoid duplicates
-    existing = UserBadge.query.filter_by(user_id=user.id, badge_id=badge.id).first()
-    if existing:
-        return jsonify({'ok': True, 'message': 'already awarded'})
-    ub = UserBadge(user_id=user.id, badge_id=badge.id)
-    db.session.add(ub)
+    # upsert against uq_user_badges_user_badge: duplicates are a no-op, even under races
+    inserted = insert_ignore(UserBadge, {'user_id': user.id, 'badge_id': badge['id']}, ('user_id', 'badge_id'))
+    if inserted:
+        outbox.emit('badge.awarded', user.id, {'user_id': user.id, 'badge_id': badge['id'], 'code': badge['code']})
     db.session.commit()
-    return jsonify({'ok': True, 'awarded': {'user_id': user.id, 'badge_id': badge.id}}), 201
+    if not inserted:
+        return jsonify({'ok': True, 'message': 'already awarded'})
+    profiles.invalidate_user(user.id)
+    return jsonify({'ok': True, 'awarded': {'user_id': user.id, 'badge_id': badge['id']}}), 201
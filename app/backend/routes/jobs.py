@@ -1,32 +1,25 @@
-from flask import Blueprint, request, jsonify, current_app, abort
+from flask import Blueprint, request, jsonify, current_app, abort, Response, stream_with_context
 from backend.app import db
 from backend.models import JobRecord, User
 from backend.auth import get_auth_user_id
-from backend.rate_limiter import check_rate_limit
-from time import time
-import os
+from backend.rate_limiter import check_policy
+from backend import job_control, job_output, redis_client
+from backend.pagination import keyset_page, next_cursor
+from sqlalchemy import select, update
 import json
-try:
-    import redis
-    _Redis = redis.Redis
-except Exception:
-    _Redis = None
+import time
 
-# simple in-memory quota store for jobs when Redis is not available: {user_id: [timestamps...]}
-_job_quota_store = {}
+JOB_DONE_STATUSES = ('finished', 'failed', 'cancelled')
 
 jobs_bp = Blueprint('jobs', __name__)
 
 
 def _get_redis_conn():
-    """Return a Redis connection from REDIS_URL or None."""
+    """Return the shared Redis client for REDIS_URL or None."""
     redis_url = current_app.config.get('REDIS_URL')
-    if not redis_url or _Redis is None:
-        return None
-    try:
-        return _Redis.from_url(redis_url)
-    except Exception:
+    if not redis_url:
         return None
+    return redis_client.get_redis(redis_url)
 
 
 @jobs_bp.route('/api/v1/jobs', methods=['POST'])
@@ -54,57 +47,38 @@ def submit_job():
     if len(payload_s.encode('utf-8')) > max_payload:
         return jsonify({'ok': False, 'error': 'payload_too_large'}), 400
 
-    job = JobRecord(user_id=user_id, language=language, payload=payload_s, status='queued')
-
-    # enforce simple per-user job quota (configurable)
-    quota = int(current_app.config.get('JOB_QUOTA_PER_MINUTE', 10))
-    window = int(current_app.config.get('JOB_QUOTA_WINDOW_SECONDS', 60))
-    now = int(time())
-
-    conn = _get_redis_conn()
-    if conn:
-        try:
-            # use fixed window keyed by window start timestamp
-            window_start = now - (now % window)
-            key = f"job_quota:{user_id}:{window_start}"
-            val = conn.incr(key)
-            if val == 1:
-                conn.expire(key, window)
-            if int(val) > quota:
-                ttl = conn.ttl(key) or window
-                return jsonify({'ok': False, 'error': 'job_rate_limited', 'retry_after': int(ttl)}), 429
-        except Exception:
-            # fallback to in-memory if Redis not reachable
-            conn = None
-
-    if not conn:
-        # in-memory fallback (per-process only)
-        entries = _job_quota_store.get(user_id, [])
-        entries = [t for t in entries if t > now - window]
-        if len(entries) >= quota:
-            return jsonify({'ok': False, 'error': 'job_rate_limited', 'retry_after': entries[0] + window - now}), 429
-        entries.append(now)
-        _job_quota_store[user_id] = entries
-
+    try:
+        priority = min(max(int(data.get('priority', 0)), 0), 9)
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'priority must be an integer'}), 400
+
+    # enforce per-user job quota (JOB_RATE_LIMIT or JOB_QUOTA_* settings)
+    allowed, info = check_policy('jobs', user_id)
+    if not allowed:
+        return jsonify({'ok': False, 'error': 'job_rate_limited', 'retry_after': info.get('reset_seconds')}), 429
+
+    # Enqueue to Redis RQ if configured; otherwise leave as queued for the scheduler
+    # (JOB_DISPATCH=scheduler always leaves jobs queued for backend.scheduler).
+    # RQ-bound jobs are inserted `enqueued`, which the scheduler never claims.
+    conn = _get_redis_conn() if current_app.config.get('JOB_DISPATCH', 'rq') == 'rq' else None
+    job = JobRecord(user_id=user_id, language=language, payload=payload_s,
+                    status='enqueued' if conn else 'queued', priority=priority)
     db.session.add(job)
     db.session.commit()
 
-    # Try to enqueue to Redis RQ if configured; otherwise leave as queued for manual worker
-    conn = _get_redis_conn()
     if conn:
         try:
             from rq import Queue
-            from redis import Redis
             # import worker function lazily
             from backend.scripts.worker import run_job
             q = Queue('default', connection=conn)
-            q.enqueue(run_job, job.id)
-            job.status = 'enqueued'
-            db.session.commit()
+            q.enqueue(run_job, job.id, job_id=job_control.rq_job_id(job.id))
         except Exception as e:
-            # leave job as queued but record the enqueue failure for observability
+            # hand the job to the scheduler and record the enqueue failure for observability
             current_app.logger.exception('failed to enqueue job')
-            job.output = f'failed to enqueue: {str(e)}'
+            db.session.execute(
+                update(JobRecord).where(JobRecord.id == job.id, JobRecord.status == 'enqueued')
+                .values(status='queued', output=f'failed to enqueue: {str(e)}'))
             db.session.commit()
 
     return jsonify({'ok': True, 'job_id': job.id, 'status': job.status}), 201
@@ -112,19 +86,30 @@ def submit_job():
 
 @jobs_bp.route('/api/v1/jobs', methods=['GET'])
 def list_jobs():
-    """List jobs for the authenticated user (simple pagination)."""
+    """List jobs for the authenticated user, newest first.
+
+    Pass the returned `next_cursor` as `cursor` to fetch the next page. The legacy `offset`
+    parameter is still honoured when no cursor is given.
+    """
     uid = get_auth_user_id()
     if uid is None:
         return jsonify({'ok': False, 'error': 'authentication required'}), 401
     user_id = int(uid)
     limit = min(int(request.args.get('limit', 50)), 200)
+    cursor = request.args.get('cursor')
+    stmt = select(JobRecord).where(JobRecord.user_id == user_id)
+    try:
+        stmt = keyset_page(stmt, JobRecord.created_at, JobRecord.id, cursor, limit)
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
     offset = int(request.args.get('offset', 0))
-    qs = db.session.query(JobRecord).filter_by(user_id=user_id).order_by(JobRecord.created_at.desc())
-    items = qs.offset(offset).limit(limit).all()
+    if offset and not cursor:
+        stmt = stmt.offset(offset)
+    items = db.session.execute(stmt).scalars().all()
     return jsonify({'ok': True, 'jobs': [
         {'id': j.id, 'status': j.status, 'created_at': j.created_at.isoformat() if j.created_at else None}
         for j in items
-    ]})
+    ], 'next_cursor': next_cursor(items, limit)})
 
 
 @jobs_bp.route('/api/v1/jobs/<int:job_id>', methods=['GET'])
@@ -147,39 +132,110 @@ def get_job(job_id):
     }})
 
 
-@jobs_bp.route('/api/v1/jobs/<int:job_id>/cancel', methods=['POST'])
-def cancel_job(job_id):
-    """Attempt to cancel a queued/enqueued job. This is a best-effort operation."""
+def _owned_job(job_id):
+    """Return (job, None) or (None, error response) for the authenticated owner."""
     job = db.session.get(JobRecord, job_id)
     if not job:
-        return jsonify({'ok': False, 'error': 'job not found'}), 404
+        return None, (jsonify({'ok': False, 'error': 'job not found'}), 404)
     uid = get_auth_user_id()
     if uid is None or int(uid) != job.user_id:
-        return jsonify({'ok': False, 'error': 'not authorized'}), 403
+        return None, (jsonify({'ok': False, 'error': 'not authorized'}), 403)
+    return job, None
+
+
+@jobs_bp.route('/api/v1/jobs/<int:job_id>/output', methods=['GET'])
+def get_job_output(job_id):
+    """Output chunks with seq > `after`, oldest first. Poll again with `after=next_after`
+    until `done` is true and no chunks are returned."""
+    job, error = _owned_job(job_id)
+    if error:
+        return error
+    try:
+        after = int(request.args.get('after', 0))
+        limit = min(max(int(request.args.get('limit', 100)), 1), 500)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'after and limit must be integers'}), 400
+    # read the status first: chunks written before the job finished are all visible then
+    status = job.status
+    rows = job_output.read_chunks(db.session, job_id, after, limit)
+    return jsonify({'ok': True, 'job_id': job_id, 'status': status, 'done': status in JOB_DONE_STATUSES,
+                    'chunks': [{'seq': seq, 'data': data} for seq, data in rows],
+                    'next_after': rows[-1][0] if rows else after})
+
+
+@jobs_bp.route('/api/v1/jobs/<int:job_id>/output/stream')
+def stream_job_output(job_id):
+    """Tail a job's output over SSE: one `output` event per chunk (id = seq), then a
+    final `end` event carrying the job status. Resumes after `Last-Event-ID`."""
+    job, error = _owned_job(job_id)
+    if error:
+        return error
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid Last-Event-ID'}), 400
+    poll = float(current_app.config.get('JOB_OUTPUT_POLL_SECONDS', 0.5))
+    heartbeat = float(current_app.config.get('JOB_OUTPUT_HEARTBEAT_SECONDS', 15))
+
+    def generate(after):
+        last_sent = time.monotonic()
+        while True:
+            status = db.session.execute(select(JobRecord.status).where(JobRecord.id == job_id)).scalar()
+            rows = job_output.read_chunks(db.session, job_id, after)
+            # end the read transaction so the next poll sees newly committed chunks
+            db.session.commit()
+            for seq, data in rows:
+                yield f'id: {seq}\nevent: output\ndata: {json.dumps(data)}\n\n'
+                after = seq
+                last_sent = time.monotonic()
+            if rows:
+                continue
+            if status in JOB_DONE_STATUSES:
+                yield f'event: end\ndata: {json.dumps({"status": status})}\n\n'
+                return
+            if time.monotonic() - last_sent >= heartbeat:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(poll)
+
+    return Response(stream_with_context(generate(after)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-    if job.status in ('finished', 'failed', 'cancelled'):
+
+@jobs_bp.route('/api/v1/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued, enqueued or running job. A running job's process is killed by its
+    worker within JOB_CANCEL_POLL_SECONDS."""
+    job, error = _owned_job(job_id)
+    if error:
+        return error
+
+    if job.status in JOB_DONE_STATUSES:
         return jsonify({'ok': False, 'error': 'cannot_cancel', 'status': job.status}), 400
 
-    # try to remove from RQ queue if present
-    conn = _get_redis_conn()
-    removed = False
-    if conn:
-        try:
-            from rq import Queue
-            q = Queue('default', connection=conn)
-            # find jobs with meta or arg matching our job id; best-effort
-            for queued in q.jobs:
-                try:
-                    if queued.args and queued.args[0] == job.id:
-                        queued.cancel()
-                        removed = True
-                except Exception:
-                    continue
-        except Exception:
-            current_app.logger.exception('failed to query RQ for cancel')
-
-    job.status = 'cancelled'
-    job.finished_at = job.finished_at or None
-    job.output = (job.output or '') + '\n[cancelled by user]'
-    db.session.commit()
-    return jsonify({'ok': True, 'cancelled': True, 'removed_from_queue': removed})
+    result = job_control.cancel_jobs(db.session, _get_redis_conn(), job_ids=[job_id])
+    if not result['cancelled']:
+        # finished between the check and the update
+        db.session.refresh(job)
+        return jsonify({'ok': False, 'error': 'cannot_cancel', 'status': job.status}), 400
+    return jsonify({'ok': True, 'cancelled': True, 'removed_from_queue': bool(result['removed_from_queue']),
+                    'was_running': bool(result['running'])})
+
+
+@jobs_bp.route('/api/v1/jobs/cancel', methods=['POST'])
+def cancel_jobs():
+    """Cancel all of the authenticated user's active jobs, optionally only those in the
+    given `status` list (queued, enqueued, running)."""
+    uid = get_auth_user_id()
+    if uid is None:
+        return jsonify({'ok': False, 'error': 'authentication required'}), 401
+    data = request.get_json(silent=True) or {}
+    statuses = data.get('status') or list(job_control.ACTIVE_STATUSES)
+    if isinstance(statuses, str):
+        statuses = [statuses]
+    invalid = [s for s in statuses if s not in job_control.ACTIVE_STATUSES]
+    if invalid:
+        return jsonify({'ok': False, 'error': f'cannot cancel jobs in status: {", ".join(map(str, invalid))}'}), 400
+    result = job_control.cancel_jobs(db.session, _get_redis_conn(), user_id=int(uid), statuses=statuses)
+    return jsonify({'ok': True, 'cancelled': len(result['cancelled']), 'job_ids': result['cancelled'],
+                    'removed_from_queue': result['removed_from_queue'], 'running': len(result['running'])})
@@ -1,9 +1,14 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, Response, current_app, stream_with_context
 from backend.app import db
-from backend.models import User, XPEvent, UserBadge, Badge, Streak
+from backend.models import User, XPEvent, Streak
 from backend.schemas import compute_new_level, next_level_threshold
-from flask import Blueprint, jsonify, request
 from backend.auth import get_auth_user_id
+from backend import badge_rules, cache, outbox, profiles, rollups
+from backend.db_helpers import insert_ignore
+from backend.pagination import keyset_page, next_cursor, parse_timestamp
+from sqlalchemy import select
+import json
+from backend import leaderboard as leaderboard_index
 
 users_bp = Blueprint('users', __name__)
 
@@ -16,74 +21,117 @@ def create_user():
     u = User(display_name=name, email=email)
     db.session.add(u)
     db.session.commit()
+    leaderboard_index.record_user(u)
     return jsonify({'ok': True, 'user': u.to_dict()}), 201
 
 
+def _build_user_stats(user_id):
+    u, _ = profiles.load_user(user_id)
+    if not u:
+        return None
+    recent = profiles.recent_events(u.id)
+    badges = profiles.user_badges(u.id)
+    return cache.encode_json({'ok': True, 'user': u.to_dict(), 'recent_events': recent, 'badges': badges})
+
+
 @users_bp.route('/api/v1/users/<int:user_id>/stats', methods=['GET'])
 def user_stats(user_id):
-    u = db.session.get(User, user_id)
-    if not u:
+    encoded = cache.get_or_load('user_stats', user_id, lambda: _build_user_stats(user_id), profiles.cache_ttl())
+    if encoded is None:
         return jsonify({'ok': False, 'error': 'user not found'}), 404
-    events = XPEvent.query.filter_by(user_id=u.id).order_by(XPEvent.created_at.desc()).limit(10).all()
-    recent = [{'id': e.id, 'amount': e.amount, 'source': e.source, 'created_at': e.created_at.isoformat()} for e in events]
+    return cache.json_response(encoded)
+
+
+def _xp_events_stmt(user_id, args):
+    """Column select over a user's XP events with optional source / date-range filters."""
+    stmt = select(XPEvent.id, XPEvent.amount, XPEvent.source, XPEvent.source_id, XPEvent.created_at).where(
+        XPEvent.user_id == user_id)
+    if args.get('source'):
+        stmt = stmt.where(XPEvent.source == args['source'])
+    if args.get('since'):
+        stmt = stmt.where(XPEvent.created_at >= parse_timestamp(args['since']))
+    if args.get('until'):
+        stmt = stmt.where(XPEvent.created_at < parse_timestamp(args['until']))
+    return stmt
+
+
+def _xp_event_dict(e):
+    return {'id': e.id, 'amount': e.amount, 'source': e.source, 'source_id': e.source_id,
+            'created_at': e.created_at.isoformat()}
 
-    # include earned badges
-    user_badges = UserBadge.query.filter_by(user_id=u.id).join(Badge, UserBadge.badge_id == Badge.id).all()
-    badges = []
-    # Note: join above returns UserBadge objects; fetch badge records
-    for ub in UserBadge.query.filter_by(user_id=u.id).all():
-        b = db.session.get(Badge, ub.badge_id)
-        if b:
-            badges.append({'id': b.id, 'code': b.code, 'name': b.name, 'earned_at': ub.earned_at.isoformat()})
 
-    return jsonify({'ok': True, 'user': u.to_dict(), 'recent_events': recent, 'badges': badges})
+@users_bp.route('/api/v1/users/<int:user_id>/xp-events', methods=['GET'])
+def list_xp_events(user_id):
+    """Page through a user's XP history, newest first.
+
+    Query params: `limit` (max 500), `cursor` (from `next_cursor`), `source`, `since` and
+    `until` (ISO-8601, `until` exclusive). With `format=ndjson` every matching event is
+    streamed as one JSON object per line, fetched in keyset chunks so the full history is
+    never held in memory.
+    """
+    if db.session.get(User, user_id) is None:
+        return jsonify({'ok': False, 'error': 'user not found'}), 404
+    args = request.args
+    try:
+        base = _xp_events_stmt(user_id, args)
+        limit = min(int(args.get('limit', 50)), 500)
+        cursor = args.get('cursor')
+        stmt = keyset_page(base, XPEvent.created_at, XPEvent.id, cursor, limit)
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+
+    if args.get('format') == 'ndjson':
+        chunk = int(current_app.config.get('XP_EVENTS_STREAM_CHUNK', 1000))
+
+        def generate(after):
+            while True:
+                rows = db.session.execute(keyset_page(base, XPEvent.created_at, XPEvent.id, after, chunk)).all()
+                for e in rows:
+                    yield json.dumps(_xp_event_dict(e)) + '\n'
+                if len(rows) < chunk:
+                    return
+                after = (rows[-1].created_at, rows[-1].id)
+
+        return Response(stream_with_context(generate(cursor)), mimetype='application/x-ndjson')
+
+    rows = db.session.execute(stmt).all()
+    return jsonify({'ok': True, 'events': [_xp_event_dict(e) for e in rows], 'next_cursor': next_cursor(rows, limit)})
+
+
+@users_bp.route('/api/v1/users/<int:user_id>/xp-summary', methods=['GET'])
+def xp_summary(user_id):
+    """XP earned per bucket with a per-source breakdown, read from `xp_rollups`.
+
+    Query params: `period` (day, week or month; default week) and `buckets` (how many
+    buckets back from the current one, max 60).
+    """
+    period = request.args.get('period', 'week')
+    if period not in rollups.PERIODS:
+        return jsonify({'ok': False, 'error': f'invalid period: {period}'}), 400
+    buckets = min(max(int(request.args.get('buckets', 1)), 1), 60)
+    if db.session.get(User, user_id) is None:
+        return jsonify({'ok': False, 'error': 'user not found'}), 404
+    return jsonify({'ok': True, 'user_id': user_id, 'period': period,
+                    'buckets': rollups.summary(user_id, period, buckets)})
 
 
 @users_bp.route('/api/v1/users/<int:user_id>/badges', methods=['GET'])
 def list_user_badges(user_id):
-    u = db.session.get(User, user_id)
+    u, _ = profiles.load_user(user_id)
     if not u:
         return jsonify({'ok': False, 'error': 'user not found'}), 404
-    ubs = UserBadge.query.filter_by(user_id=u.id).all()
-    rows = []
-    for ub in ubs:
-        b = db.session.get(Badge, ub.badge_id)
-        if b:
-            rows.append({'id': b.id, 'code': b.code, 'name': b.name, 'description': b.description, 'earned_at': ub.earned_at.isoformat()})
-    return jsonify({'ok': True, 'badges': rows})
+    return cache.json_response(cache.encode_json({'ok': True, 'badges': profiles.user_badges(u.id, with_description=True)}))
 
 
-@users_bp.route('/api/v1/me/progress', methods=['GET'])
-def me_progress():
-    """Return current authenticated user's progress: xp, level, streak, recent xp events and badges."""
-    uid = get_auth_user_id()
-    if uid is None:
-        return jsonify({'ok': False, 'error': 'unauthorized'}), 401
-
-    u = db.session.get(User, int(uid))
+def _build_me_progress(user_id):
+    # user and streak in one query, then recent events and badges: three queries in total
+    u, streak = profiles.load_user(user_id, with_streak=True)
     if not u:
-        return jsonify({'ok': False, 'error': 'user not found'}), 404
+        return None
 
-    # streak info (if present)
-    streak = Streak.query.filter_by(user_id=u.id).first()
-    streak_info = {}
-    if streak:
-        streak_info = {
-            'current_streak': streak.current_streak,
-            'last_checkin_date': streak.last_checkin_date.isoformat() if streak.last_checkin_date else None,
-        }
-
-    # recent xp events
-    events = XPEvent.query.filter_by(user_id=u.id).order_by(XPEvent.created_at.desc()).limit(10).all()
-    recent = [{'id': e.id, 'amount': e.amount, 'source': e.source, 'created_at': e.created_at.isoformat()} for e in events]
-
-    # earned badges
-    ubs = UserBadge.query.filter_by(user_id=u.id).all()
-    badges = []
-    for ub in ubs:
-        b = db.session.get(Badge, ub.badge_id)
-        if b:
-            badges.append({'id': b.id, 'code': b.code, 'name': b.name, 'earned_at': ub.earned_at.isoformat()})
+    streak_info = profiles.streak_dict(streak)
+    recent = profiles.recent_events(u.id)
+    badges = profiles.user_badges(u.id)
 
     # include level/progression info using existing XP math
     current_xp = getattr(u, 'xp_total', 0) or 0
@@ -95,7 +143,7 @@ def me_progress():
     denom = max(1, next_threshold - prev_threshold)
     progress_pct = int(((current_xp - prev_threshold) / denom) * 100) if denom else 0
 
-    return jsonify({
+    return cache.encode_json({
         'ok': True,
         'user': u.to_dict(),
         'streak': streak_info,
@@ -109,6 +157,18 @@ def me_progress():
     })
 
 
+@users_bp.route('/api/v1/me/progress', methods=['GET'])
+def me_progress():
+    """Return current authenticated user's progress: xp, level, streak, recent xp events and badges."""
+    uid = get_auth_user_id()
+    if uid is None:
+        return jsonify({'ok': False, 'error': 'unauthorized'}), 401
+    uid = int(uid)
+    encoded = cache.get_or_load('me_progress', uid, lambda: _build_me_progress(uid), profiles.cache_ttl())
+    if encoded is None:
+        return jsonify({'ok': False, 'error': 'user not found'}), 404
+    return cache.json_response(encoded)
+
 
 @users_bp.route('/api/v1/me/checkin', methods=['POST'])
 def me_checkin():
@@ -127,10 +187,9 @@ def me_checkin():
     from datetime import date
 
     today = date.today()
-    streak = Streak.query.filter_by(user_id=u.id).first()
-    if not streak:
-        streak = Streak(user_id=u.id, current_streak=0, last_checkin_date=None)
-        db.session.add(streak)
+    # upsert against uq_streaks_user_id, then lock the single streak row
+    insert_ignore(Streak, {'user_id': u.id, 'current_streak': 0, 'last_checkin_date': None}, ('user_id',))
+    streak = db.session.execute(select(Streak).where(Streak.user_id == u.id).with_for_update()).scalar_one()
 
     if streak.last_checkin_date == today:
         return jsonify({'ok': True, 'duplicate': True, 'message': 'already checked in today', 'current_streak': streak.current_streak}), 200
@@ -146,13 +205,24 @@ def me_checkin():
     from backend.models import XPEvent
     ev = XPEvent(user_id=u.id, amount=xp_award, source='daily_checkin', source_id=today.isoformat())
     db.session.add(ev)
+    rollups.record_events([ev])
 
     u.xp_total = (u.xp_total or 0) + xp_award
     old_level = u.level or 1
     new_level = compute_new_level(u.xp_total)
     u.level = new_level
+    outbox.emit('streak.checkin', u.id, {
+        'user_id': u.id, 'date': today.isoformat(), 'current_streak': streak.current_streak,
+        'amount': xp_award, 'new_xp': u.xp_total, 'new_level': new_level, 'leveled_up': new_level > old_level,
+    })
+    new_badges = badge_rules.evaluate([('streak.checkin', u.id, {
+        'xp_total': u.xp_total, 'streak': streak.current_streak, 'source': 'daily_checkin'})])
 
     db.session.commit()
+    leaderboard_index.record_user(u)
+    profiles.invalidate_user(u.id)
 
     leveled_up = new_level > old_level
-    return jsonify({'ok': True, 'new_xp': u.xp_total, 'new_level': u.level, 'leveled_up': leveled_up, 'current_streak': streak.current_streak}), 200
+    return jsonify({'ok': True, 'new_xp': u.xp_total, 'new_level': u.level, 'leveled_up': leveled_up,
+                    'current_streak': streak.current_streak,
+                    'new_badges': [code for _uid, _bid, code in new_badges]}), 200
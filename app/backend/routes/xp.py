@@ -1,13 +1,14 @@
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, current_app
 from backend.app import db
 from backend.models import User, XPEvent
 from backend.schemas import validate_award_payload, compute_new_level, next_level_threshold
 from backend.auth import get_auth_user_id, require_auth_or_payload_user
-from backend.rate_limiter import check_rate_limit
+from backend.rate_limiter import check_policy
+from backend import leaderboard as leaderboard_index
+from backend import badge_rules, ingest, outbox, profiles, rollups
+from backend import leaderboard_stream as leaderboard_stream_hub
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import select
-import json
-import time
+from sqlalchemy import select, or_, tuple_
 
 xp_bp = Blueprint('xp', __name__)
 
@@ -43,9 +44,8 @@ def award_xp():
     if not user:
         return jsonify({'ok': False, 'error': 'user not found'}), 404
 
-    # rate limit (per-user if available, otherwise per-ip)
-    rl_key = f"xp:{user.id}" if user else f"xp:anon:{request.remote_addr}"
-    allowed, info = check_rate_limit(rl_key)
+    # rate limit per user
+    allowed, info = check_policy('xp', user.id)
     if not allowed:
         return jsonify({'ok': False, 'error': 'rate_limited', 'retry_after': info.get('reset_seconds')}), 429
 
@@ -72,6 +72,9 @@ def award_xp():
                 'new_level': user.level,
             })
 
+    if ingest.enabled():
+        return _enqueue_award(user, xp_amount, source, source_id, metadata, idemp)
+
     # transactionally update user totals and insert event
     try:
         # lock the user row for update to avoid race conditions (best-effort; sqlite may ignore FOR UPDATE)
@@ -79,14 +82,23 @@ def award_xp():
         db.session.execute(stmt)
         event = XPEvent(user_id=user.id, amount=xp_amount, source=source, source_id=source_id, meta=metadata, idempotency_key=idemp)
         db.session.add(event)
+        rollups.record_events([event])
 
         # update totals
         user.xp_total = (user.xp_total or 0) + xp_amount
         old_level = user.level or 1
         new_level = compute_new_level(user.xp_total)
         user.level = new_level
+        outbox.emit('xp.awarded', user.id, {
+            'user_id': user.id, 'amount': xp_amount, 'source': source, 'source_id': source_id,
+            'idempotency_key': idemp, 'new_xp': user.xp_total, 'new_level': new_level,
+            'leveled_up': new_level > old_level,
+        })
+        new_badges = badge_rules.evaluate([('xp.awarded', user.id, {'xp_total': user.xp_total, 'source': source})])
 
         db.session.commit()
+        leaderboard_index.record_user(user)
+        profiles.invalidate_user(user.id)
     except IntegrityError:
         # unique constraint violation — treat as duplicate
         db.session.rollback()
@@ -112,36 +124,261 @@ def award_xp():
         'new_level': user.level,
         'leveled_up': leveled_up,
         'next_level_threshold': next_level_threshold(user.level),
+        'new_badges': [code for _uid, _bid, code in new_badges],
     })
 
+
+def _enqueue_award(user, xp_amount, source, source_id, metadata, idemp):
+    """Async ingestion (XP_INGEST_MODE=async): queue the event without locking the user row."""
+    try:
+        event_id = ingest.enqueue(user.id, xp_amount, source, source_id, metadata, idemp)
+    except IntegrityError:
+        # a concurrent request queued the same key first
+        db.session.rollback()
+        return jsonify({'ok': True, 'duplicate': True, 'new_xp': user.xp_total, 'new_level': user.level})
+    ingest.ensure_started(current_app._get_current_object())
+    body = {'ok': True, 'queued': True, 'event_id': event_id}
+    if ingest.read_your_writes():
+        projected = ingest.projected_total(user)
+        body.update({'new_xp': projected, 'new_level': compute_new_level(projected)})
+    return jsonify(body), 202
+
+
+def _validate_batch_item(item, token_uid):
+    """Return (award dict, error) for one batch item using the same rules as award_xp."""
+    if not isinstance(item, dict):
+        return None, 'award must be an object'
+    ok, err = validate_award_payload(item)
+    if not ok:
+        return None, err
+    try:
+        user_id = int(token_uid) if token_uid is not None else int(item['user_id'])
+    except Exception:
+        return None, 'invalid user_id'
+    source = item.get('source')
+    source_id = item.get('source_id')
+    return {
+        'user_id': user_id,
+        'xp': int(item['xp']),
+        'source': source,
+        'source_id': str(source_id) if source_id is not None else None,
+        'idempotency_key': item.get('idempotency_key'),
+        'metadata': item.get('metadata'),
+    }, None
+
+
+def _charge_xp_limit(user_id: int, count: int):
+    """Charge `count` awards to the user's xp limit in one call. Returns (n allowed,
+    retry_after): when the whole batch does not fit, the tokens left are charged instead."""
+    allowed, info = check_policy('xp', user_id, count)
+    if allowed:
+        return count, None
+    fit = min(max(info.get('remaining') or 0, 0), count)
+    if fit and check_policy('xp', user_id, fit)[0]:
+        return fit, info.get('reset_seconds')
+    return 0, info.get('reset_seconds')
+
+
+# tries of a batch whose insert lost a race on a dedupe key (IntegrityError)
+_BATCH_ATTEMPTS = 3
+
+
+def _apply_award_batch(awards, results, allowance):
+    """Dedupe and persist validated awards in one transaction.
+
+    `awards` is a list of (index, award) pairs that passed validation; `results` is
+    filled in place. The rate limit is charged once per user, before any row is locked;
+    `allowance` ({user_id: (n allowed, retry_after)}) records the charge so a retry of
+    the same batch is not charged again. Awarded items carry the user's running
+    new_xp/new_level after that event. Returns {user_id: (old_level, user)} for the users
+    touched.
+    """
+    user_ids = sorted({a['user_id'] for _i, a in awards})
+    existing = set(db.session.execute(select(User.id).where(User.id.in_(user_ids))).scalars()) if user_ids else set()
+
+    idemp_keys = {(a['user_id'], a['idempotency_key']) for _i, a in awards if a['idempotency_key']}
+    source_keys = {(a['user_id'], a['source'], a['source_id']) for _i, a in awards if a['source'] and a['source_id']}
+    seen_idemp, seen_source = set(), set()
+    conditions = []
+    if idemp_keys:
+        conditions.append(tuple_(XPEvent.user_id, XPEvent.idempotency_key).in_(list(idemp_keys)))
+    if source_keys:
+        conditions.append(tuple_(XPEvent.user_id, XPEvent.source, XPEvent.source_id).in_(list(source_keys)))
+    if conditions:
+        rows = db.session.execute(
+            select(XPEvent.user_id, XPEvent.idempotency_key, XPEvent.source, XPEvent.source_id).where(or_(*conditions))
+        ).all()
+        for r in rows:
+            if r.idempotency_key:
+                seen_idemp.add((r.user_id, r.idempotency_key))
+            if r.source and r.source_id:
+                seen_source.add((r.user_id, r.source, r.source_id))
+
+    accepted = []
+    per_user = {}
+    for index, a in awards:
+        if a['user_id'] not in existing:
+            results[index] = {'index': index, 'status': 'rejected', 'error': 'user not found'}
+            continue
+        ikey = (a['user_id'], a['idempotency_key']) if a['idempotency_key'] else None
+        skey = (a['user_id'], a['source'], a['source_id']) if a['source'] and a['source_id'] else None
+        # duplicates are checked against both stored events and earlier items of this batch
+        if (ikey and ikey in seen_idemp) or (skey and skey in seen_source):
+            results[index] = {'index': index, 'status': 'duplicate', 'user_id': a['user_id']}
+            continue
+        if ikey:
+            seen_idemp.add(ikey)
+        if skey:
+            seen_source.add(skey)
+        accepted.append((index, a))
+        per_user[a['user_id']] = per_user.get(a['user_id'], 0) + 1
+
+    # one limiter round trip per user, outside the row locks
+    for user_id, count in per_user.items():
+        if user_id not in allowance:
+            allowance[user_id] = _charge_xp_limit(user_id, count)
+
+    # lock all affected user rows in one statement (sqlite ignores FOR UPDATE)
+    users = {}
+    if per_user:
+        stmt = select(User).where(User.id.in_(sorted(per_user))).order_by(User.id).with_for_update()
+        users = {u.id: u for u in db.session.execute(stmt).scalars()}
+
+    touched = {}
+    levels = {}
+    events = []
+    used = {}
+    for index, a in accepted:
+        user = users[a['user_id']]
+        allowed, retry_after = allowance[user.id]
+        if used.get(user.id, 0) >= allowed:
+            results[index] = {'index': index, 'status': 'rejected', 'error': 'rate_limited', 'retry_after': retry_after}
+            continue
+        used[user.id] = used.get(user.id, 0) + 1
+        if user.id not in touched:
+            touched[user.id] = (user.level or 1, user)
+            levels[user.id] = user.level or 1
+        user.xp_total = (user.xp_total or 0) + a['xp']
+        # each item reports the running total this event brought the user to
+        level = compute_new_level(user.xp_total)
+        result = {'index': index, 'status': 'awarded', 'user_id': user.id, 'xp': a['xp'], 'new_xp': user.xp_total,
+                  'new_level': level, 'leveled_up': level > levels[user.id]}
+        levels[user.id] = level
+        results[index] = result
+        events.append((XPEvent(user_id=user.id, amount=a['xp'], source=a['source'], source_id=a['source_id'],
+                               meta=a['metadata'], idempotency_key=a['idempotency_key']), result))
+
+    for user_id, (_old_level, user) in touched.items():
+        user.level = levels[user_id]
+    for e, result in events:
+        outbox.emit('xp.awarded', e.user_id, {
+            'user_id': e.user_id, 'amount': e.amount, 'source': e.source, 'source_id': e.source_id,
+            'idempotency_key': e.idempotency_key, 'new_xp': result['new_xp'],
+            'new_level': result['new_level'], 'leveled_up': result['leveled_up'],
+        })
+    events = [e for e, _result in events]
+    db.session.add_all(events)
+    badge_rules.evaluate([('xp.awarded', e.user_id, {'xp_total': users[e.user_id].xp_total, 'source': e.source})
+                          for e in events])
+    rollups.record_events(events)
+    db.session.commit()
+    return touched
+
+
+@xp_bp.route('/api/v1/xp/award/batch', methods=['POST'])
+def award_xp_batch():
+    """Award XP for many events in one transaction.
+
+    Accepts {"awards": [<award payload>, ...]} where each payload has the same shape as
+    /api/v1/xp/award. Every item gets its own result: awarded, duplicate or rejected.
+    """
+    data = request.get_json() or {}
+    items = data.get('awards') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'ok': False, 'error': 'awards must be a non-empty list'}), 400
+    max_items = int(current_app.config.get('XP_BATCH_MAX_ITEMS', 1000))
+    if len(items) > max_items:
+        return jsonify({'ok': False, 'error': f'at most {max_items} awards per batch'}), 400
+
+    token_uid = get_auth_user_id()
+    results = [None] * len(items)
+    awards = []
+    for index, item in enumerate(items):
+        award, err = _validate_batch_item(item, token_uid)
+        if err:
+            results[index] = {'index': index, 'status': 'rejected', 'error': err}
+        else:
+            awards.append((index, award))
+
+    allowance = {}
+    for _attempt in range(_BATCH_ATTEMPTS):
+        try:
+            touched = _apply_award_batch(awards, results, allowance)
+            break
+        except IntegrityError:
+            # a concurrent writer inserted one of our keys; the retry's dedupe query will
+            # see it, and reuses the rate-limit charge already made
+            db.session.rollback()
+    else:
+        resp = jsonify({'ok': False, 'error': 'conflicting concurrent awards; retry the batch', 'retry_after': 1})
+        resp.headers['Retry-After'] = '1'
+        return resp, 409
+    leaderboard_index.record_users([user for _old_level, user in touched.values()])
+    for user_id in touched:
+        profiles.invalidate_user(user_id)
+
+    counts = {'awarded': 0, 'duplicate': 0, 'rejected': 0}
+    for r in results:
+        counts[r['status']] += 1
+    return jsonify({'ok': True, 'results': results, **counts})
+
+
 @xp_bp.route('/api/v1/leaderboard', methods=['GET'])
 def leaderboard():
-    limit = int(request.args.get('limit', 50))
-    users = User.query.order_by(User.xp_total.desc()).limit(limit).all()
-    rows = []
-    rank = 1
-    for u in users:
-        rows.append({
-            'rank': rank,
-            'user_id': u.id,
-            'display_name': u.display_name,
-            'xp': u.xp_total,
-            'level': u.level,
-        })
-        rank += 1
-    return jsonify({'ok': True, 'rows': rows})
+    """Top users by XP, served from the leaderboard index.
+
+    Pass the returned `next_cursor` as `cursor` to fetch the following page. With
+    `period=day|week|month` users are ranked by XP earned in the current bucket, read
+    from the `xp_rollups` table.
+    """
+    limit = min(int(request.args.get('limit', 50)), 500)
+    period = request.args.get('period', 'all')
+    if period != 'all' and period not in rollups.PERIODS:
+        return jsonify({'ok': False, 'error': f'invalid period: {period}'}), 400
+    try:
+        if period == 'all':
+            rows, next_cursor = leaderboard_index.top(limit, request.args.get('cursor'))
+            return jsonify({'ok': True, 'rows': rows, 'next_cursor': next_cursor})
+        rows, start, next_cursor = rollups.top(period, limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    return jsonify({'ok': True, 'period': period, 'bucket_start': start.isoformat(), 'rows': rows,
+                    'next_cursor': next_cursor})
+
+
+@xp_bp.route('/api/v1/leaderboard/users/<int:user_id>', methods=['GET'])
+def leaderboard_rank(user_id):
+    """Rank of one user plus up to `neighbours` users directly above and below."""
+    neighbours = min(max(int(request.args.get('neighbours', 0)), 0), 50)
+    found = leaderboard_index.rank(user_id, neighbours)
+    if found is None:
+        return jsonify({'ok': False, 'error': 'user not found'}), 404
+    rank, rows = found
+    return jsonify({'ok': True, 'user_id': user_id, 'rank': rank, 'rows': rows})
 
 
 @xp_bp.route('/api/v1/leaderboard/stream')
 def leaderboard_stream():
-    def gen():
-        last = None
-        while True:
-            users = User.query.order_by(User.xp_total.desc()).limit(50).all()
-            rows = [{'rank': i+1, 'user_id': u.id, 'display_name': u.display_name, 'xp': u.xp_total, 'level': u.level} for i, u in enumerate(users)]
-            payload = json.dumps({'rows': rows})
-            if payload != last:
-                yield f"data: {payload}\n\n"
-                last = payload
-            time.sleep(2)
-    return Response(gen(), mimetype='text/event-stream')
+    """Live leaderboard over SSE, fed by the shared per-process broadcaster.
+
+    Clients resume with the standard `Last-Event-ID` header (or `last_event_id` query param).
+    """
+    app = current_app._get_current_object()
+    leaderboard_stream_hub.ensure_started(app)
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    heartbeat = float(app.config.get('LEADERBOARD_STREAM_HEARTBEAT_SECONDS', 15))
+    return Response(
+        leaderboard_stream_hub.subscribe(last_event_id, heartbeat),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
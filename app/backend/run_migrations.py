@@ -5,8 +5,9 @@ import os
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend.app import app, db
+from backend.app import app, create_app, db
 
+create_app()
 with app.app_context():
     db.create_all()
     print('Created all tables using SQLAlchemy create_all()')
@@ -0,0 +1,547 @@
+"""Pool of warm, persistent job sandboxes.
+
+Starting a container per job (`container_runner.run_in_container`) costs seconds, which
+dwarfs the typical sub-200ms lab job. A RunnerPool instead keeps up to `size` sandboxes
+per language alive. Each sandbox runs a small agent (AGENT_SOURCE) that reads one JSON
+request per line on stdin and runs the command in a fresh child process with a timeout
+and an output cap. It answers on stdout with a `{"chunk": ...}` line for each piece of
+output as the job produces it, then one final line with the exit code. Jobs therefore
+pay only a process spawn inside an already running sandbox.
+
+Sandboxes are shared by jobs from different users, so nothing may outlive a job: each
+job runs in its own session and a fresh working directory (also its TMPDIR/HOME), and,
+when the agent runs as root, under a separate unprivileged uid, so a job cannot signal,
+ptrace or write to the agent (e.g. forge answers through /proc/<agent>/fd/1). Every
+request carries a nonce that the agent echoes on each line; the Sandbox drops any data
+left from earlier requests and retires a sandbox whose answer does not carry it. Once
+it ends the agent kills the job's process group and any process that escaped it (the
+agent is their subreaper), and empties its scratch directory. A sandbox in which such
+leftover processes were found is retired rather than reused.
+
+Backends:
+  DockerBackend  one long-lived `docker run -i --network none` container per sandbox
+                 (memory/CPU/pids limits, read-only root, tmpfs /tmp). The agent runs as
+                 root with only the capabilities it needs to manage jobs and
+                 no-new-privileges; jobs run as `job_uid` (default 65534, nobody).
+  LocalBackend   the agent as a plain host process: no isolation, for tests and dev.
+
+A sandbox is recycled (stopped and replaced in the background) after `max_jobs` jobs,
+when the agent reports memory use above `memory_watermark` bytes, or when it stops
+answering, or killed when the job it runs is cancelled. `stats()` reports queue wait, exec time and cold vs warm starts.
+
+The pool is per process. Under RQ use a non-forking worker (`rq worker -w
+rq.worker.SimpleWorker`) so the pool outlives individual jobs.
+"""
+import json
+import os
+import queue
+import select
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+# Runs inside the sandbox; keep it dependency-free and compatible with old Pythons.
+AGENT_SOURCE = r'''
+import codecs, ctypes, json, os, resource, select, shutil, signal, subprocess, sys, tempfile, time
+
+# argv[1]: scratch root, emptied after every job (the sandbox's tmpfs /tmp under docker)
+# argv[2]: uid (and gid) jobs run as; needs the agent to run as root
+if len(sys.argv) > 1 and sys.argv[1]:
+    SCRATCH = sys.argv[1]
+else:
+    SCRATCH = tempfile.mkdtemp(prefix="runner-")
+    os.chmod(SCRATCH, 0o711)  # a job running as JOB_UID must reach its own directory below it
+JOB_UID = int(sys.argv[2]) if len(sys.argv) > 2 and os.getuid() == 0 else None
+
+def drop_privileges():
+    os.setgroups([])
+    os.setgid(JOB_UID)
+    os.setuid(JOB_UID)
+
+try:
+    # become the subreaper: processes a job daemonizes are re-parented here, not to init
+    ctypes.CDLL(None).prctl(36, 1, 0, 0, 0)  # PR_SET_CHILD_SUBREAPER
+except Exception:
+    pass
+
+def memory_used():
+    for path in ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes"):
+        try:
+            with open(path) as f:
+                return int(f.read().strip())
+        except Exception:
+            pass
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return kb * 1024
+
+def descendants():
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/%s/stat" % entry) as f:
+                    stat = f.read()
+                # the fields after the parenthesised command name: state, ppid, ...
+                fields = stat[stat.rindex(")") + 2:].split()
+                if fields[0] != "Z":
+                    parents[int(entry)] = int(fields[1])
+            except Exception:
+                pass
+    found, frontier = [], [os.getpid()]
+    while frontier:
+        pid = frontier.pop()
+        children = [p for p, ppid in parents.items() if ppid == pid]
+        found.extend(children)
+        frontier.extend(children)
+    return found
+
+def reap():
+    while True:
+        try:
+            if os.waitpid(-1, os.WNOHANG)[0] == 0:
+                return
+        except ChildProcessError:
+            return
+
+def kill_all(proc):
+    # the job's process group first, then anything that escaped it (setsid, double fork)
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    for _ in range(50):
+        reap()
+        pids = descendants()
+        if not pids:
+            return
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        time.sleep(0.02)
+
+def wipe_scratch():
+    for entry in os.listdir(SCRATCH):
+        path = os.path.join(SCRATCH, entry)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def send(msg, rid=None):
+    if rid is not None:
+        msg["id"] = rid
+    sys.stdout.write(json.dumps(msg) + "\n")
+    sys.stdout.flush()
+
+send({"ready": True, "mem": memory_used()})
+for line in sys.stdin:
+    req = json.loads(line)
+    rid = req.get("id")
+    start = time.time()
+    timeout = req.get("timeout", 30)
+    limit = req.get("max_output", 1 << 20)
+    proc, rc, sent, truncated, timed_out = None, None, 0, False, False
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    workdir = tempfile.mkdtemp(prefix="job-", dir=SCRATCH)
+    env = dict(os.environ, TMPDIR=workdir, HOME=workdir)
+    try:
+        if JOB_UID is not None:
+            os.chown(workdir, JOB_UID, JOB_UID)
+        proc = subprocess.Popen(req["argv"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                stdin=subprocess.DEVNULL, cwd=workdir, env=env, start_new_session=True,
+                                preexec_fn=drop_privileges if JOB_UID is not None else None)
+        fd = proc.stdout.fileno()
+        deadline = start + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                timed_out = True
+                break
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            keep = data[:max(0, limit - sent)]
+            sent += len(data)
+            truncated = truncated or len(keep) < len(data)
+            text = decoder.decode(keep)
+            if text:
+                send({"chunk": text}, rid)
+        if not timed_out:
+            try:
+                rc = proc.wait(max(0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                timed_out = True
+        text = decoder.decode(b"", True)
+        if text:
+            send({"chunk": text}, rid)
+        if timed_out:
+            kill_all(proc)
+            rc = 124
+            send({"chunk": "\nTimeout after %ss" % timeout}, rid)
+    except Exception as e:
+        rc = 1
+        send({"chunk": "error during execution: %s" % e}, rid)
+    # anything still alive now that the job's own process is done was left behind
+    leftover = len(descendants()) if proc is not None and not timed_out else 0
+    if proc is not None:
+        kill_all(proc)
+        proc.stdout.close()
+    wipe_scratch()
+    send({"rc": rc, "truncated": truncated, "elapsed": time.time() - start, "mem": memory_used(), "leftover": leftover}, rid)
+'''
+
+
+class SandboxError(Exception):
+    """The sandbox process died or stopped answering; it will be replaced."""
+
+
+class LocalBackend:
+    """Agent as a host subprocess. No isolation: tests and local development only."""
+    name = 'local'
+
+    def __init__(self, job_uid: int = None):
+        # only takes effect when the host process runs as root
+        self.job_uid = job_uid
+
+    def start(self, language: str, name: str):
+        argv = [sys.executable, '-u', '-c', AGENT_SOURCE]
+        if self.job_uid is not None:
+            argv += ['', str(self.job_uid)]
+        return subprocess.Popen(argv, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, start_new_session=True)
+
+    def argv(self, command: str):
+        return shlex.split(command)
+
+    def kill(self, box) -> None:
+        # the agent leads its own process group, so this also takes down the running job
+        try:
+            os.killpg(box.proc.pid, 9)
+        except OSError:
+            pass
+
+
+class DockerBackend:
+    """Agent inside a long-lived, network-disabled container (image must provide python3)."""
+    name = 'docker'
+
+    # what the root agent needs: run jobs as job_uid, chown/empty their scratch, kill them
+    CAPABILITIES = ('SETUID', 'SETGID', 'CHOWN', 'DAC_OVERRIDE', 'FOWNER', 'KILL')
+
+    def __init__(self, images: dict, memory: str = '256m', cpus: str = '0.5', pids: int = 128, job_uid: int = 65534):
+        self.images = images
+        self.memory = memory
+        self.cpus = cpus
+        self.pids = pids
+        self.job_uid = job_uid
+
+    def start(self, language: str, name: str):
+        image = self.images.get(language) or self.images.get('default')
+        if not image:
+            raise ValueError(f'no runner image configured for {language}')
+        argv = ['docker', 'run', '-i', '--rm', '--name', name, '--network', 'none', '--memory', self.memory, '--cpus', self.cpus,
+                '--pids-limit', str(self.pids), '--read-only', '--tmpfs', '/tmp', '--workdir', '/tmp',
+                '--user', '0:0', '--cap-drop', 'ALL', '--security-opt', 'no-new-privileges']
+        for cap in self.CAPABILITIES:
+            argv += ['--cap-add', cap]
+        argv += [image, 'python3', '-u', '-c', AGENT_SOURCE, '/tmp', str(self.job_uid)]
+        return subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def argv(self, command: str):
+        return ['/bin/sh', '-lc', command]
+
+    def kill(self, box) -> None:
+        subprocess.run(['docker', 'kill', box.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        box.proc.kill()
+
+
+class SandboxCancelled(SandboxError):
+    """The job was cancelled while it ran; the sandbox has been killed."""
+
+
+class Sandbox:
+    def __init__(self, language: str, proc, name: str = None):
+        self.language = language
+        self.proc = proc
+        self.name = name
+        self.jobs = 0
+        self.memory = 0
+        self._buf = b''
+
+    def read_line(self, timeout: float, cancel: threading.Event = None) -> dict:
+        deadline = time.monotonic() + timeout
+        fd = self.proc.stdout.fileno()
+        while b'\n' not in self._buf:
+            if cancel is not None and cancel.is_set():
+                raise SandboxCancelled('job cancelled')
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SandboxError('sandbox did not answer in time')
+            # wake up periodically to notice cancellation
+            ready, _, _ = select.select([fd], [], [], remaining if cancel is None else min(remaining, 0.1))
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise SandboxError('sandbox exited')
+            self._buf += chunk
+        line, self._buf = self._buf.split(b'\n', 1)
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise SandboxError('sandbox sent a malformed line')
+
+    def _discard_pending(self) -> None:
+        """Drop output not read for an earlier request; none of it may answer the next one."""
+        self._buf = b''
+        fd = self.proc.stdout.fileno()
+        while select.select([fd], [], [], 0)[0]:
+            if not os.read(fd, 65536):
+                return  # exited; the request reports it
+
+    def request(self, payload: dict, timeout: float, cancel: threading.Event = None, on_chunk=None) -> dict:
+        """Send one job and return the agent's final line; output chunks that arrive
+        before it go to `on_chunk`. Lines without the request's nonce raise SandboxError."""
+        nonce = uuid.uuid4().hex
+        self._discard_pending()
+        try:
+            self.proc.stdin.write(json.dumps(dict(payload, id=nonce)).encode() + b'\n')
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise SandboxError(f'sandbox stdin closed: {e}')
+        deadline = time.monotonic() + timeout
+        while True:
+            msg = self.read_line(deadline - time.monotonic(), cancel)
+            if msg.get('id') != nonce:
+                raise SandboxError('sandbox sent a line that does not answer this request')
+            if 'chunk' not in msg:
+                return msg
+            if on_chunk is not None:
+                on_chunk(msg['chunk'])
+
+    def close(self) -> None:
+        try:
+            self.proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.proc.wait(timeout=2)
+        except Exception:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class RunnerPool:
+    def __init__(self, backend, size: int = 2, max_jobs: int = 100, memory_watermark: int = None,
+                 start_timeout: float = 30.0, max_output: int = 1 << 20, languages=('python',), prewarm: bool = True):
+        self.backend = backend
+        self.size = size
+        self.max_jobs = max_jobs
+        self.memory_watermark = memory_watermark
+        self.start_timeout = start_timeout
+        self.max_output = max_output
+        self._idle = {}
+        self._live = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {'jobs': 0, 'cold_starts': 0, 'warm_starts': 0, 'recycled': 0, 'failures': 0, 'cancelled': 0, 'dirty': 0,
+                       'queue_wait_seconds': 0.0, 'queue_wait_max': 0.0, 'exec_seconds': 0.0, 'exec_max': 0.0}
+        if prewarm:
+            for language in languages:
+                for _ in range(size):
+                    self._spawn_async(language)
+
+    # --- sandbox lifecycle ------------------------------------------------------
+
+    def _queue(self, language: str) -> queue.Queue:
+        with self._lock:
+            q = self._idle.get(language)
+            if q is None:
+                q = self._idle[language] = queue.Queue()
+                self._live[language] = 0
+            return q
+
+    def _reserve(self, language: str) -> bool:
+        """Claim a slot for a new sandbox if the language is below `size`."""
+        self._queue(language)
+        with self._lock:
+            if self._closed or self._live[language] >= self.size:
+                return False
+            self._live[language] += 1
+            return True
+
+    def _start(self, language: str) -> Sandbox:
+        try:
+            name = f'runner-{language}-{uuid.uuid4().hex[:12]}'
+            box = Sandbox(language, self.backend.start(language, name), name)
+            hello = box.read_line(self.start_timeout)
+            box.memory = hello.get('mem', 0)
+            return box
+        except Exception:
+            with self._lock:
+                self._live[language] -= 1
+                self._stats['failures'] += 1
+            raise
+
+    def _spawn_async(self, language: str) -> None:
+        if not self._reserve(language):
+            return
+
+        def run():
+            try:
+                self._idle[language].put(self._start(language))
+            except Exception:
+                pass
+        threading.Thread(target=run, name=f'runner-warm-{language}', daemon=True).start()
+
+    def _retire(self, box: Sandbox, replace: bool = True) -> None:
+        box.close()
+        with self._lock:
+            self._live[box.language] -= 1
+            self._stats['recycled'] += 1
+        if replace and not self._closed:
+            self._spawn_async(box.language)
+
+    # --- public API -------------------------------------------------------------
+
+    def _acquire(self, language: str, timeout: float):
+        idle = self._queue(language)
+        try:
+            return idle.get_nowait(), False
+        except queue.Empty:
+            pass
+        if self._reserve(language):
+            return self._start(language), True
+        try:
+            return idle.get(timeout=timeout), False
+        except queue.Empty:
+            raise SandboxError(f'no {language} sandbox became free within {timeout}s')
+
+    def run(self, language: str, command: str, timeout: float = 30.0, queue_timeout: float = 60.0,
+            cancel: threading.Event = None, on_output=None):
+        """Run `command` in a warm sandbox. Returns (exit_code, output) like run_in_container.
+
+        With `on_output`, output is passed to it as the job produces it, and the returned
+        text only holds what follows (the truncation note or an error). Setting `cancel`
+        while the job runs kills the sandbox (it is replaced in the background) and
+        returns exit code -9.
+        """
+        chunks = []
+        waited = time.monotonic()
+        box, cold = self._acquire(language, queue_timeout)
+        waited = time.monotonic() - waited
+        started = time.monotonic()
+        try:
+            resp = box.request({'argv': self.backend.argv(command), 'timeout': timeout, 'max_output': self.max_output},
+                               timeout + 5, cancel, on_output or chunks.append)
+        except SandboxCancelled:
+            self.backend.kill(box)
+            self._retire(box)
+            with self._lock:
+                self._stats['cancelled'] += 1
+            return -9, 'cancelled'
+        except SandboxError as e:
+            self._retire(box)
+            with self._lock:
+                self._stats['failures'] += 1
+            return 1, f'error during execution: {e}'
+        elapsed = time.monotonic() - started
+        box.jobs += 1
+        box.memory = resp.get('mem', 0)
+        with self._lock:
+            s = self._stats
+            s['jobs'] += 1
+            s['cold_starts' if cold else 'warm_starts'] += 1
+            s['queue_wait_seconds'] += waited
+            s['queue_wait_max'] = max(s['queue_wait_max'], waited)
+            s['exec_seconds'] += elapsed
+            s['exec_max'] = max(s['exec_max'], elapsed)
+        if resp.get('leftover'):
+            # the job left processes behind; don't hand this sandbox to the next user
+            self.backend.kill(box)
+            self._retire(box)
+            with self._lock:
+                self._stats['dirty'] += 1
+        elif box.jobs >= self.max_jobs or (self.memory_watermark and box.memory > self.memory_watermark):
+            self._retire(box)
+        else:
+            self._idle[language].put(box)
+        out = ''.join(chunks)
+        if resp.get('truncated'):
+            out += '\n[output truncated]'
+        return resp.get('rc', 1), out
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s['live'] = dict(self._live)
+        s['idle'] = {lang: q.qsize() for lang, q in self._idle.items()}
+        jobs = s['jobs'] or 1
+        s['queue_wait_avg'] = s['queue_wait_seconds'] / jobs
+        s['exec_avg'] = s['exec_seconds'] / jobs
+        s['backend'] = self.backend.name
+        return s
+
+    def shutdown(self) -> None:
+        self._closed = True
+        for q in list(self._idle.values()):
+            while True:
+                try:
+                    box = q.get_nowait()
+                except queue.Empty:
+                    break
+                box.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(config=None) -> RunnerPool:
+    """Process-wide pool, configured on first use from `config` (default: the current
+    app's config, see ENV_SETTINGS in backend.app):
+
+    RUNNER_BACKEND (docker|local, default docker), RUNNER_POOL_SIZE (per language, 2),
+    RUNNER_MAX_JOBS (100), RUNNER_MEMORY_WATERMARK_BYTES, RUNNER_IMAGES ({language:
+    image}, falling back to DOCKER_RUNNER_IMAGE), JOB_RUN_MEMORY (256m), RUNNER_JOB_UID
+    (uid jobs run as inside docker sandboxes, 65534).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if config is None:
+                from flask import current_app
+                config = current_app.config
+            if config.get('RUNNER_BACKEND', 'docker') == 'local':
+                backend = LocalBackend()
+            else:
+                images = dict(config.get('RUNNER_IMAGES') or {})
+                if config.get('DOCKER_RUNNER_IMAGE'):
+                    images.setdefault('default', config['DOCKER_RUNNER_IMAGE'])
+                backend = DockerBackend(images, memory=config.get('JOB_RUN_MEMORY', '256m'),
+                                        job_uid=int(config.get('RUNNER_JOB_UID', 65534)))
+            watermark = config.get('RUNNER_MEMORY_WATERMARK_BYTES')
+            _pool = RunnerPool(
+                backend,
+                size=int(config.get('RUNNER_POOL_SIZE', 2)),
+                max_jobs=int(config.get('RUNNER_MAX_JOBS', 100)),
+                memory_watermark=int(watermark) if watermark else None,
+            )
+        return _pool
+
+
+def reset() -> None:
+    """Shut down the process-wide pool (tests, worker shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
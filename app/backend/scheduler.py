@@ -0,0 +1,256 @@
+"""DB-backed job scheduler with fair sharing, priorities and leases.
+
+With JOB_DISPATCH = 'scheduler', `submit_job` leaves new jobs `queued` in the `jobs`
+table and one or more scheduler processes (`scripts/job_scheduler.py`) run them. Each
+process runs a claim loop plus a pool of executor threads:
+
+  claim     pick queued jobs fairly and mark them `running` under a lease, in one short
+            transaction. Candidates are locked FOR UPDATE SKIP LOCKED (PostgreSQL), so
+            processes claiming at the same time take disjoint jobs instead of waiting on
+            each other, and a job is never claimed twice.
+  fairness  each free slot goes to the user with the fewest running jobs; among users
+            with equal counts the higher priority job, then the older one, wins. A user's
+            own jobs run in priority order. SCHEDULER_MAX_PER_USER caps one user's running
+            jobs across all processes.
+  cap       SCHEDULER_MAX_CONCURRENCY caps running jobs across all processes. Checking
+            the cap and claiming must not interleave between processes, so with a cap
+            set, claims on PostgreSQL take a transaction-scoped advisory lock (claims
+            last milliseconds; job execution is outside the lock).
+  leases    a claimed job holds a lease of SCHEDULER_LEASE_SECONDS, renewed by a
+            heartbeat thread every third of that while it runs. Jobs whose lease ran out
+            (their process died) are put back to `queued`, or marked `failed` after
+            SCHEDULER_MAX_ATTEMPTS claims. An executor that lost its lease is stopped
+            and its result discarded: `run_job` writes a claimed job only while
+            `lease_owner` is still its own.
+
+Jobs left `queued` because Redis was not configured, or because enqueueing to RQ
+failed, are picked up too. Jobs bound for RQ are inserted as `enqueued` and left alone,
+and RQ workers start a job only if it is still `queued`/`enqueued`, so the two
+dispatchers never run the same job.
+"""
+import functools
+import heapq
+import os
+import socket
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, text, update
+
+from backend import outbox
+from backend.app import db
+from backend.models import JobRecord
+
+# pg_advisory_xact_lock key serializing capped claims
+_CLAIM_LOCK_KEY = 0x6A6F6273
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _emit_status(job) -> None:
+    outbox.emit('job.status', job.user_id, {'job_id': job.id, 'user_id': job.user_id, 'status': job.status})
+
+
+def _fair_order(candidates, running: dict, want: int, max_per_user: int = None) -> list:
+    """Pick up to `want` jobs from `candidates` (JobRecords sorted by priority desc, id)
+    giving each slot to the user with the fewest running jobs."""
+    by_user = defaultdict(list)
+    for job in candidates:
+        by_user[job.user_id].append(job)
+    heap = [(running.get(uid, 0), -jobs[0].priority, jobs[0].id, uid) for uid, jobs in by_user.items()]
+    heapq.heapify(heap)
+    picked = []
+    while heap and len(picked) < want:
+        count, _prio, _id, uid = heapq.heappop(heap)
+        if max_per_user and count >= max_per_user:
+            continue
+        jobs = by_user[uid]
+        picked.append(jobs.pop(0))
+        if jobs:
+            heapq.heappush(heap, (count + 1, -jobs[0].priority, jobs[0].id, uid))
+    return picked
+
+
+def claim(session, owner: str, want: int, lease_seconds: float = 60, max_concurrency: int = None,
+          max_per_user: int = None) -> list:
+    """Claim up to `want` queued jobs for `owner` and commit. Returns the claimed job ids."""
+    postgres = session.get_bind().dialect.name == 'postgresql'
+    if max_concurrency and postgres:
+        session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': _CLAIM_LOCK_KEY})
+    if max_concurrency:
+        running = session.execute(select(func.count()).where(JobRecord.status == 'running')).scalar_one()
+        want = min(want, max_concurrency - running)
+    if want <= 0:
+        session.rollback()
+        return []
+
+    # at most `want` candidates per user, so one user's backlog cannot crowd out the rest
+    ranked = select(
+        JobRecord.id,
+        func.row_number().over(partition_by=JobRecord.user_id,
+                               order_by=(JobRecord.priority.desc(), JobRecord.id)).label('rn'),
+    ).where(JobRecord.status == 'queued').subquery()
+    ids = session.execute(select(ranked.c.id).where(ranked.c.rn <= want)).scalars().all()
+    if not ids:
+        session.rollback()
+        return []
+    stmt = (select(JobRecord).where(JobRecord.id.in_(ids), JobRecord.status == 'queued')
+            .order_by(JobRecord.priority.desc(), JobRecord.id))
+    if postgres:
+        stmt = stmt.with_for_update(skip_locked=True)
+    candidates = session.execute(stmt).scalars().all()
+    users = {j.user_id for j in candidates}
+    running = dict(session.execute(
+        select(JobRecord.user_id, func.count())
+        .where(JobRecord.status == 'running', JobRecord.user_id.in_([u for u in users if u is not None]))
+        .group_by(JobRecord.user_id)
+    ).all())
+
+    now = _now()
+    picked = _fair_order(candidates, running, want, max_per_user)
+    for job in picked:
+        job.status = 'running'
+        job.started_at = now
+        job.lease_owner = owner
+        job.lease_expires_at = now + timedelta(seconds=lease_seconds)
+        job.attempts = (job.attempts or 0) + 1
+        _emit_status(job)
+    session.commit()
+    return [j.id for j in picked]
+
+
+def renew(session, owner: str, job_ids, lease_seconds: float = 60) -> int:
+    """Extend the leases `owner` still holds on `job_ids` and commit. Returns rows renewed."""
+    if not job_ids:
+        return 0
+    result = session.execute(
+        update(JobRecord)
+        .where(JobRecord.id.in_(list(job_ids)), JobRecord.lease_owner == owner, JobRecord.status == 'running')
+        .values(lease_expires_at=_now() + timedelta(seconds=lease_seconds)),
+        execution_options={'synchronize_session': False},
+    )
+    session.commit()
+    return result.rowcount
+
+
+def requeue_expired(session, max_attempts: int = 3) -> int:
+    """Requeue running jobs whose lease expired (or fail them after `max_attempts`) and commit."""
+    stmt = select(JobRecord).where(JobRecord.status == 'running', JobRecord.lease_expires_at < _now())
+    if session.get_bind().dialect.name == 'postgresql':
+        stmt = stmt.with_for_update(skip_locked=True)
+    jobs = session.execute(stmt).scalars().all()
+    for job in jobs:
+        if (job.attempts or 0) >= max_attempts:
+            job.status = 'failed'
+            job.finished_at = _now()
+            job.output = (job.output or '') + f'\n[lease expired after {job.attempts} attempts]'
+        else:
+            job.status = 'queued'
+        job.lease_owner = None
+        job.lease_expires_at = None
+        _emit_status(job)
+    session.commit()
+    return len(jobs)
+
+
+def _run_job(job_id: int, owner: str = None) -> None:
+    from backend.scripts.worker import run_job
+    run_job(job_id, claimed=True, owner=owner)
+
+
+class Scheduler:
+    """Claim loop, heartbeat and `threads` executor threads for one process."""
+
+    def __init__(self, app, threads: int = 4, execute=None, owner: str = None):
+        cfg = app.config
+        self.app = app
+        self.threads = threads
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.execute = execute or functools.partial(_run_job, owner=self.owner)
+        self.max_concurrency = int(cfg.get('SCHEDULER_MAX_CONCURRENCY', 0)) or None
+        self.max_per_user = int(cfg.get('SCHEDULER_MAX_PER_USER', 0)) or None
+        self.lease_seconds = float(cfg.get('SCHEDULER_LEASE_SECONDS', 60))
+        self.max_attempts = int(cfg.get('SCHEDULER_MAX_ATTEMPTS', 3))
+        self.poll = float(cfg.get('SCHEDULER_POLL_SECONDS', 1))
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix='job-exec')
+
+    def _execute(self, job_id: int) -> None:
+        try:
+            with self.app.app_context():
+                try:
+                    self.execute(job_id)
+                except Exception:
+                    self.app.logger.exception('scheduler: job %s failed', job_id)
+                finally:
+                    db.session.remove()
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+            self._wake.set()
+
+    def tick(self) -> int:
+        """Requeue expired leases, then claim jobs for the free local threads and submit
+        them. Returns the number of jobs started. Needs an app context."""
+        requeue_expired(db.session, self.max_attempts)
+        with self._lock:
+            free = self.threads - len(self._running)
+        if free <= 0:
+            return 0
+        ids = claim(db.session, self.owner, free, self.lease_seconds, self.max_concurrency, self.max_per_user)
+        with self._lock:
+            self._running.update(ids)
+        for job_id in ids:
+            self._pool.submit(self._execute, job_id)
+        return len(ids)
+
+    def wake(self) -> None:
+        """Cut the claim loop's poll wait short, e.g. after setting its `stop` event."""
+        self._wake.set()
+
+    def heartbeat(self) -> int:
+        with self._lock:
+            ids = list(self._running)
+        return renew(db.session, self.owner, ids, self.lease_seconds)
+
+    def _heartbeat_loop(self, stop: threading.Event) -> None:
+        with self.app.app_context():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.heartbeat()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('scheduler: heartbeat failed')
+                finally:
+                    db.session.remove()
+
+    def run(self, stop: threading.Event = None) -> None:
+        """Claim loop: claim again as soon as a job finishes, otherwise every
+        SCHEDULER_POLL_SECONDS. Waits for running jobs when `stop` is set."""
+        stop = stop or threading.Event()
+        # keeps renewing leases until the last running job has finished
+        beat_stop = threading.Event()
+        beat = threading.Thread(target=self._heartbeat_loop, args=(beat_stop,), name='job-heartbeat', daemon=True)
+        beat.start()
+        with self.app.app_context():
+            while not stop.is_set():
+                try:
+                    started = self.tick()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('scheduler: claim failed')
+                    started = 0
+                finally:
+                    db.session.remove()
+                if not started:
+                    self._wake.wait(self.poll)
+                    self._wake.clear()
+        self._pool.shutdown(wait=True)
+        beat_stop.set()
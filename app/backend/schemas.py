@@ -2,6 +2,8 @@
 Lightweight helper functions and constants for level math and simple validation.
 """
 import math
+from bisect import bisect_right
+from typing import Iterable
 
 BASE_XP = 100
 
@@ -14,12 +16,39 @@ def xp_for_level(level: int) -> int:
 def next_level_threshold(current_level: int) -> int:
     return xp_for_level(current_level + 1)
 
-def compute_new_level(current_xp: int) -> int:
-    level = 1
-    while True:
-        if current_xp < xp_for_level(level + 1):
-            return level
+# _thresholds[i] is xp_for_level(i + 2): the XP needed to leave level i + 1. The table
+# covers the first TABLE_LEVELS levels so common lookups are a bisect; totals past it use
+# the closed form, so no input grows the table.
+TABLE_LEVELS = 4096
+_thresholds = [xp_for_level(level) for level in range(2, TABLE_LEVELS + 2)]
+
+# largest XP a single award may carry
+MAX_AWARD_XP = 100_000_000
+# sources an award may not use: '*' keys the all-sources rows of backend.rollups
+RESERVED_SOURCES = ('*',)
+
+
+def _level_closed_form(current_xp: int) -> int:
+    # invert BASE_XP * level ** 1.5, then correct the float estimate against xp_for_level
+    level = max(1, int((current_xp / BASE_XP) ** (2 / 3)))
+    while xp_for_level(level + 1) <= current_xp:
         level += 1
+    while level > 1 and xp_for_level(level) > current_xp:
+        level -= 1
+    return level
+
+
+def compute_new_level(current_xp: int) -> int:
+    """Return the level for a cumulative XP total (always >= 1)."""
+    if current_xp < _thresholds[-1]:
+        return 1 + bisect_right(_thresholds, current_xp)
+    return _level_closed_form(current_xp)
+
+
+def compute_levels(xp_totals: Iterable[int]) -> list[int]:
+    """Vectorized compute_new_level: map many XP totals to levels in one call."""
+    table, top = _thresholds, _thresholds[-1]
+    return [1 + bisect_right(table, xp) if xp < top else _level_closed_form(xp) for xp in xp_totals]
 
 
 def validate_award_payload(payload: dict) -> (bool, str):
@@ -31,6 +60,10 @@ def validate_award_payload(payload: dict) -> (bool, str):
         xp = int(payload.get('xp', 0))
         if xp <= 0:
             return False, 'xp must be positive'
+        if xp > MAX_AWARD_XP:
+            return False, f'xp must be at most {MAX_AWARD_XP}'
     except Exception:
         return False, 'xp must be an integer'
+    if payload.get('source') in RESERVED_SOURCES:
+        return False, f"source {payload['source']!r} is reserved"
     return True, ''
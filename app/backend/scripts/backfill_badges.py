@@ -0,0 +1,37 @@
+"""Award rule-driven badges from existing history.
+
+Usage:
+  python backend/scripts/backfill_badges.py           # dry-run: count users per badge
+  python backend/scripts/backfill_badges.py --apply   # insert the missing user_badges rows
+
+Every badge with a `rule` is evaluated for all users in one INSERT ... SELECT per rule
+(see backend.badge_rules). Users who already hold a badge are skipped, so it is safe to
+re-run, e.g. after adding a new rule. No outbox events are written for backfilled badges.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app import app, create_app, db
+from backend.badge_rules import backfill
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apply', action='store_true', help='Insert the awards instead of counting them')
+    args = parser.parse_args()
+
+    create_app()
+    with app.app_context():
+        result = backfill(db.session, dry_run=not args.apply)
+        if not args.apply:
+            print(f'\nDry-run complete: {sum(result.values())} awards pending. Re-run with --apply to insert them.')
+            return
+        db.session.commit()
+        print(f'Awarded {sum(result.values())} badges')
+
+
+if __name__ == '__main__':
+    main()
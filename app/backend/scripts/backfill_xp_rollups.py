@@ -0,0 +1,35 @@
+"""Build the xp_rollups table from xp_events history.
+
+Usage:
+  python backend/scripts/backfill_xp_rollups.py                 # rebuild rollups for every user
+  python backend/scripts/backfill_xp_rollups.py --user-id 1 --user-id 2
+
+Existing rollup rows of the affected users are replaced, so the command is safe to re-run
+(e.g. after dedupe_xp_events.py removed events). Run it once after applying migration
+0005_xp_rollups; afterwards the XP write paths keep the rollups current.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app import app, create_app, db
+from backend.rollups import backfill
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--user-id', type=int, action='append', help='Only rebuild these users (repeatable)')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Users aggregated per bulk upsert')
+    args = parser.parse_args()
+
+    create_app()
+    with app.app_context():
+        written = backfill(db.session, user_ids=args.user_id, chunk_size=args.chunk_size)
+        db.session.commit()
+        print(f'Wrote {written} rollup rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Cancel jobs in bulk.
+
+Usage:
+  python backend/scripts/cancel_jobs.py --user-id 42                 # all of a user's active jobs
+  python backend/scripts/cancel_jobs.py --status queued --status enqueued
+  python backend/scripts/cancel_jobs.py --job-id 7 --job-id 8
+
+Matching jobs (queued, enqueued or running by default) are marked cancelled in batches;
+enqueued ones are removed from RQ by id when REDIS_URL is set, and running ones are
+killed by their workers (see backend/job_control.py).
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app import app, create_app, db
+from backend import job_control, redis_client
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--user-id', type=int)
+    parser.add_argument('--job-id', type=int, action='append', dest='job_ids')
+    parser.add_argument('--status', action='append', choices=job_control.ACTIVE_STATUSES, dest='statuses')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    if args.user_id is None and not args.job_ids and not args.statuses:
+        parser.error('pass --user-id, --job-id or --status')
+
+    create_app()
+    with app.app_context():
+        redis_url = app.config.get('REDIS_URL')
+        conn = redis_client.get_redis(redis_url) if redis_url else None
+        result = job_control.cancel_jobs(db.session, conn, job_ids=args.job_ids, user_id=args.user_id,
+                                         statuses=args.statuses or job_control.ACTIVE_STATUSES,
+                                         batch_size=args.batch_size, note='[cancelled by operator]')
+        print(f"Cancelled {len(result['cancelled'])} jobs ({len(result['running'])} running, "
+              f"{result['removed_from_queue']} removed from RQ)")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,19 +5,28 @@ isolate execution. It uses the `docker` CLI via subprocess. In production you sh
 use a proper orchestrator (Kubernetes) and stronger sandboxing.
 
 API:
-  run_in_container(command: str, timeout: int = 30, memory: str = '256m') -> (exit_code, output)
+  run_in_container(image: str, command: str, timeout: int = 30, memory: str = '256m', name: str = None,
+                   on_output=None) -> (exit_code, output)
+  kill_container(name: str) -> None
 
 Note: This script does not execute containers in CI here — it's a scaffold to be used
-when the environment has Docker available.
+when the environment has Docker available. Every call pays a container cold start; the
+worker uses `backend.runner_pool` instead when USE_RUNNER_POOL is set.
 """
-import shlex
+import os
 import subprocess
+import threading
 from typing import Tuple
 
 
-def run_in_container(image: str, command: str, timeout: int = 30, memory: str = '256m') -> Tuple[int, str]:
+def run_in_container(image: str, command: str, timeout: int = 30, memory: str = '256m',
+                     name: str = None, on_output=None) -> Tuple[int, str]:
     """Run `command` inside `image` using docker run. Returns (exit_code, output).
 
+    A `name` lets another thread stop the container with `kill_container(name)`. With
+    `on_output`, output bytes are passed to it as the container produces them and the
+    returned text only holds the timeout or error message.
+
     Security notes: executing arbitrary commands in Docker still carries risk. Ensure
     the runner image is minimal and that you run containers with network disabled
     and with appropriate seccomp/apparmor profiles in production.
@@ -26,17 +35,46 @@ def run_in_container(image: str, command: str, timeout: int = 30, memory: str =
         raise ValueError('image must be provided')
 
     # Build docker run command; disable network and remove container after exit.
-    # Use --rm, --network none, limit memory and CPU as example.
-    docker_cmd = (
-        f"docker run --rm --network none --memory {memory} "
-        f"--cpus 0.5 {image} /bin/sh -lc {shlex.quote(command)}"
-    )
+    # Use --rm, --network none, limit memory and CPU as example. Arguments are passed as a
+    # list (no shell), so nothing in `command` is interpreted on the host.
+    docker_cmd = [
+        'docker', 'run', '--rm', '--network', 'none', '--memory', memory,
+        '--cpus', '0.5', image, '/bin/sh', '-lc', command,
+    ]
+    if name:
+        docker_cmd[2:2] = ['--name', name]
 
+    chunks = []
     try:
-        proc = subprocess.run(docker_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
-        out = proc.stdout.decode('utf-8', errors='replace')
-        return proc.returncode, out
-    except subprocess.TimeoutExpired as e:
-        return 124, f'Timeout after {timeout}s'
+        proc = subprocess.Popen(docker_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
     except Exception as e:
         return 1, f'Error running container: {e}'
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        if name:
+            # killing the docker client does not stop the container itself
+            kill_container(name)
+        proc.kill()
+    timer = threading.Timer(timeout, expire)
+    timer.start()
+    try:
+        fd = proc.stdout.fileno()
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            (on_output or chunks.append)(data)
+        rc = proc.wait()
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+    if timed_out.is_set():
+        return 124, ('\n' if on_output else '') + f'Timeout after {timeout}s'
+    return rc, b''.join(chunks).decode('utf-8', errors='replace')
+
+
+def kill_container(name: str) -> None:
+    """Stop a container started by run_in_container(name=...); `docker run` then returns."""
+    subprocess.run(['docker', 'kill', name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -3,184 +3,255 @@
 Usage:
   python backend/scripts/dedupe_xp_events.py         # dry-run, prints summary
   python backend/scripts/dedupe_xp_events.py --apply # actually delete duplicates and reconcile
+  python backend/scripts/dedupe_xp_events.py --apply --only-drifted  # reconcile only drifted users
 
 This script finds duplicates in two ways:
   1) same (user_id, source, source_id) when both source and source_id are set
   2) same (user_id, idempotency_key) when idempotency_key is set
 
-It keeps the earliest event (by created_at) and removes later duplicates.
+It keeps the earliest event (by created_at, then id) and removes later duplicates. Both
+keys are evaluated in one ROW_NUMBER() OVER (PARTITION BY ...) pass, deletions run in
+bounded chunks (`--delete-chunk-size`), `--checkpoint FILE` (one JSON line appended per removed
+row, deleted once the run completes) makes an interrupted --apply resumable, and `--report FILE.json|FILE.csv` writes the removed ids and XP delta per user.
 After removals (when --apply is used) it recalculates each user's xp_total as the
 sum of their remaining XPEvent.amount values and updates level accordingly.
 
 CAUTION: run with --apply only after taking a DB backup in production.
 """
 import argparse
+import csv
+import json
 import os
 import sys
 from collections import defaultdict
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend.app import app, db
-from backend.models import XPEvent, User
-from sqlalchemy import text
-from backend.schemas import compute_new_level
+from backend.app import app, create_app, db
+from backend.models import XPEvent
+from sqlalchemy import inspect, text
+from backend.schemas import compute_levels
 
 
-def find_duplicate_groups(session):
-    # Find duplicates by (user_id, source, source_id) where both source and source_id are not null
-    try:
-        dup_source = session.execute(
-            text(
-                """
-        SELECT user_id, source, source_id, COUNT(*) as cnt
+# Every row that is not the earliest (created_at, id) of its (user, source, source_id) or
+# (user, idempotency_key) group, found in a single window-function pass.
+_DUPLICATES_SQL = """
+    SELECT id, user_id, amount FROM (
+        SELECT id, user_id, amount,
+            CASE WHEN source IS NOT NULL AND source_id IS NOT NULL
+                THEN ROW_NUMBER() OVER (PARTITION BY user_id, source, source_id ORDER BY created_at, id)
+                ELSE 1 END AS rn_source,
+            {idemp_column}
         FROM xp_events
-        WHERE source IS NOT NULL AND source_id IS NOT NULL
-        GROUP BY user_id, source, source_id
-        HAVING cnt > 1
-        """
-            )
-        ).fetchall()
-    except Exception as e:
-        print('Warning: could not run source-based duplicate query:', e)
-        dup_source = []
+    ) ranked
+    WHERE rn_source > 1 OR rn_idemp > 1
+    ORDER BY id
+    """
+_IDEMP_RANK = """CASE WHEN idempotency_key IS NOT NULL
+                THEN ROW_NUMBER() OVER (PARTITION BY user_id, idempotency_key ORDER BY created_at, id)
+                ELSE 1 END AS rn_idemp"""
+
 
-    # Find duplicates by (user_id, idempotency_key) where idempotency_key is not null
+def find_duplicate_rows(session):
+    """Return (id, user_id, amount) rows to remove, for both dedupe keys, in one query."""
     try:
-        dup_idemp = session.execute(
-            text(
-                """
-        SELECT user_id, idempotency_key, COUNT(*) as cnt
-        FROM xp_events
-        WHERE idempotency_key IS NOT NULL
-        GROUP BY user_id, idempotency_key
-        HAVING cnt > 1
-        """
-            )
-        ).fetchall()
+        return session.execute(text(_DUPLICATES_SQL.format(idemp_column=_IDEMP_RANK))).fetchall()
     except Exception as e:
-        # likely the column doesn't exist in older DBs
+        # likely the idempotency_key column doesn't exist in older DBs
         print('Info: idempotency_key column not present or query failed; skipping idempotency duplicates:', e)
-        dup_idemp = []
+        session.rollback()
+        return session.execute(text(_DUPLICATES_SQL.format(idemp_column='1 AS rn_idemp'))).fetchall()
 
-    return dup_source, dup_idemp
 
+def dry_run(session):
+    rows = find_duplicate_rows(session)
+    users = {r.user_id for r in rows}
+    print(f"Total duplicate event rows that would be removed: {len(rows)} (across {len(users)} users)")
+    return rows
 
-def collect_rows_for_group(session, kind, key):
-    # kind: 'source' -> key = (user_id, source, source_id)
-    # kind: 'idemp' -> key = (user_id, idempotency_key)
-    if kind == 'source':
-        user_id, source, source_id = key
-        rows = session.execute(
-            text(
-                """
-            SELECT id, amount, created_at
-            FROM xp_events
-            WHERE user_id = :uid AND source = :source AND source_id = :source_id
-            ORDER BY created_at ASC, id ASC
-            """
-            ),
-            {'uid': user_id, 'source': source, 'source_id': source_id}
-        ).fetchall()
+
+def _load_checkpoint(path):
+    """Rows recorded by an earlier, interrupted run: one JSON [id, user_id, amount] per line."""
+    if not path or not os.path.exists(path):
+        return []
+    removed = []
+    with open(path) as f:
+        for line in f:
+            try:
+                removed.append(tuple(json.loads(line)))
+            except ValueError:
+                # a line cut short by the interruption; its chunk was committed, the
+                # rows are simply missing from the report
+                break
+    return removed
+
+
+def _append_checkpoint(path, rows):
+    if not path:
+        return
+    with open(path, 'a') as f:
+        f.writelines(json.dumps([r.id, r.user_id, r.amount]) + '\n' for r in rows)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def clear_checkpoint(path):
+    """Remove the checkpoint once its run has completed (and been reported)."""
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def apply_actions(session, rows, chunk_size: int = 1000, checkpoint=None, progress=print):
+    """Delete duplicate rows in chunks of `chunk_size`, committing each chunk.
+
+    When `checkpoint` is a file path, each committed chunk's rows are appended to it. A
+    re-run recomputes the remaining duplicates (already-deleted rows are simply gone) and
+    appends to the same checkpoint, so an interrupted run can be resumed and the final
+    report still covers every removal. Returns all removed rows as (id, user_id, amount)
+    tuples, including those from earlier runs; call `clear_checkpoint` when done.
+    """
+    removed = _load_checkpoint(checkpoint)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        session.query(XPEvent).filter(XPEvent.id.in_([r.id for r in chunk])).delete(synchronize_session=False)
+        session.commit()
+        _append_checkpoint(checkpoint, chunk)
+        removed.extend((r.id, r.user_id, r.amount) for r in chunk)
+        if progress:
+            progress(f'  removed {start + len(chunk):,}/{len(rows):,} rows')
+    return removed
+
+
+def write_report(path, removed):
+    """Write removed ids and the XP delta per user as JSON, or CSV if `path` ends in .csv."""
+    delta = defaultdict(int)
+    for _id, user_id, amount in removed:
+        delta[user_id] -= amount
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'user_id', 'amount', 'user_xp_delta'])
+            for row_id, user_id, amount in removed:
+                writer.writerow([row_id, user_id, amount, delta[user_id]])
     else:
-        user_id, idemp = key
-        rows = session.execute(
-            text(
-                """
-            SELECT id, amount, created_at
-            FROM xp_events
-            WHERE user_id = :uid AND idempotency_key = :idemp
-            ORDER BY created_at ASC, id ASC
-            """
-            ),
-            {'uid': user_id, 'idemp': idemp}
-        ).fetchall()
-    return rows
+        with open(path, 'w') as f:
+            json.dump({
+                'removed_ids': [r[0] for r in removed],
+                'removed': [{'id': i, 'user_id': u, 'amount': a} for i, u, a in removed],
+                'xp_delta_by_user': {str(u): d for u, d in sorted(delta.items())},
+            }, f, indent=2)
 
 
-def dry_run(session):
-    dup_source, dup_idemp = find_duplicate_groups(session)
-    total_dup = 0
-    actions = []
-
-    print(f"Found {len(dup_source)} duplicate groups by (user,source,source_id)")
-    print(f"Found {len(dup_idemp)} duplicate groups by (user,idempotency_key)")
-
-    for row in dup_source:
-        key = (row.user_id, row.source, row.source_id)
-        rows = collect_rows_for_group(session, 'source', key)
-        keep = rows[0]
-        remove = rows[1:]
-        total_dup += len(remove)
-        actions.append(('source', key, keep, remove))
-
-    for row in dup_idemp:
-        key = (row.user_id, row.idempotency_key)
-        rows = collect_rows_for_group(session, 'idemp', key)
-        keep = rows[0]
-        remove = rows[1:]
-        total_dup += len(remove)
-        actions.append(('idemp', key, keep, remove))
-
-    print(f"Total duplicate event rows that would be removed: {total_dup}")
-    return actions
-
-
-def apply_actions(session, actions):
-    removed_ids = []
-    for kind, key, keep, remove in actions:
-        ids = [r.id for r in remove]
-        if not ids:
-            continue
-        # Use ORM delete to avoid param style issues
-        session.query(XPEvent).filter(XPEvent.id.in_(ids)).delete(synchronize_session=False)
-        removed_ids.extend(ids)
-    return removed_ids
-
-
-def reconcile_users(session):
-    # Recalculate xp_total per user and update level
-    users = session.execute("SELECT id FROM users").fetchall()
-    updates = []
-    for u in users:
-        uid = u.id
-        s = session.execute(
-            "SELECT COALESCE(SUM(amount),0) as total FROM xp_events WHERE user_id = :uid",
-            {'uid': uid}
-        ).fetchone()
-        total = int(s.total or 0)
-        level = compute_new_level(total)
+def _has_pending_column(session) -> bool:
+    # xp_events.pending arrives with migration 0006; this script may run before it
+    return any(c['name'] == 'pending' for c in inspect(session.get_bind()).get_columns('xp_events'))
+
+
+def _drift_query(only_drifted: bool, skip_pending: bool = False):
+    # one aggregate pass over xp_events, joined to users so users without events get 0.
+    # Events still pending in async ingestion are not part of xp_total yet.
+    join = "e.user_id = u.id AND e.pending = false" if skip_pending else "e.user_id = u.id"
+    sql = f"""
+        SELECT u.id AS id, u.xp_total AS xp_total, u.level AS level, COALESCE(SUM(e.amount), 0) AS total
+        FROM users u
+        LEFT JOIN xp_events e ON {join}
+        GROUP BY u.id, u.xp_total, u.level
+        """
+    if only_drifted:
+        sql += " HAVING COALESCE(SUM(e.amount), 0) <> COALESCE(u.xp_total, 0)"
+    return text(sql + " ORDER BY u.id")
+
+
+def _write_updates(session, rows):
+    """Write (uid, total, level) rows: UPDATE ... FROM (VALUES ...) on PostgreSQL,
+    executemany elsewhere."""
+    if not rows:
+        return
+    if session.get_bind().dialect.name == 'postgresql':
+        params = {}
+        values = []
+        for i, (uid, total, level) in enumerate(rows):
+            values.append(f'(CAST(:u{i} AS INTEGER), CAST(:t{i} AS INTEGER), CAST(:l{i} AS INTEGER))')
+            params.update({f'u{i}': uid, f't{i}': total, f'l{i}': level})
+        session.execute(
+            text(
+                "UPDATE users AS u SET xp_total = v.total, level = v.level "
+                f"FROM (VALUES {', '.join(values)}) AS v(id, total, level) WHERE u.id = v.id"
+            ),
+            params,
+        )
+    else:
         session.execute(
-            "UPDATE users SET xp_total = :total, level = :level WHERE id = :uid",
-            {'total': total, 'level': level, 'uid': uid}
+            text("UPDATE users SET xp_total = :total, level = :level WHERE id = :uid"),
+            [{'uid': uid, 'total': total, 'level': level} for uid, total, level in rows],
         )
-        updates.append((uid, total, level))
-    return updates
+
+
+def reconcile_users(session, only_drifted: bool = False, chunk_size: int = 5000, progress=print):
+    """Set each user's xp_total to the sum of their events and recompute level.
+
+    Runs one GROUP BY query (streamed in chunks), computes levels per chunk with
+    compute_levels and writes only rows whose xp_total or level actually changed, in
+    chunked bulk UPDATEs. With `only_drifted` the query itself only returns users whose
+    stored xp_total differs from their event sum. Returns the number of users updated.
+    Does not commit.
+    """
+    scanned = 0
+    updated = 0
+    query = _drift_query(only_drifted, skip_pending=_has_pending_column(session))
+    result = session.execute(query, execution_options={'yield_per': chunk_size})
+    for chunk in result.partitions(chunk_size):
+        totals = [int(r.total or 0) for r in chunk]
+        levels = compute_levels(totals)
+        changes = [
+            (r.id, total, level)
+            for r, total, level in zip(chunk, totals, levels)
+            if r.xp_total != total or r.level != level
+        ]
+        _write_updates(session, changes)
+        scanned += len(chunk)
+        updated += len(changes)
+        if progress:
+            progress(f'  reconciled {scanned:,} users, {updated:,} updated')
+    return updated
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--apply', action='store_true', help='Apply deletions and reconcile users')
+    parser.add_argument('--only-drifted', action='store_true',
+                        help='Only update users whose stored xp_total differs from their event sum')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Users per bulk UPDATE during reconcile')
+    parser.add_argument('--delete-chunk-size', type=int, default=1000, help='Event rows deleted per transaction')
+    parser.add_argument('--checkpoint', help='Checkpoint file for resuming an interrupted --apply')
+    parser.add_argument('--report', help='Write removed ids and per-user XP delta to this .json or .csv file')
     args = parser.parse_args()
 
-    # Ensure the SQLAlchemy instance is initialized with the Flask app
-    db.init_app(app)
+    # bind the SQLAlchemy instance to the Flask app
+    create_app()
     with app.app_context():
         session = db.session
-        actions = dry_run(session)
+        rows = dry_run(session)
         if not args.apply:
+            if args.report:
+                write_report(args.report, [tuple(r) for r in rows])
+                print(f'Wrote report of rows that would be removed to {args.report}')
             print('\nDry-run complete. Re-run with --apply to remove duplicates and reconcile users.')
             return
 
         print('\nApplying duplicate removals...')
-        removed = apply_actions(session, actions)
-        session.commit()
+        removed = apply_actions(session, rows, chunk_size=args.delete_chunk_size, checkpoint=args.checkpoint)
         print(f'Removed {len(removed)} xp_event rows')
+        if args.report:
+            write_report(args.report, removed)
+            print(f'Wrote report to {args.report}')
+        # a later run with the same --checkpoint must not report these removals again
+        clear_checkpoint(args.checkpoint)
 
         print('Reconciling users xp_total and levels...')
-        updates = reconcile_users(session)
+        updated = reconcile_users(session, only_drifted=args.only_drifted, chunk_size=args.chunk_size)
         session.commit()
-        print(f'Updated {len(updates)} users')
+        print(f'Updated {updated} users')
         print('Done.')
 
 
@@ -0,0 +1,46 @@
+"""Run the DB-backed job scheduler (see backend/scheduler.py).
+
+Usage:
+  python backend/scripts/job_scheduler.py [--threads 4]
+
+Claims queued jobs from the `jobs` table and runs them on `--threads` executor threads,
+renewing their leases while they run. Start as many copies as needed; on PostgreSQL
+they claim disjoint jobs. Stop with Ctrl-C or SIGTERM (`docker stop`); running jobs are
+finished first, with their leases still renewed, so give the container a stop grace period
+longer than your longest job.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app import app, create_app, db
+from backend.scheduler import Scheduler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=int(os.getenv('SCHEDULER_THREADS', '4')))
+    args = parser.parse_args()
+
+    create_app()
+    stop = threading.Event()
+    scheduler = Scheduler(app, threads=args.threads)
+    print(f'Starting job scheduler {scheduler.owner} with {args.threads} threads...')
+
+    def _stop(signum, frame):
+        if not stop.is_set():
+            print(f'{signal.Signals(signum).name}: stopping; waiting for running jobs...')
+        stop.set()
+        scheduler.wake()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    scheduler.run(stop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Publish outbox events to a Redis stream or a JSON-lines file.
+
+Usage:
+  python backend/scripts/outbox_relay.py --sink redis [--stream outbox] [--max-lag 100000]
+  python backend/scripts/outbox_relay.py --sink file --path events.jsonl
+  python backend/scripts/outbox_relay.py --sink file --path events.jsonl --once
+
+Each --consumer name keeps its own offset in `outbox_offsets`, so several sinks can be
+fed from the same outbox independently. Delivery is at-least-once; downstream consumers
+should deduplicate on the event `id`.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app import app, create_app, db
+from backend import outbox, redis_client
+
+
+def build_sink(args):
+    if args.sink == 'file':
+        if not args.path:
+            raise SystemExit('--path is required for the file sink')
+        return outbox.FileSink(args.path)
+    client = redis_client.get_redis(app.config.get('REDIS_URL', os.getenv('REDIS_URL')), socket_timeout=5)
+    if client is None:
+        raise SystemExit('redis is not installed')
+    return outbox.RedisStreamSink(client, stream=args.stream, maxlen=args.maxlen, max_lag=args.max_lag)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sink', choices=('redis', 'file'), default='redis')
+    parser.add_argument('--path', help='Output file for the file sink')
+    parser.add_argument('--stream', default='outbox', help='Redis stream name')
+    parser.add_argument('--maxlen', type=int, help='Approximate cap on the Redis stream length')
+    parser.add_argument('--max-lag', type=int, help='Pause while a consumer group lags by more entries than this')
+    parser.add_argument('--consumer', help='Offset name (defaults to the sink name)')
+    parser.add_argument('--once', action='store_true', help='Publish everything pending and exit')
+    args = parser.parse_args()
+
+    create_app()
+    sink = build_sink(args)
+    consumer = args.consumer or args.sink
+    if args.once:
+        with app.app_context():
+            total = 0
+            while True:
+                n = outbox.relay_once(db.session, sink, consumer, int(app.config.get('OUTBOX_RELAY_BATCH_SIZE', 500)),
+                                      float(app.config.get('OUTBOX_GAP_GRACE_SECONDS', 5)))
+                if not n:
+                    break
+                total += n
+            print(f'Published {total} outbox events')
+        return
+    print(f'Starting outbox relay ({args.sink}, consumer {consumer})...')
+    outbox.run_relay(app, sink, consumer)
+
+
+if __name__ == '__main__':
+    main()
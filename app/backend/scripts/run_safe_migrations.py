@@ -12,7 +12,7 @@ import sys
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend.app import app, db
+from backend.app import app, create_app, db
 from alembic.config import Config
 from alembic import command
 
@@ -23,7 +23,7 @@ def main():
     args = parser.parse_args()
 
     # initialize DB integration
-    db.init_app(app)
+    create_app()
     with app.app_context():
         # Import dedupe helper functions lazily so they use the initialized DB
         try:
@@ -33,23 +33,21 @@ def main():
             return
 
         session = db.session
-        actions = dry_run(session)
-        total = sum(len(rem) for (_k, _key, _keep, rem) in actions)
-        print(f"Dedupe dry-run: total duplicate rows identified = {total}")
+        rows = dry_run(session)
+        print(f"Dedupe dry-run: total duplicate rows identified = {len(rows)}")
 
         if not args.apply:
             print('\nDry-run complete. Re-run with --apply to remove duplicates and run Alembic migrations.')
             return
 
         print('\nApplying duplicate removals...')
-        removed = apply_actions(session, actions)
-        session.commit()
+        removed = apply_actions(session, rows)
         print(f'Removed {len(removed)} xp_event rows')
 
         print('Reconciling users xp_total/levels...')
-        updates = reconcile_users(session)
+        updated = reconcile_users(session)
         session.commit()
-        print(f'Updated {len(updates)} users')
+        print(f'Updated {updated} users')
 
         # Run alembic upgrade
         print('Running Alembic upgrade head...')
@@ -7,22 +7,164 @@ Note: this is a minimal example. Real execution should sandbox code in container
 """
 import subprocess
 import shlex
+import signal
+import threading
+import uuid
 from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import select, update
 from backend.app import db
 from backend.models import JobRecord
 import os
 from backend.scripts import container_runner
+from backend import badge_rules, job_output, outbox, runner_pool
 
 
-def run_job(job_id: int):
-    # run job identified by job_id; this function is intended to be enqueued by RQ
+def _record_status(job):
+    # committed together with the status change it reports
+    outbox.emit('job.status', job.user_id, {'job_id': job.id, 'user_id': job.user_id, 'status': job.status})
+    if job.user_id is not None:
+        badge_rules.evaluate([('job.status', job.user_id, {'status': job.status})])
+
+
+def _output_writer(session, job_id):
+    cfg = current_app.config
+    return job_output.OutputWriter(
+        session, job_id,
+        chunk_bytes=int(cfg.get('JOB_OUTPUT_CHUNK_BYTES', job_output.DEFAULT_CHUNK_BYTES)),
+        max_bytes=int(cfg.get('JOB_OUTPUT_MAX_BYTES', job_output.DEFAULT_MAX_BYTES)),
+        preview_bytes=int(cfg.get('JOB_OUTPUT_PREVIEW_BYTES', job_output.DEFAULT_PREVIEW_BYTES)),
+        flush_seconds=float(cfg.get('JOB_OUTPUT_FLUSH_SECONDS', job_output.DEFAULT_FLUSH_SECONDS)),
+    )
+
+
+class _CancelWatch:
+    """Polls the job's status every JOB_CANCEL_POLL_SECONDS while it runs. Once the row
+    reads 'cancelled' (see the cancel endpoints) it sets `event` and runs the registered
+    kill callbacks, so cancellation works the same for RQ and the scheduler. A scheduler
+    job whose lease passed to another owner is stopped the same way."""
+
+    def __init__(self, job_id: int, owner: str = None):
+        self.job_id = job_id
+        self.owner = owner
+        self.poll = float(current_app.config.get('JOB_CANCEL_POLL_SECONDS', 1))
+        self.event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._app = current_app._get_current_object()
+
+    def on_cancel(self, callback) -> None:
+        with self._lock:
+            self._callbacks.append(callback)
+            fired = self.event.is_set()
+        if fired:
+            callback()
+
+    def _watch(self) -> None:
+        with self._app.app_context():
+            while not self._done.wait(self.poll):
+                try:
+                    row = db.session.execute(select(JobRecord.status, JobRecord.lease_owner)
+                                             .where(JobRecord.id == self.job_id)).first()
+                except Exception:
+                    row = None
+                finally:
+                    db.session.remove()
+                if row is not None and (row.status == 'cancelled' or (self.owner and row.lease_owner != self.owner)):
+                    with self._lock:
+                        self.event.set()
+                        callbacks = list(self._callbacks)
+                    for callback in callbacks:
+                        callback()
+                    return
+
+    def __enter__(self):
+        threading.Thread(target=self._watch, name=f'job-cancel-{self.job_id}', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+
+
+def _run_local(args, writer, timeout, watch):
+    """Run `args` and stream its stdout/stderr into `writer` as it is produced."""
+    # own process group, so a kill also reaches anything the command spawned
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                            start_new_session=True)
+
+    def kill():
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    watch.on_cancel(kill)
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        fd = proc.stdout.fileno()
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            writer.write_bytes(data)
+        rc = proc.wait()
+    finally:
+        timed_out = not timer.is_alive()
+        timer.cancel()
+        proc.stdout.close()
+    if timed_out and rc < 0 and not watch.event.is_set():
+        writer.write(f'\nTimeout after {timeout}s')
+    return rc
+
+
+def _transition(session, job, values: dict, from_statuses, owner: str = None) -> bool:
+    """Apply `values` to `job` only while it is in `from_statuses` (and, for scheduler
+    jobs, still leased by `owner`), recording the status change. Commits either way
+    (pending output chunks are kept) and returns whether the row was updated."""
+    stmt = update(JobRecord).where(JobRecord.id == job.id, JobRecord.status.in_(from_statuses))
+    if owner is not None:
+        stmt = stmt.where(JobRecord.lease_owner == owner)
+    moved = session.execute(stmt.values(**values)).rowcount == 1
+    if moved and 'status' in values:
+        _record_status(job)
+    session.commit()
+    return moved
+
+
+def _finish(session, job, values: dict, owner: str = None) -> str:
+    """Final write for a running job. If it was cancelled meanwhile, keep that status;
+    if its lease moved to another scheduler, leave the row to the new owner."""
+    values = {'finished_at': datetime.now(timezone.utc), **values}
+    if _transition(session, job, values, ('running',), owner):
+        return job.output
+    session.refresh(job)
+    if job.status == 'cancelled':
+        # the cancel endpoint already recorded the status change
+        _transition(session, job, {'output': (values.get('output') or '') + '\n[cancelled by user]'}, ('cancelled',))
+        return job.output
+    current_app.logger.warning('job %s: lease lost (now %s), result discarded', job.id, job.status)
+    return 'lease lost'
+
+
+def run_job(job_id: int, claimed: bool = False, owner: str = None):
+    # run job identified by job_id; this function is intended to be enqueued by RQ.
+    # `claimed` jobs were already marked running by backend.scheduler under `owner`'s lease.
+    # Every status change is conditional, so a job cancelled, re-claimed or started by
+    # another worker in the meantime is neither run twice nor overwritten.
     session = db.session
     job = session.get(JobRecord, job_id)
     if not job:
         return 'job not found'
-    job.status = 'running'
-    job.started_at = datetime.now(timezone.utc)
-    session.commit()
+    if claimed:
+        # no-op write: succeeds only while the lease is still ours
+        started = _transition(session, job, {'lease_owner': JobRecord.lease_owner}, ('running',), owner)
+    else:
+        started = _transition(session, job, {'status': 'running', 'started_at': datetime.now(timezone.utc)},
+                              ('queued', 'enqueued'))
+    if not started:
+        session.refresh(job)
+        return 'job cancelled' if job.status == 'cancelled' else f'job not runnable ({job.status})'
 
     # For safety in this scaffold, do not execute arbitrary code.
     # If payload contains {'command': '...'}, we could run a safe subset.
@@ -30,35 +172,32 @@ def run_job(job_id: int):
         payload = job.payload or {}
         cmd = payload.get('command') if isinstance(payload, dict) else None
         if not cmd:
-            job.output = 'no command provided; execution disabled in scaffold'
-            job.status = 'finished'
-            job.finished_at = datetime.now(timezone.utc)
-            session.commit()
-            return job.output
-
-        # If configured, run inside a container runner image for better isolation.
-        image = os.getenv('DOCKER_RUNNER_IMAGE')
-        if os.getenv('USE_CONTAINER_RUNNER', '0') in ('1', 'true', 'True') and image:
-            rc, out = container_runner.run_in_container(image, cmd, timeout= int(os.getenv('JOB_RUN_TIMEOUT', '30')),
-                                                      memory=os.getenv('JOB_RUN_MEMORY', '256m'))
-            job.output = out
-            job.status = 'finished' if rc == 0 else 'failed'
-            job.finished_at = datetime.now(timezone.utc)
-            session.commit()
-            return out
-
-        # Fallback to simple local execution (unsafe for untrusted code)
-        args = shlex.split(cmd)
-        proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=30)
-        out = proc.stdout.decode('utf-8', errors='replace')
-        job.output = out
-        job.status = 'finished'
-    job.finished_at = datetime.now(timezone.utc)
-        session.commit()
-        return out
+            return _finish(session, job, {'status': 'finished',
+                                          'output': 'no command provided; execution disabled in scaffold'}, owner)
+
+        cfg = current_app.config
+        timeout = int(cfg.get('JOB_RUN_TIMEOUT', 30))
+        writer = _output_writer(session, job.id)
+        # every path stores output while the job runs, so clients can tail it
+        with _CancelWatch(job.id, owner) as watch:
+            # Preferred: a warm sandbox from the runner pool (no per-job container start).
+            if cfg.get('USE_RUNNER_POOL'):
+                rc, out = runner_pool.get_pool().run(job.language or 'python', cmd, timeout=timeout, cancel=watch.event,
+                                                     on_output=writer.write)
+                writer.write(out)
+            # If configured, run inside a container runner image for better isolation.
+            elif cfg.get('USE_CONTAINER_RUNNER') and cfg.get('DOCKER_RUNNER_IMAGE'):
+                name = f'job-{job.id}-{uuid.uuid4().hex[:8]}'
+                watch.on_cancel(lambda: container_runner.kill_container(name))
+                rc, out = container_runner.run_in_container(cfg['DOCKER_RUNNER_IMAGE'], cmd, timeout=timeout,
+                                                            memory=cfg.get('JOB_RUN_MEMORY', '256m'), name=name,
+                                                            on_output=writer.write_bytes)
+                writer.write(out)
+            else:
+                # Fallback to simple local execution (unsafe for untrusted code).
+                rc = _run_local(shlex.split(cmd), writer, timeout, watch)
+        preview = writer.close()
+        return _finish(session, job, {'status': 'finished' if rc == 0 else 'failed', 'output': preview}, owner)
     except Exception as e:
-        job.output = f'error during execution: {e}'
-        job.status = 'failed'
-    job.finished_at = datetime.now(timezone.utc)
-        session.commit()
-        return job.output
+        session.rollback()
+        return _finish(session, job, {'status': 'failed', 'output': f'error during execution: {e}'}, owner)
@@ -0,0 +1,36 @@
+"""Standalone consumer for async XP ingestion (XP_INGEST_MODE=async).
+
+Usage:
+  python backend/scripts/xp_ingest_consumer.py            # run until interrupted
+  python backend/scripts/xp_ingest_consumer.py --once     # drain pending events and exit
+
+Use this when the web processes run with XP_INGEST_CONSUMER=external. It polls every
+XP_INGEST_POLL_SECONDS and folds pending events into user totals in micro-batches of
+XP_INGEST_BATCH_SIZE; on PostgreSQL several copies can run at once.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app import app, create_app, db
+from backend import ingest
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--once', action='store_true', help='Drain pending events and exit')
+    args = parser.parse_args()
+
+    create_app()
+    if args.once:
+        with app.app_context():
+            print(f'Applied {ingest.drain(db.session)} pending xp events')
+        return
+    print('Starting XP ingest consumer...')
+    ingest.run_consumer(app)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 """Seed the dev SQLite DB with example users and badges."""
-from backend.app import app, db
+from backend.app import app, create_app, db
 from backend.models import User, Badge, XPEvent
 
+create_app()
 with app.app_context():
     # create tables
     db.create_all()
@@ -19,9 +20,13 @@ with app.app_context():
 
     # create some badges
     if not Badge.query.first():
-        b1 = Badge(code='first_lab', name='First Lab', description='Completed first lab')
+        b1 = Badge(code='first_lab', name='First Lab', description='Completed first lab',
+                   rule={'type': 'source_events', 'source': 'lab', 'min': 1})
         b2 = Badge(code='python_beginner', name='Python Beginner', description='Completed Python module')
-        db.session.add_all([b1, b2])
+        b3 = Badge(code='xp_500', name='Rising Star', description='Earned 500 XP', rule={'type': 'xp_total', 'min': 500})
+        b4 = Badge(code='week_streak', name='On a Roll', description='Checked in 7 days in a row',
+                   rule={'type': 'streak', 'min': 7})
+        db.session.add_all([b1, b2, b3, b4])
         db.session.commit()
         print('Created sample badges')
     else:
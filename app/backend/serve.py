@@ -0,0 +1,136 @@
+"""Production entry point: the app under gunicorn.
+
+Usage:
+  python -m backend.serve web      # API, threaded sync workers
+  python -m backend.serve stream   # SSE endpoints, gevent workers
+
+`web` runs SERVE_WORKERS processes (default 2 x CPUs + 1, capped at SERVE_MAX_WORKERS)
+with SERVE_THREADS threads each. `stream` serves the long-lived SSE connections
+(/api/v1/leaderboard/stream, /api/v1/jobs/<id>/output/stream) on gevent workers, one per
+CPU with SERVE_WORKER_CONNECTIONS connections each, so idle subscribers never hold a sync
+worker. psycopg2 is made cooperative there with psycogreen, so a worker's database
+queries do not block each other. Run both behind a reverse proxy that sends the stream
+paths to the stream port.
+
+The app is built once in the master (`preload_app`): models, blueprints and the
+leaderboard index load before forking and are shared copy-on-write by the workers.
+Connections opened during the preload are discarded in each worker after the fork.
+Workers are recycled after SERVE_MAX_REQUESTS requests (with jitter) to bound memory growth.
+"""
+import argparse
+import os
+import sys
+
+ROLES = ('web', 'stream')
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _patch_psycopg() -> None:
+    """Make psycopg2 yield to the gevent hub while it waits on the server.
+
+    psycopg2 talks to libpq in C, which `monkey.patch_all` does not reach: without this
+    every query (the job output tail polls one per connection) blocks the whole worker.
+    """
+    if not os.getenv('DATABASE_URL', '').startswith('postgres'):
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        sys.exit('the stream role needs psycogreen with PostgreSQL: pip install -r backend/requirements.txt')
+    patch_psycopg()
+
+
+def options(role: str, cpus: int = None) -> dict:
+    """gunicorn settings for `role`, sized from the CPU count and SERVE_* overrides."""
+    cpus = cpus or os.cpu_count() or 1
+    port = _int_env('PORT', 5000 if role == 'web' else 5001)
+    opts = {
+        'bind': os.getenv('SERVE_BIND', f'0.0.0.0:{port}'),
+        'preload_app': True,
+        'graceful_timeout': _int_env('SERVE_GRACEFUL_TIMEOUT', 30),
+        'keepalive': _int_env('SERVE_KEEPALIVE', 5),
+        'max_requests': _int_env('SERVE_MAX_REQUESTS', 10000),
+        'max_requests_jitter': _int_env('SERVE_MAX_REQUESTS_JITTER', 1000),
+        'accesslog': os.getenv('SERVE_ACCESS_LOG', '-'),
+        'post_fork': _post_fork,
+    }
+    if role == 'web':
+        opts.update(
+            worker_class='gthread',
+            workers=_int_env('SERVE_WORKERS', min(2 * cpus + 1, _int_env('SERVE_MAX_WORKERS', 12))),
+            threads=_int_env('SERVE_THREADS', 4),
+            timeout=_int_env('SERVE_TIMEOUT', 30),
+        )
+    else:
+        opts.update(
+            worker_class='gevent',
+            workers=_int_env('SERVE_STREAM_WORKERS', cpus),
+            worker_connections=_int_env('SERVE_WORKER_CONNECTIONS', 1000),
+            # async workers heartbeat independently of how long a response runs
+            timeout=_int_env('SERVE_TIMEOUT', 30),
+            max_requests=0,
+        )
+    return opts
+
+
+def _post_fork(server, worker) -> None:
+    # never share the master's pooled DB connections with a forked worker
+    from backend.app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def load_app():
+    """Build the app and warm what every worker needs, before forking."""
+    from backend.app import app, create_app, db
+    create_app()
+    with app.app_context():
+        from backend import leaderboard
+        try:
+            leaderboard.rebuild(db.session)
+        except Exception:
+            app.logger.exception('leaderboard warm-up failed; it will be built on first use')
+        finally:
+            db.session.remove()
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('role', choices=ROLES, nargs='?', default='web')
+    args = parser.parse_args(argv)
+    if args.role == 'stream':
+        # patch before the app (and its locks and sockets) is imported by the preload
+        from gevent import monkey
+        monkey.patch_all()
+        _patch_psycopg()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit('gunicorn is not installed: pip install -r backend/requirements.txt')
+
+    class Server(BaseApplication):
+        def __init__(self, settings):
+            self.settings = settings
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app()
+
+    opts = options(args.role)
+    # lets per-process pools (password hashing) size themselves to a share of the CPUs
+    os.environ.setdefault('SERVE_WORKER_PROCESSES', str(opts['workers']))
+    Server(opts).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Before/after latency benchmark for the hot-path indexes (alembic 0004_hot_path_indexes).
+
+Usage:
+  python backend/tests/bench_indexes.py [--events 1000000] [--users 1000] [--jobs 100000]
+  python backend/tests/bench_indexes.py --database-url postgresql://...   # scratch DB only!
+
+Seeds a scratch database, drops the indexes, times each endpoint, recreates the indexes
+and times them again. Profile caching is disabled so every request hits the database.
+Not collected by pytest (no `test_` prefix).
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from sqlalchemy import insert, text
+
+from backend.app import app, create_app, db
+from backend.auth import create_token
+from backend.models import User, XPEvent, JobRecord, Badge, UserBadge, Streak
+
+INDEX_NAMES = (
+    'ix_users_xp_total',
+    'ix_xp_events_user_created',
+    'ix_jobs_user_created',
+    'uq_user_badges_user_badge',
+    'uq_streaks_user_id',
+)
+CHUNK = 50_000
+
+
+def _indexes():
+    return [ix for table in db.metadata.tables.values() for ix in table.indexes if ix.name in INDEX_NAMES]
+
+
+def seed(users: int, events: int, jobs: int):
+    db.drop_all()
+    db.create_all()
+    rng = random.Random(1)
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    db.session.execute(insert(User), [
+        {'id': i, 'display_name': f'user-{i}', 'xp_total': rng.randrange(100_000), 'level': 1}
+        for i in range(1, users + 1)
+    ])
+    for start in range(0, events, CHUNK):
+        db.session.execute(insert(XPEvent), [
+            {'user_id': rng.randint(1, users), 'amount': 5, 'source': 'bench',
+             'created_at': base + timedelta(seconds=i)}
+            for i in range(start, min(events, start + CHUNK))
+        ])
+        print(f'  seeded {min(events, start + CHUNK):,} events', end='\r', flush=True)
+    print()
+    for start in range(0, jobs, CHUNK):
+        db.session.execute(insert(JobRecord), [
+            {'user_id': rng.randint(1, users), 'status': 'finished', 'created_at': base + timedelta(seconds=i)}
+            for i in range(start, min(jobs, start + CHUNK))
+        ])
+    db.session.execute(insert(Badge), [{'id': i, 'code': f'b{i}', 'name': f'Badge {i}'} for i in range(1, 21)])
+    db.session.execute(insert(UserBadge), [
+        {'user_id': u, 'badge_id': b} for u in range(1, users + 1) for b in rng.sample(range(1, 21), 5)
+    ])
+    db.session.execute(insert(Streak), [{'user_id': u, 'current_streak': 1} for u in range(1, users + 1)])
+    db.session.commit()
+
+
+def measure(client, users: int, requests: int):
+    rng = random.Random(2)
+    endpoints = {
+        'GET /users/<id>/stats': lambda uid, h: client.get(f'/api/v1/users/{uid}/stats'),
+        'GET /users/<id>/badges': lambda uid, h: client.get(f'/api/v1/users/{uid}/badges'),
+        'GET /me/progress': lambda uid, h: client.get('/api/v1/me/progress', headers=h),
+        'GET /jobs': lambda uid, h: client.get('/api/v1/jobs?limit=50', headers=h),
+    }
+    results = {}
+    for name, call in endpoints.items():
+        samples = []
+        for _ in range(requests):
+            uid = rng.randint(1, users)
+            headers = {'Authorization': f'Bearer {create_token(uid)}'}
+            start = time.perf_counter()
+            rv = call(uid, headers)
+            samples.append(time.perf_counter() - start)
+            assert rv.status_code == 200, (name, rv.status_code)
+        samples.sort()
+        results[name] = samples[len(samples) // 2] * 1000
+    # the leaderboard endpoint is served from the in-memory index; time the SQL it replaced
+    samples = []
+    with app.app_context():
+        for _ in range(requests):
+            start = time.perf_counter()
+            db.session.execute(text('SELECT id FROM users ORDER BY xp_total DESC LIMIT 50')).all()
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    results['SQL leaderboard ORDER BY xp_total'] = samples[len(samples) // 2] * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--jobs', type=int, default=100_000)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['PROFILE_CACHE_TTL_SECONDS'] = 0
+    app.config['RATE_LIMIT_BACKEND'] = 'memory'
+    create_app()
+
+    with app.app_context():
+        print(f'seeding {args.users:,} users, {args.events:,} events, {args.jobs:,} jobs into {url}')
+        seed(args.users, args.events, args.jobs)
+        for ix in _indexes():
+            ix.drop(db.engine)
+
+    with app.test_client() as client:
+        before = measure(client, args.users, args.requests)
+        with app.app_context():
+            for ix in _indexes():
+                ix.create(db.engine)
+            if db.engine.dialect.name == 'postgresql':
+                with db.engine.begin() as conn:
+                    conn.execute(text('ANALYZE'))
+        after = measure(client, args.users, args.requests)
+
+    print(f"{'endpoint (p50 ms)':<36}{'before':>10}{'after':>10}{'speedup':>10}")
+    for name in before:
+        print(f'{name:<36}{before[name]:>10.2f}{after[name]:>10.2f}{before[name] / max(after[name], 1e-9):>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
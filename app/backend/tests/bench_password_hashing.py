@@ -0,0 +1,132 @@
+"""Login storm benchmark: inline password hashing vs the hashing process pool.
+
+Usage:
+  python backend/tests/bench_password_hashing.py [--logins 400] [--concurrency 32] [--server-threads 16]
+                                                  [--method scrypt:32768:8:1] [--workers N] [--queue-limit N]
+
+Serves the app over HTTP with a fixed pool of `--server-threads` request threads (like a
+threaded WSGI server with a bounded worker count), then fires `--logins` logins from
+`--concurrency` clients while one more client keeps calling /api/v1/ping. Prints login and
+ping p50/p99 and how many logins were shed with 503, once with PASSWORD_HASH_POOL=inline
+and once with the process pool. Not collected by pytest (no `test_` prefix).
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import BaseWSGIServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.app import app, create_app, db
+from backend import passwords
+from backend.models import User
+
+
+class PooledServer(BaseWSGIServer):
+    """Handles requests on a fixed number of threads, like a server with N workers."""
+
+    def __init__(self, host, port, wsgi_app, threads):
+        super().__init__(host, port, wsgi_app)
+        self.executor = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def _pct(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def _storm(base, logins, concurrency, users):
+    login_lat, ping_lat, statuses = [], [], []
+    done = threading.Event()
+
+    def pinger():
+        with requests.Session() as s:
+            while not done.is_set():
+                start = time.perf_counter()
+                s.get(f'{base}/api/v1/ping')
+                ping_lat.append(time.perf_counter() - start)
+
+    def login(i):
+        with requests.Session() as s:
+            start = time.perf_counter()
+            rv = s.post(f'{base}/api/v1/auth/login', json={'username': f'bench-{i % users}', 'password': 'pw'})
+            login_lat.append(time.perf_counter() - start)
+            statuses.append(rv.status_code)
+
+    probe = threading.Thread(target=pinger)
+    probe.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    probe.join()
+    return elapsed, login_lat, ping_lat, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--server-threads', type=int, default=16)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--method', default=passwords.DEFAULT_METHOD)
+    parser.add_argument('--workers', type=int, default=0, help='hashing processes (default: CPU count)')
+    parser.add_argument('--queue-limit', type=int, default=0, help='default: 8 per hashing process')
+    args = parser.parse_args()
+
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    app.config.update(SQLALCHEMY_DATABASE_URI=url, RATE_LIMIT_BACKEND='memory', AUTH_RATE_LIMIT='1000000:60',
+                      PASSWORD_HASH_METHOD=args.method)
+    if args.workers:
+        app.config['PASSWORD_HASH_WORKERS'] = args.workers
+    if args.queue_limit:
+        app.config['PASSWORD_HASH_QUEUE_LIMIT'] = args.queue_limit
+    create_app()
+    with app.app_context():
+        db.create_all()
+        pw_hash = generate_password_hash('pw', args.method)
+        db.session.add_all([User(username=f'bench-{i}', display_name=f'bench-{i}', password_hash=pw_hash)
+                            for i in range(args.users)])
+        db.session.commit()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = PooledServer('127.0.0.1', 0, app, args.server_threads)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    print(f'logins={args.logins} concurrency={args.concurrency} server_threads={args.server_threads} '
+          f'method={args.method} cpus={os.cpu_count()}')
+    for mode in ('inline', 'process'):
+        app.config['PASSWORD_HASH_POOL'] = mode
+        passwords.reset()
+        _storm(base, min(args.logins, 10), 2, args.users)  # warm up (starts the pool)
+        elapsed, login_lat, ping_lat, statuses = _storm(base, args.logins, args.concurrency, args.users)
+        ok = statuses.count(200)
+        print(f'{mode:8} {elapsed:6.2f}s  login p50 {_pct(login_lat, .5):7.1f}ms p99 {_pct(login_lat, .99):7.1f}ms  '
+              f'ok {ok} shed(503) {statuses.count(503)}  |  ping p50 {_pct(ping_lat, .5):6.1f}ms '
+              f'p99 {_pct(ping_lat, .99):7.1f}ms ({len(ping_lat)} pings)')
+    server.shutdown()
+    passwords.reset()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Load benchmark for check_rate_limit.
+
+Usage:
+  python backend/tests/bench_rate_limiter.py [--checks 200000] [--keys 10000] [--threads 4]
+  python backend/tests/bench_rate_limiter.py --backend redis --redis-url redis://localhost:6379/0
+
+Reports checks/sec and p50/p99 overhead per check for the selected backend. Not collected
+by pytest (no `test_` prefix).
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.app import app
+from backend import rate_limiter
+
+
+def _worker(n, keys, offset, latencies):
+    with app.app_context():
+        local = []
+        for i in range(n):
+            key = f'bench:{(i + offset) % keys}'
+            start = time.perf_counter()
+            rate_limiter.check_rate_limit(key, '100:60')
+            local.append(time.perf_counter() - start)
+        latencies.extend(local)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checks', type=int, default=200_000)
+    parser.add_argument('--keys', type=int, default=10_000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--backend', choices=('memory', 'redis'), default='memory')
+    parser.add_argument('--redis-url', default=None)
+    args = parser.parse_args()
+
+    app.config['RATE_LIMIT_BACKEND'] = args.backend
+    if args.redis_url:
+        app.config['REDIS_URL'] = args.redis_url
+
+    per_thread = args.checks // args.threads
+    latencies = []
+    threads = [threading.Thread(target=_worker, args=(per_thread, args.keys, t * 7919, latencies))
+               for t in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total = len(latencies)
+    p50 = latencies[total // 2] * 1e6
+    p99 = latencies[int(total * 0.99)] * 1e6
+    print(f'backend={args.backend} checks={total} keys={args.keys} threads={args.threads}')
+    print(f'{total / elapsed:,.0f} checks/s  p50={p50:.1f}us  p99={p99:.1f}us')
+
+
+if __name__ == '__main__':
+    main()
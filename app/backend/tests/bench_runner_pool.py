@@ -0,0 +1,59 @@
+"""Job start latency: a fresh sandbox per job vs the warm runner pool.
+
+Usage:
+  python backend/tests/bench_runner_pool.py [--jobs 50] [--backend local|docker] [--image python:3.11-slim]
+
+"cold" starts a new sandbox for every job, like `container_runner.run_in_container`; "warm"
+sends the same jobs to a RunnerPool whose sandboxes stay up. With the local backend the
+gap is interpreter start-up; with --backend docker it is the container start.
+Not collected by pytest (no `test_` prefix).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.runner_pool import DockerBackend, LocalBackend, RunnerPool
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--backend', choices=('local', 'docker'), default='local')
+    parser.add_argument('--image', default='python:3.11-slim')
+    args = parser.parse_args()
+
+    backend = LocalBackend() if args.backend == 'local' else DockerBackend({'python': args.image})
+    python = sys.executable if args.backend == 'local' else 'python3'
+    command = f'{python} -c "print(sum(range(1000)))"'
+
+    cold = []
+    for _ in range(args.jobs):
+        start = time.perf_counter()
+        pool = RunnerPool(backend, size=1, prewarm=False)
+        pool.run('python', command)
+        pool.shutdown()
+        cold.append(time.perf_counter() - start)
+
+    pool = RunnerPool(backend, size=2)
+    pool.run('python', command)  # wait for the warm-up
+    warm = []
+    for _ in range(args.jobs):
+        start = time.perf_counter()
+        pool.run('python', command)
+        warm.append(time.perf_counter() - start)
+    stats = pool.stats()
+    pool.shutdown()
+
+    print(f'backend={args.backend} jobs={args.jobs}')
+    print(f'cold: median {statistics.median(cold) * 1000:.1f}ms  p95 {sorted(cold)[int(len(cold) * 0.95) - 1] * 1000:.1f}ms')
+    print(f'warm: median {statistics.median(warm) * 1000:.1f}ms  p95 {sorted(warm)[int(len(warm) * 0.95) - 1] * 1000:.1f}ms')
+    print(f"pool: cold_starts={stats['cold_starts']} warm_starts={stats['warm_starts']} "
+          f"queue_wait_avg={stats['queue_wait_avg'] * 1000:.2f}ms exec_avg={stats['exec_avg'] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
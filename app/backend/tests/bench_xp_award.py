@@ -0,0 +1,76 @@
+"""Throughput benchmark: single-event /xp/award vs /xp/award/batch.
+
+Usage:
+  python backend/tests/bench_xp_award.py [--events 5000] [--users 50] [--batch-size 500]
+
+Runs both paths against a fresh temporary SQLite file through the Flask test client and
+prints events/sec for each. Not collected by pytest (no `test_` prefix).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.app import app, create_app, db
+from backend.models import User
+
+
+def _setup(users: int):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([User(display_name=f'bench-{i}') for i in range(users)])
+        db.session.commit()
+        return [u.id for u in User.query.order_by(User.id).all()]
+
+
+def bench_single(client, user_ids, events):
+    start = time.perf_counter()
+    for i in range(events):
+        uid = user_ids[i % len(user_ids)]
+        rv = client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': 5, 'source': 'bench', 'source_id': f's-{i}'})
+        assert rv.status_code == 200, rv.get_json()
+    return time.perf_counter() - start
+
+
+def bench_batch(client, user_ids, events, batch_size):
+    start = time.perf_counter()
+    for offset in range(0, events, batch_size):
+        awards = [
+            {'user_id': user_ids[i % len(user_ids)], 'xp': 5, 'source': 'bench', 'source_id': f'b-{i}'}
+            for i in range(offset, min(events, offset + batch_size))
+        ]
+        rv = client.post('/api/v1/xp/award/batch', json={'awards': awards})
+        assert rv.status_code == 200 and rv.get_json()['awarded'] == len(awards), rv.get_json()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    app.config['XP_RATE_LIMIT'] = f'{args.events * 2}:60'
+    app.config['XP_BATCH_MAX_ITEMS'] = max(args.batch_size, 1000)
+    create_app()
+
+    with app.test_client() as client:
+        user_ids = _setup(args.users)
+        single = bench_single(client, user_ids, args.events)
+        user_ids = _setup(args.users)
+        batch = bench_batch(client, user_ids, args.events, args.batch_size)
+
+    print(f'events={args.events} users={args.users} batch_size={args.batch_size}')
+    print(f'single: {single:.2f}s  {args.events / single:,.0f} events/s')
+    print(f'batch:  {batch:.2f}s  {args.events / batch:,.0f} events/s  ({single / batch:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Same-user contention benchmark: synchronous /xp/award vs async ingestion.
+
+Usage:
+  python backend/tests/bench_xp_contention.py [--events 2000] [--threads 8] [--database-url URL]
+
+Every request awards XP to the same user from `--threads` concurrent clients. In sync mode
+each award holds the user's row lock until commit; in async mode (XP_INGEST_MODE=async)
+the request only inserts a pending event and the in-process consumer folds them into
+the user total in micro-batches. Prints requests/sec for both and checks the final total.
+Defaults to a temporary SQLite file, where the database lock rather than the row lock
+is what serializes writers; pass a PostgreSQL --database-url to measure row-lock
+contention. Not collected by pytest (no `test_` prefix).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.app import app, create_app, db
+from backend import ingest
+from backend.models import User
+
+
+def _setup():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        u = User(display_name='hot-user')
+        db.session.add(u)
+        db.session.commit()
+        return u.id
+
+
+def _run(user_id, events, threads, prefix):
+    def worker(offset):
+        with app.test_client() as client:
+            for i in range(offset, events, threads):
+                rv = client.post('/api/v1/xp/award', json={'user_id': user_id, 'xp': 1, 'source': 'bench',
+                                                           'source_id': f'{prefix}-{i}'})
+                assert rv.status_code in (200, 202), rv.get_json()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(worker, range(threads)))
+    return time.perf_counter() - start
+
+
+def _wait_applied(user_id, expected, timeout=60.0):
+    deadline = time.perf_counter() + timeout
+    with app.app_context():
+        while True:
+            total = db.session.get(User, user_id).xp_total
+            db.session.remove()
+            if total == expected:
+                return True
+            if time.perf_counter() >= deadline:
+                return False
+            time.sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    if url.startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 60}}
+    app.config['XP_RATE_LIMIT'] = f'{args.events * 2}:60'
+    app.config['RATE_LIMIT_BACKEND'] = 'memory'
+    create_app()
+
+    app.config['XP_INGEST_MODE'] = 'sync'
+    user_id = _setup()
+    sync = _run(user_id, args.events, args.threads, 'sync')
+    sync_exact = _wait_applied(user_id, args.events, timeout=0)
+
+    app.config['XP_INGEST_MODE'] = 'async'
+    app.config['XP_INGEST_READ_YOUR_WRITES'] = False
+    user_id = _setup()
+    start = time.perf_counter()
+    queued = _run(user_id, args.events, args.threads, 'async')
+    applied = _wait_applied(user_id, args.events)
+    settled = time.perf_counter() - start
+
+    print(f'events={args.events} threads={args.threads} db={url.split(":")[0]}')
+    print(f'sync:  {sync:.2f}s  {args.events / sync:,.0f} awards/s'
+          + ('' if sync_exact else '  (user total is wrong: lost updates)'))
+    print(f'async: {queued:.2f}s  {args.events / queued:,.0f} awards/s accepted ({sync / queued:.1f}x); '
+          f'user total {"settled" if applied else "NOT settled"} after {settled:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Micro-benchmark for XP -> level mapping.
+
+Usage:
+  python backend/tests/bench_xp_math.py [--n 200000] [--max-xp 2000000]
+
+Compares the original level-by-level loop with the bisect-based compute_new_level and
+the vectorized compute_levels. Not collected by pytest (no `test_` prefix).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend import schemas
+
+
+def linear_level(current_xp):
+    level = 1
+    while True:
+        if current_xp < schemas.xp_for_level(level + 1):
+            return level
+        level += 1
+
+
+def _time(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=200_000)
+    parser.add_argument('--max-xp', type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    totals = [rng.randrange(args.max_xp) for _ in range(args.n)]
+
+    t_linear, expected = _time(lambda: [linear_level(x) for x in totals])
+    t_bisect, got = _time(lambda: [schemas.compute_new_level(x) for x in totals])
+    t_vector, got_vec = _time(lambda: schemas.compute_levels(totals))
+    assert got == expected and got_vec == expected
+
+    print(f'n={args.n} max_xp={args.max_xp}')
+    for name, t in (('linear loop', t_linear), ('bisect', t_bisect), ('compute_levels', t_vector)):
+        print(f'{name:>15}: {t * 1000:8.1f} ms  {t / args.n * 1e9:8.0f} ns/op  ({t_linear / t:5.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -17,21 +17,15 @@ if backend_dir not in sys.path:
     sys.path.insert(0, backend_dir)
 
 import pytest
-from backend.app import app, db
+from backend.app import app, create_app, db
 from backend.models import User
 
 
 @pytest.fixture(scope='module')
 def test_client():
-    # Use an in-memory SQLite DB for tests
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    app.config['TESTING'] = True
-    # initialize DB for this test instance (guard if already initialized)
-    try:
-        db.init_app(app)
-    except RuntimeError:
-        # already initialized by another test module; that's OK
-        pass
+    # Use an in-memory SQLite DB for tests; the first module to get here binds it,
+    # later ones reuse the same app and database
+    create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'TESTING': True})
     with app.app_context():
         db.create_all()
         # create a sample user
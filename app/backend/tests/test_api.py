@@ -226,3 +226,519 @@ def test_me_checkin_endpoint(test_client):
     assert r2.status_code == 200
     d2 = r2.get_json()
     assert d2.get('duplicate') is True
+
+
+def test_award_xp_batch(test_client):
+    rv = test_client.post('/api/v1/users', json={'display_name': 'BatchA'})
+    ua = rv.get_json()['user']['id']
+    rv = test_client.post('/api/v1/users', json={'display_name': 'BatchB'})
+    ub = rv.get_json()['user']['id']
+
+    # pre-existing event so the batch sees a stored duplicate
+    r0 = test_client.post('/api/v1/xp/award', json={'user_id': ua, 'xp': 10, 'source': 'lab', 'source_id': 'lab-1'})
+    assert r0.status_code == 200
+
+    awards = [
+        {'user_id': ua, 'xp': 20, 'source': 'lab', 'source_id': 'lab-2'},
+        {'user_id': ua, 'xp': 20, 'source': 'lab', 'source_id': 'lab-1'},   # stored duplicate
+        {'user_id': ub, 'xp': 30, 'idempotency_key': 'grader-1'},
+        {'user_id': ub, 'xp': 30, 'idempotency_key': 'grader-1'},          # in-batch duplicate
+        {'user_id': ub, 'xp': -5},                                          # invalid
+        {'user_id': 999999, 'xp': 5},                                       # unknown user
+    ]
+    rv = test_client.post('/api/v1/xp/award/batch', json={'awards': awards})
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert [r['status'] for r in data['results']] == ['awarded', 'duplicate', 'awarded', 'duplicate', 'rejected', 'rejected']
+    assert data['awarded'] == 2 and data['duplicate'] == 2 and data['rejected'] == 2
+    assert data['results'][0]['new_xp'] == 30
+    assert data['results'][2]['new_xp'] == 30
+
+    rv = test_client.get(f'/api/v1/users/{ub}/stats')
+    assert rv.get_json()['user']['xp_total'] == 30
+
+    # empty batch is a request error
+    rv = test_client.post('/api/v1/xp/award/batch', json={'awards': []})
+    assert rv.status_code == 400
+
+
+def test_award_xp_batch_charges_rate_limit_once_per_user(test_client, monkeypatch):
+    from backend import rate_limiter
+    from backend.routes import xp as xp_routes
+    uid = test_client.post('/api/v1/users', json={'display_name': 'BatchLimited'}).get_json()['user']['id']
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_BACKEND', 'memory')
+    monkeypatch.setitem(app.config, 'XP_RATE_LIMIT', '3:3600')
+    calls = []
+
+    def spy(policy, identity, cost=1):
+        calls.append(cost)
+        return rate_limiter.check_policy(policy, identity, cost)
+    monkeypatch.setattr(xp_routes, 'check_policy', spy)
+
+    rv = test_client.post('/api/v1/xp/award/batch', json={'awards': [{'user_id': uid, 'xp': 1} for _ in range(5)]})
+    data = rv.get_json()
+    # the whole batch did not fit: the 3 tokens left were charged in a second call
+    assert calls == [5, 3]
+    assert data['awarded'] == 3 and data['rejected'] == 2
+    assert {r.get('error') for r in data['results'] if r['status'] == 'rejected'} == {'rate_limited'}
+
+
+def test_award_xp_batch_reports_running_totals_and_bounds_retries(test_client, monkeypatch):
+    from sqlalchemy.exc import IntegrityError
+    from backend.routes import xp as xp_routes
+    from backend.schemas import compute_new_level, xp_for_level
+    uid = test_client.post('/api/v1/users', json={'display_name': 'BatchRunning'}).get_json()['user']['id']
+    monkeypatch.setitem(app.config, 'XP_RATE_LIMIT', '1000:60')
+    step = xp_for_level(2)
+    rv = test_client.post('/api/v1/xp/award/batch', json={'awards': [{'user_id': uid, 'xp': step} for _ in range(3)]})
+    results = rv.get_json()['results']
+    assert [r['new_xp'] for r in results] == [step, 2 * step, 3 * step]
+    assert [r['new_level'] for r in results] == [compute_new_level(n * step) for n in (1, 2, 3)]
+    assert results[0]['leveled_up'] is True
+
+    calls = []
+
+    def conflict(*args):
+        calls.append(1)
+        raise IntegrityError('INSERT', {}, Exception('duplicate key'))
+    monkeypatch.setattr(xp_routes, '_apply_award_batch', conflict)
+    rv = test_client.post('/api/v1/xp/award/batch', json={'awards': [{'user_id': uid, 'xp': 1}]})
+    assert rv.status_code == 409 and rv.headers['Retry-After'] == '1'
+    assert len(calls) == xp_routes._BATCH_ATTEMPTS
+
+
+def test_leaderboard_index_pagination_and_rank(test_client):
+    uids = []
+    for i, xp in enumerate((5_000_000, 4_000_000, 3_000_000)):
+        rv = test_client.post('/api/v1/users', json={'display_name': f'Top{i}'})
+        uid = rv.get_json()['user']['id']
+        r = test_client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': xp})
+        assert r.status_code == 200
+        uids.append(uid)
+
+    rv = test_client.get('/api/v1/leaderboard?limit=2')
+    data = rv.get_json()
+    assert [r['user_id'] for r in data['rows']] == uids[:2]
+    assert data['rows'][0]['rank'] == 1 and data['rows'][0]['xp'] == 5_000_000
+    assert data['next_cursor']
+
+    rv = test_client.get(f"/api/v1/leaderboard?limit=2&cursor={data['next_cursor']}")
+    page2 = rv.get_json()['rows']
+    assert page2[0]['user_id'] == uids[2] and page2[0]['rank'] == 3
+
+    rv = test_client.get(f'/api/v1/leaderboard/users/{uids[1]}?neighbours=1')
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert data['rank'] == 2
+    assert [r['user_id'] for r in data['rows']] == uids
+
+    assert test_client.get('/api/v1/leaderboard?cursor=@@').status_code == 400
+    assert test_client.get('/api/v1/leaderboard/users/999999').status_code == 404
+
+
+def test_leaderboard_refreshes_changes_from_other_processes(test_client, monkeypatch):
+    import time
+    from backend import leaderboard
+    rv = test_client.post('/api/v1/users', json={'display_name': 'ElsewhereTop'})
+    uid = rv.get_json()['user']['id']
+    test_client.get('/api/v1/leaderboard')
+    with app.app_context():
+        # written by another process: this one's index is not told
+        db.session.get(User, uid).xp_total = 10 ** 12
+        db.session.commit()
+    assert test_client.get('/api/v1/leaderboard?limit=1').get_json()['rows'][0]['xp'] != 10 ** 12
+    later = leaderboard.monotonic() + 61
+    monkeypatch.setattr(leaderboard, 'monotonic', lambda: later)
+    # the request that finds the index stale starts a background refresh and is not held up
+    deadline = time.monotonic() + 5
+    while test_client.get('/api/v1/leaderboard?limit=1').get_json()['rows'][0]['user_id'] != uid:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_leaderboard_replays_writes_skipped_during_redis_backoff(test_client, monkeypatch):
+    pytest.importorskip('redis')
+    from backend import leaderboard, redis_client
+    written = {}
+
+    class Pipeline:
+        def zadd(self, key, mapping):
+            written.update(mapping)
+
+        def hset(self, *args):
+            pass
+
+        def sadd(self, *args):
+            pass
+
+        def publish(self, *args):
+            pass
+
+        def execute(self):
+            pass
+
+    class Client:
+        def pipeline(self, transaction=True):
+            return Pipeline()
+
+    url = 'redis://127.0.0.1:1/0'
+    monkeypatch.setitem(app.config, 'REDIS_URL', url)
+    monkeypatch.setitem(app.config, 'LEADERBOARD_BACKEND', 'redis')
+    monkeypatch.setitem(app.config, 'LEADERBOARD_REFRESH_SECONDS', 0)
+    with app.app_context():
+        leaderboard._ensure_built()
+        user = User(display_name='BackoffUser', xp_total=77)
+        db.session.add(user)
+        db.session.commit()
+        # the rate limiter just failed on this URL, so no client is handed out
+        redis_client.mark_failed(url, backoff_seconds=60)
+        leaderboard.record_user(user)
+        assert user.id in leaderboard._redis_dirty
+        monkeypatch.setattr(redis_client, 'get_redis', lambda *a, **k: Client())
+        leaderboard.top(1)
+        assert written == {leaderboard._member(user.id): 77} and not leaderboard._redis_dirty
+    redis_client.reset()
+
+
+def test_leaderboard_shared_rebuild_keeps_writes_made_during_the_scan(test_client, monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    from backend import leaderboard, redis_client
+    url = 'redis://fake:6379/0'
+    monkeypatch.setitem(app.config, 'REDIS_URL', url)
+    monkeypatch.setitem(app.config, 'LEADERBOARD_BACKEND', 'redis')
+    monkeypatch.setitem(app.config, 'LEADERBOARD_REDIS_KEY', 'lb-test')
+    monkeypatch.setitem(app.config, 'LEADERBOARD_REFRESH_SECONDS', 0)
+    monkeypatch.setitem(redis_client._clients, url, fakeredis.FakeRedis())
+    with app.app_context():
+        user = User(display_name='ScanRacer', xp_total=10)
+        db.session.add(user)
+        db.session.commit()
+        scan = leaderboard._scan_users
+
+        def racing_scan(session):
+            rows = scan(session)
+            # committed after the scan read it, recorded before the swap
+            user.xp_total = 500
+            leaderboard.record_user(user)
+            return rows
+        monkeypatch.setattr(leaderboard, '_scan_users', racing_scan)
+        leaderboard.rebuild(db.session)
+        monkeypatch.setattr(leaderboard, '_scan_users', scan)
+        _rank, rows = leaderboard.rank(user.id)
+        assert rows[0]['xp'] == 500
+    redis_client.reset()
+
+
+def test_leaderboard_stream_wakes_on_writes_from_another_process(test_client, monkeypatch):
+    import os
+    import socket
+    import subprocess
+    import sys
+    import threading
+    import time
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    from backend import leaderboard, leaderboard_stream, redis_client
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = fakeredis.TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'redis://127.0.0.1:{port}/0'
+    settings = {'REDIS_URL': url, 'LEADERBOARD_BACKEND': 'redis', 'LEADERBOARD_REDIS_KEY': 'lb-xproc',
+                'LEADERBOARD_REFRESH_SECONDS': '0'}
+    for key, value in settings.items():
+        monkeypatch.setitem(app.config, key, value)
+    # how often the listener checks `stop`
+    monkeypatch.setitem(app.config, 'LEADERBOARD_STREAM_POLL_SECONDS', 1)
+
+    stop = threading.Event()
+    listener = threading.Thread(target=leaderboard_stream._run_listener, args=(app, stop), daemon=True)
+    listener.start()
+    try:
+        client = redis_client.get_redis(url)
+        deadline = time.monotonic() + 5
+        while not dict(client.pubsub_numsub('lb-xproc:changes')).get(b'lb-xproc:changes'):
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        leaderboard.changed.clear()
+
+        # a web worker in another process records an XP change
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        writer = (
+            "from backend.app import app, create_app, db\n"
+            "from backend.models import User\n"
+            "from backend import leaderboard\n"
+            "create_app()\n"
+            "with app.app_context():\n"
+            "    db.create_all()\n"
+            "    u = User(display_name='Elsewhere', xp_total=5)\n"
+            "    db.session.add(u)\n"
+            "    db.session.commit()\n"
+            "    leaderboard.record_user(u)\n"
+        )
+        env = dict(os.environ, PYTHONPATH=root, DATABASE_URL='sqlite://', **settings)
+        subprocess.run([sys.executable, '-c', writer], cwd=root, env=env, timeout=60, check=True)
+        assert leaderboard.changed.wait(5)
+    finally:
+        stop.set()
+        listener.join(5)
+        redis_client.reset()
+        server.shutdown()
+        server.server_close()
+
+
+def test_leaderboard_backs_off_redis_after_an_error(test_client, monkeypatch):
+    pytest.importorskip('redis')
+    from backend import leaderboard, redis_client
+    calls = []
+
+    class Broken:
+        def __getattr__(self, name):
+            calls.append(name)
+            raise ConnectionError('redis down')
+
+    url = 'redis://127.0.0.1:1/1'
+    monkeypatch.setitem(app.config, 'REDIS_URL', url)
+    monkeypatch.setitem(app.config, 'LEADERBOARD_BACKEND', 'redis')
+    monkeypatch.setitem(app.config, 'LEADERBOARD_REFRESH_SECONDS', 0)
+    monkeypatch.setitem(redis_client._clients, url, Broken())
+    with app.app_context():
+        leaderboard._ensure_built()
+        redis_client._down_until.clear()
+        calls.clear()
+        leaderboard.top(5)
+        assert calls  # tried Redis once, then backed off
+        calls.clear()
+        leaderboard.top(5)
+        leaderboard.rank(1)
+        assert calls == []
+    redis_client.reset()
+
+
+def test_leaderboard_stream_resume_and_heartbeat(test_client):
+    app = test_client.application
+    app.config['LEADERBOARD_STREAM_HEARTBEAT_SECONDS'] = 0.05
+
+    rv = test_client.get('/api/v1/leaderboard/stream')
+    assert rv.mimetype == 'text/event-stream'
+    frames = iter(rv.response)
+    assert next(frames).startswith(b'retry:')
+    snapshot = next(frames).decode()
+    assert snapshot.startswith('id: ') and 'data: {"rows"' in snapshot
+    event_id = snapshot.split('\n', 1)[0][len('id: '):]
+    rv.close()
+
+    # a client that already has the latest frame only gets heartbeats until something changes
+    rv = test_client.get('/api/v1/leaderboard/stream', headers={'Last-Event-ID': event_id})
+    frames = iter(rv.response)
+    next(frames)
+    assert next(frames) == b': heartbeat\n\n'
+
+    r = test_client.post('/api/v1/users', json={'display_name': 'StreamUser'})
+    uid = r.get_json()['user']['id']
+    test_client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': 9_000_000})
+    for frame in frames:
+        if frame != b': heartbeat\n\n':
+            break
+    assert f'"user_id": {uid}'.encode() in frame
+    rv.close()
+
+
+def _count_queries(client, method, url, **kwargs):
+    from sqlalchemy import event
+    statements = []
+
+    def before(conn, cursor, statement, params, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before)
+    try:
+        rv = getattr(client, method)(url, **kwargs)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before)
+    return rv, statements
+
+
+def test_profile_endpoints_query_count_is_bounded(test_client):
+    from backend.models import Badge, UserBadge
+    rv = test_client.post('/api/v1/auth/signup', json={'username': 'manybadges', 'password': 'pw'})
+    token = rv.get_json()['token']
+    uid = rv.get_json()['user']['id']
+    with app.app_context():
+        badges = [Badge(code=f'qc_{i}', name=f'QC {i}') for i in range(8)]
+        db.session.add_all(badges)
+        db.session.flush()
+        db.session.add_all([UserBadge(user_id=uid, badge_id=b.id) for b in badges])
+        db.session.commit()
+
+    rv, stmts = _count_queries(test_client, 'get', f'/api/v1/users/{uid}/stats')
+    assert rv.status_code == 200 and len(rv.get_json()['badges']) == 8
+    assert len(stmts) <= 3
+
+    rv, stmts = _count_queries(test_client, 'get', f'/api/v1/users/{uid}/badges')
+    assert rv.status_code == 200 and len(rv.get_json()['badges']) == 8
+    assert len(stmts) <= 2
+
+    rv, stmts = _count_queries(test_client, 'get', '/api/v1/me/progress', headers={'Authorization': f'Bearer {token}'})
+    assert rv.status_code == 200 and len(rv.get_json()['badges']) == 8
+    assert len(stmts) <= 3
+
+
+def test_badge_etag_and_profile_cache_invalidation(test_client):
+    rv = test_client.get('/api/v1/badges')
+    etag = rv.headers.get('ETag')
+    assert rv.status_code == 200 and etag
+    rv = test_client.get('/api/v1/badges', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+
+    rv = test_client.post('/api/v1/users', json={'display_name': 'CacheUser'})
+    uid = rv.get_json()['user']['id']
+    assert test_client.get(f'/api/v1/users/{uid}/stats').get_json()['user']['xp_total'] == 0
+    # second read is served from cache without touching the DB
+    rv, stmts = _count_queries(test_client, 'get', f'/api/v1/users/{uid}/stats')
+    assert rv.status_code == 200 and stmts == []
+
+    # awarding XP invalidates the cached payload
+    test_client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': 25})
+    assert test_client.get(f'/api/v1/users/{uid}/stats').get_json()['user']['xp_total'] == 25
+
+    counters = test_client.get('/api/v1/cache/stats').get_json()['cache']['namespaces']
+    assert counters['user_stats']['hits'] >= 1
+    assert counters['user_stats']['invalidations'] >= 1
+    assert counters['badges']['hits'] >= 1
+
+
+def test_profile_cache_drops_loads_that_raced_an_invalidation(test_client):
+    from backend import cache, profiles
+    with app.app_context():
+        def racing_load():
+            # the writer commits and invalidates while this (now stale) payload is built
+            profiles.invalidate_user(424242)
+            return 'stale'
+        assert cache.get_or_load('user_stats', 424242, racing_load, 30) == 'stale'
+        assert cache.get('user_stats', 424242) is None
+        assert cache.get_or_load('user_stats', 424242, lambda: 'fresh', 30) == 'fresh'
+        assert cache.get('user_stats', 424242) == 'fresh'
+        assert cache.stats()['namespaces']['user_stats']['stale_loads'] >= 1
+
+
+def test_xp_events_keyset_pagination_and_stream(test_client):
+    from datetime import datetime, timedelta
+    from backend.models import XPEvent
+    rv = test_client.post('/api/v1/users', json={'display_name': 'HistoryUser'})
+    uid = rv.get_json()['user']['id']
+    base = datetime(2025, 1, 1)
+    with app.app_context():
+        db.session.add_all([
+            XPEvent(user_id=uid, amount=i + 1, source='lab' if i % 2 else 'quiz', source_id=f'h-{i}',
+                    created_at=base + timedelta(hours=i // 2))  # pairs share a timestamp
+            for i in range(7)
+        ])
+        db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        url = f'/api/v1/users/{uid}/xp-events?limit=3' + (f'&cursor={cursor}' if cursor else '')
+        data = test_client.get(url).get_json()
+        seen.extend(e['amount'] for e in data['events'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    assert seen == [7, 6, 5, 4, 3, 2, 1]
+
+    data = test_client.get(f'/api/v1/users/{uid}/xp-events?source=lab&since=2025-01-01T01:00:00Z').get_json()
+    assert [e['amount'] for e in data['events']] == [6, 4]
+
+    test_client.application.config['XP_EVENTS_STREAM_CHUNK'] = 2
+    rv = test_client.get(f'/api/v1/users/{uid}/xp-events?format=ndjson')
+    assert rv.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in rv.get_data(as_text=True).splitlines()]
+    assert [e['amount'] for e in lines] == [7, 6, 5, 4, 3, 2, 1]
+
+    assert test_client.get(f'/api/v1/users/{uid}/xp-events?since=yesterday').status_code == 400
+
+
+def test_xp_rollups_period_leaderboard_and_summary(test_client):
+    from sqlalchemy import select
+    from backend.models import XPRollup
+    from backend import rollups
+    uids = []
+    for name in ('WeekA', 'WeekB'):
+        rv = test_client.post('/api/v1/users', json={'display_name': name})
+        uids.append(rv.get_json()['user']['id'])
+    ua, ub = uids
+    assert test_client.post('/api/v1/xp/award', json={'user_id': ua, 'xp': 20_000_000, 'source': 'lab', 'source_id': 'w1'}).status_code == 200
+    assert test_client.post('/api/v1/xp/award', json={'user_id': ua, 'xp': 5, 'source': 'quiz', 'source_id': 'w2'}).status_code == 200
+    rv = test_client.post('/api/v1/xp/award/batch', json={'awards': [
+        {'user_id': ub, 'xp': 10_000_000, 'source': 'lab', 'source_id': 'w3'},
+        {'user_id': ub, 'xp': 7},
+    ]})
+    assert rv.get_json()['awarded'] == 2
+
+    data = test_client.get('/api/v1/leaderboard?period=week&limit=1').get_json()
+    assert data['period'] == 'week' and data['rows'][0]['user_id'] == ua
+    assert data['rows'][0]['xp'] == 20_000_005
+    data = test_client.get(f"/api/v1/leaderboard?period=week&limit=1&cursor={data['next_cursor']}").get_json()
+    assert data['rows'][0]['user_id'] == ub and data['rows'][0]['rank'] == 2
+    assert test_client.get('/api/v1/leaderboard?period=year').status_code == 400
+
+    data = test_client.get(f'/api/v1/users/{ua}/xp-summary?period=month&buckets=2').get_json()
+    current, previous = data['buckets']
+    assert current['xp'] == 20_000_005 and current['events'] == 2
+    assert current['by_source'] == [{'source': 'lab', 'xp': 20_000_000}, {'source': 'quiz', 'xp': 5}]
+    assert previous['xp'] == 0
+    assert test_client.get('/api/v1/users/999999/xp-summary').status_code == 404
+
+    # a backfill from history reproduces the incrementally maintained rows exactly
+    def snapshot():
+        stmt = select(XPRollup.user_id, XPRollup.period, XPRollup.bucket_start, XPRollup.source,
+                      XPRollup.amount, XPRollup.event_count).where(XPRollup.user_id.in_(uids))
+        return sorted(tuple(r) for r in db.session.execute(stmt))
+
+    with app.app_context():
+        before = snapshot()
+        rollups.backfill(db.session, user_ids=uids, chunk_size=1, progress=None)
+        db.session.commit()
+        assert snapshot() == before
+
+
+def test_async_xp_ingestion_write_behind(test_client):
+    from backend import ingest
+    from backend.models import XPEvent
+    cfg = test_client.application.config
+    cfg.update({'XP_INGEST_MODE': 'async', 'XP_INGEST_CONSUMER': 'external', 'XP_RATE_LIMIT': '1000:60'})
+    try:
+        rv = test_client.post('/api/v1/users', json={'display_name': 'HotUser'})
+        uid = rv.get_json()['user']['id']
+        for i in range(5):
+            rv = test_client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': 100, 'source': 'contest', 'source_id': f'c-{i}'})
+            assert rv.status_code == 202
+        data = rv.get_json()
+        assert data['queued'] is True and data['new_xp'] == 500  # read-your-writes projection
+
+        # duplicates are still caught while the event is pending
+        rv = test_client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': 100, 'source': 'contest', 'source_id': 'c-0'})
+        assert rv.status_code == 200 and rv.get_json()['duplicate'] is True
+
+        cfg['XP_INGEST_READ_YOUR_WRITES'] = False
+        rv = test_client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': 50})
+        assert rv.status_code == 202 and 'new_xp' not in rv.get_json()
+
+        # totals are untouched until the consumer folds the batch in
+        assert test_client.get(f'/api/v1/users/{uid}/stats').get_json()['user']['xp_total'] == 0
+        with app.app_context():
+            assert ingest.apply_pending(db.session, limit=4) == 4
+            assert ingest.drain(db.session) == 2
+            assert db.session.query(XPEvent).filter_by(user_id=uid, pending=True).count() == 0
+        assert test_client.get(f'/api/v1/users/{uid}/stats').get_json()['user']['xp_total'] == 550
+        rows = test_client.get(f'/api/v1/leaderboard/users/{uid}').get_json()['rows']
+        assert rows[0]['xp'] == 550
+        summary = test_client.get(f'/api/v1/users/{uid}/xp-summary?period=day').get_json()['buckets'][0]
+        assert summary['xp'] == 550 and summary['events'] == 6
+    finally:
+        cfg.update({'XP_INGEST_MODE': 'sync', 'XP_INGEST_READ_YOUR_WRITES': True})
@@ -0,0 +1,181 @@
+import jwt
+import pytest
+from datetime import datetime, timedelta, timezone
+
+from backend import auth
+
+
+@pytest.fixture
+def fresh_keys():
+    yield
+    auth.load_keys({})
+    auth.clear_cache()
+
+
+def test_token_cache_honours_exp_and_key_rotation(test_client, fresh_keys, monkeypatch):
+    legacy = auth.create_token(7)
+    before = auth.stats()
+    assert auth.decode_token(legacy) == 7 and auth.decode_token(legacy) == 7
+    after = auth.stats()
+    assert after['verifications'] - before['verifications'] == 1
+    assert after['cache_hits'] - before['cache_hits'] == 1
+
+    # rotate: new tokens carry the new kid, old ones keep verifying while their key is loaded
+    auth.load_keys({'k1': 'first-secret-key-of-at-least-32-bytes', 'k2': 'second-secret-key-of-at-least-32-bytes'},
+                   active_kid='k2', accept_legacy=True)
+    token = auth.create_token(8)
+    assert jwt.get_unverified_header(token)['kid'] == 'k2'
+    assert auth.decode_token(token) == 8 and auth.decode_token(legacy) == 7
+    auth.load_keys({'k1': 'first-secret-key-of-at-least-32-bytes'}, active_kid='k1')
+    assert auth.decode_token(token) is None  # cached, but its key is gone
+    assert auth.decode_token(legacy) is None  # SECRET_KEY is retired unless accepted explicitly
+    assert auth.stats()['failures']['unknown_kid'] >= 2
+
+    # a kid whose secret was replaced does not serve tokens cached under the old secret
+    k1_token = auth.create_token(10)
+    assert auth.decode_token(k1_token) == 10
+    auth.load_keys({'k1': 'replacement-secret-key-of-at-least-32-bytes'}, active_kid='k1')
+    assert auth.decode_token(k1_token) is None
+    auth.load_keys({'k1': 'first-secret-key-of-at-least-32-bytes'}, active_kid='k1')
+
+    # a cached token is only served from the cache until its exp
+    short = jwt.encode({'sub': '9', 'exp': datetime.now(timezone.utc) + timedelta(seconds=30)}, 'first-secret-key-of-at-least-32-bytes',
+                       algorithm='HS256', headers={'kid': 'k1'})
+    assert auth.decode_token(short) == 9
+    verified = auth.stats()['verifications']
+    now = auth.time.time()
+    monkeypatch.setattr(auth.time, 'time', lambda: now + 60)
+    auth.decode_token(short)
+    assert auth.stats()['verifications'] == verified + 1
+
+    with pytest.raises(ValueError):
+        auth.load_keys({'k1': 'first-secret-key-of-at-least-32-bytes'}, active_kid='missing')
+
+    # without an active kid (and SECRET_KEY retired) the only key signs; two keys are ambiguous
+    auth.load_keys({'k1': 'first-secret-key-of-at-least-32-bytes'}, accept_legacy=False)
+    assert jwt.get_unverified_header(auth.create_token(12))['kid'] == 'k1'
+    with pytest.raises(ValueError):
+        auth.load_keys({'k1': 'first-secret-key-of-at-least-32-bytes', 'k2': 'second-secret-key-of-at-least-32-bytes'},
+                       accept_legacy=False)
+
+
+def test_auth_is_memoized_per_request(test_client):
+    from backend.app import app
+    token = auth.create_token(11)
+    with app.test_request_context(headers={'Authorization': f'Bearer {token}'}):
+        before = auth.stats()
+        assert auth.get_auth_user_id() == 11 and auth.get_auth_user_id() == 11
+        after = auth.stats()
+        assert after['cache_hits'] + after['cache_misses'] - before['cache_hits'] - before['cache_misses'] == 1
+
+
+def test_login_rehashes_and_sheds_load(test_client):
+    from backend import passwords
+    from backend.app import app, db
+    from backend.models import User
+    cfg = test_client.application.config
+    cfg['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    rv = test_client.post('/api/v1/auth/signup', json={'username': 'rehashuser', 'password': 'pw'})
+    assert rv.status_code == 201
+    uid = rv.get_json()['user']['id']
+    with app.app_context():
+        assert db.session.get(User, uid).password_hash.startswith('pbkdf2:sha256:1000$')
+
+    cfg['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+    assert test_client.post('/api/v1/auth/login', json={'username': 'rehashuser', 'password': 'nope'}).status_code == 401
+    assert test_client.post('/api/v1/auth/login', json={'username': 'rehashuser', 'password': 'pw'}).status_code == 200
+    with app.app_context():
+        assert db.session.get(User, uid).password_hash.startswith('pbkdf2:sha256:2000$')
+    assert test_client.post('/api/v1/auth/login', json={'username': 'rehashuser', 'password': 'pw'}).status_code == 200
+
+    passwords.reset()
+    cfg['PASSWORD_HASH_QUEUE_LIMIT'] = 0
+    try:
+        rv = test_client.post('/api/v1/auth/login', json={'username': 'rehashuser', 'password': 'pw'})
+        assert rv.status_code == 503 and rv.headers['Retry-After'] == '1'
+    finally:
+        cfg.pop('PASSWORD_HASH_QUEUE_LIMIT')
+        cfg.pop('PASSWORD_HASH_METHOD')
+        passwords.reset()
+
+
+def test_login_survives_busy_rehash_and_times_out_as_busy(test_client, monkeypatch):
+    from backend import passwords
+    from backend.app import app, db
+    from backend.models import User
+    cfg = test_client.application.config
+    monkeypatch.setitem(cfg, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    uid = test_client.post('/api/v1/auth/signup', json={'username': 'busyrehash', 'password': 'pw'}).get_json()['user']['id']
+
+    # the password checks out but there is no capacity to upgrade it: log in anyway
+    monkeypatch.setitem(cfg, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:2000')
+
+    def busy(_password):
+        raise passwords.HashBusy('full')
+    monkeypatch.setattr(passwords, 'hash_password', busy)
+    skipped = passwords.stats()['rehashes_skipped']
+    assert test_client.post('/api/v1/auth/login', json={'username': 'busyrehash', 'password': 'pw'}).status_code == 200
+    assert passwords.stats()['rehashes_skipped'] == skipped + 1
+    with app.app_context():
+        assert db.session.get(User, uid).password_hash.startswith('pbkdf2:sha256:1000$')
+
+    # a hash that outlives PASSWORD_HASH_TIMEOUT is shed like a full queue; its slot is
+    # held until the worker process is done with it
+    passwords.reset()
+    monkeypatch.setitem(cfg, 'PASSWORD_HASH_TIMEOUT', 0.001)
+    monkeypatch.setitem(cfg, 'PASSWORD_HASH_WORKERS', 1)
+    try:
+        rv = test_client.post('/api/v1/auth/login', json={'username': 'busyrehash', 'password': 'pw'})
+        assert rv.status_code == 503 and passwords.stats()['timeouts'] == 1
+        assert passwords.stats()['in_flight'] == 1
+    finally:
+        passwords.reset()
+
+
+def test_github_callback_uses_pooled_client_and_upsert(test_client, monkeypatch):
+    import json
+    import threading
+    import time
+    from werkzeug.serving import make_server
+    from werkzeug.wrappers import Request, Response
+    from backend import http_client
+
+    hits = {'token': 0, 'user': 0}
+
+    @Request.application
+    def github(req):
+        if req.path == '/login/oauth/access_token':
+            hits['token'] += 1
+            if req.form.get('code') == 'slow':
+                time.sleep(1)
+            return Response(json.dumps({'access_token': f"stub-{req.form.get('code')}"}),
+                            content_type='application/json')
+        hits['user'] += 1
+        assert req.headers['Authorization'].startswith('token stub-')
+        return Response(json.dumps({'id': 424242, 'login': 'octo', 'name': 'Octo Cat', 'email': None}),
+                        content_type='application/json')
+
+    server = make_server('127.0.0.1', 0, github, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    cfg = test_client.application.config
+    cfg.update(GITHUB_OAUTH_URL=base, GITHUB_API_URL=base, HTTP_READ_TIMEOUT=0.3)
+    monkeypatch.setenv('GITHUB_CLIENT_ID', 'id')
+    monkeypatch.setenv('GITHUB_CLIENT_SECRET', 'secret')
+    http_client.reset()
+    try:
+        first = test_client.get('/api/v1/auth/github/callback?code=a').get_json()
+        second = test_client.get('/api/v1/auth/github/callback?code=b').get_json()
+        assert first['ok'] and first['user']['display_name'] == 'Octo Cat'
+        assert second['user']['id'] == first['user']['id']
+        assert hits == {'token': 2, 'user': 2}
+
+        started = time.monotonic()
+        rv = test_client.get('/api/v1/auth/github/callback?code=slow')
+        assert rv.status_code == 502 and time.monotonic() - started < 1
+        assert hits['token'] == 3  # POSTs are not retried after a read timeout
+    finally:
+        for key in ('GITHUB_OAUTH_URL', 'GITHUB_API_URL', 'HTTP_READ_TIMEOUT'):
+            cfg.pop(key)
+        http_client.reset()
+        server.shutdown()
@@ -0,0 +1,64 @@
+from backend.app import app, db
+from backend import badge_rules
+from backend.models import Badge, JobRecord, User, UserBadge, XPEvent
+from backend.routes.badges import invalidate_badge_catalog
+
+
+def _badges_of(uid):
+    with app.app_context():
+        rows = db.session.query(Badge.code).join(UserBadge, UserBadge.badge_id == Badge.id).filter(UserBadge.user_id == uid)
+        return sorted(code for (code,) in rows)
+
+
+def test_rules_award_incrementally_and_idempotently(test_client):
+    with app.app_context():
+        db.session.add_all([
+            Badge(code='rule-xp-1m', name='Million', rule={'type': 'xp_total', 'min': 1_000_000}),
+            Badge(code='rule-lab-2', name='Lab Rat', rule={'type': 'source_events', 'source': 'rule-lab', 'min': 2}),
+            Badge(code='rule-streak-1', name='Day One', rule={'type': 'streak', 'min': 1}),
+            Badge(code='rule-first-job', name='Shipped', rule={'type': 'jobs_finished', 'min': 1}),
+        ])
+        db.session.commit()
+    invalidate_badge_catalog()
+    test_client.application.config['XP_RATE_LIMIT'] = '1000:60'
+
+    rv = test_client.post('/api/v1/auth/signup', json={'username': 'ruleuser', 'password': 'pw', 'display_name': 'Rules'})
+    uid = rv.get_json()['user']['id']
+    headers = {'Authorization': f"Bearer {rv.get_json()['token']}"}
+
+    rv = test_client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': 10, 'source': 'rule-lab', 'source_id': '1'})
+    assert rv.get_json()['new_badges'] == []
+    rv = test_client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': 1_000_000, 'source': 'rule-lab', 'source_id': '2'})
+    assert sorted(rv.get_json()['new_badges']) == ['rule-lab-2', 'rule-xp-1m']
+    # already held: nothing new, and no duplicate rows
+    rv = test_client.post('/api/v1/xp/award', json={'user_id': uid, 'xp': 5, 'source': 'rule-lab', 'source_id': '3'})
+    assert rv.get_json()['new_badges'] == []
+
+    rv = test_client.post('/api/v1/me/checkin', headers=headers)
+    assert rv.get_json()['new_badges'] == ['rule-streak-1']
+
+    with app.app_context():
+        from backend.scripts.worker import run_job
+        job = JobRecord(user_id=uid, payload={})
+        db.session.add(job)
+        db.session.commit()
+        run_job(job.id)
+    assert _badges_of(uid) == ['rule-first-job', 'rule-lab-2', 'rule-streak-1', 'rule-xp-1m']
+
+
+def test_rules_backfill_in_bulk(test_client):
+    with app.app_context():
+        veteran = User(display_name='Veteran', xp_total=2_000_000, level=10)
+        db.session.add(veteran)
+        db.session.flush()
+        db.session.add_all([XPEvent(user_id=veteran.id, amount=1, source='rule-lab', source_id=f'old-{i}') for i in range(2)])
+        db.session.commit()
+        uid = veteran.id
+
+        preview = badge_rules.backfill(db.session, dry_run=True, progress=None)
+        assert preview['rule-xp-1m'] >= 1 and preview['rule-lab-2'] >= 1
+        badge_rules.backfill(db.session, progress=None)
+        db.session.commit()
+        # a second pass has nothing left to award
+        assert not any(badge_rules.backfill(db.session, dry_run=True, progress=None).values())
+    assert _badges_of(uid) == ['rule-lab-2', 'rule-xp-1m']
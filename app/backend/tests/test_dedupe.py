@@ -0,0 +1,84 @@
+import json
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from backend.app import app, db
+from backend.models import User, XPEvent
+from backend.schemas import compute_new_level
+from backend.scripts.dedupe_xp_events import apply_actions, clear_checkpoint, dry_run, reconcile_users, write_report
+
+
+def test_reconcile_users_is_set_based_and_only_writes_changes(test_client):
+    with app.app_context():
+        drifted = User(display_name='Drifted', xp_total=5, level=1)
+        level_only = User(display_name='LevelOnly', xp_total=300, level=1)
+        db.session.add_all([drifted, level_only])
+        db.session.flush()
+        db.session.add_all([
+            XPEvent(user_id=drifted.id, amount=200, source='r', source_id='1'),
+            XPEvent(user_id=drifted.id, amount=150, source='r', source_id='2'),
+            XPEvent(user_id=level_only.id, amount=300, source='r', source_id='3'),
+        ])
+        db.session.commit()
+        ids = (drifted.id, level_only.id)
+
+        # --only-drifted looks at xp_total only, so the level-only user is left alone
+        reconcile_users(db.session, only_drifted=True, chunk_size=2, progress=None)
+        db.session.commit()
+        d, lo = db.session.get(User, ids[0]), db.session.get(User, ids[1])
+        assert (d.xp_total, d.level) == (350, compute_new_level(350))
+        assert lo.level == 1
+
+        # a full pass also repairs stale levels, and a second pass has nothing to do
+        reconcile_users(db.session, chunk_size=2, progress=None)
+        db.session.commit()
+        assert db.session.get(User, ids[1]).level == compute_new_level(300)
+        assert reconcile_users(db.session, chunk_size=2, progress=None) == 0
+
+
+def test_dedupe_single_pass_chunked_and_resumable(tmp_path):
+    # the ORM tables carry the unique constraints, so build a legacy table that lacks them
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE xp_events (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, amount INTEGER NOT NULL,'
+            ' source VARCHAR(50), source_id VARCHAR(200), meta JSON, idempotency_key VARCHAR(200),'
+            ' created_at DATETIME)'
+        ))
+        conn.execute(text('INSERT INTO xp_events VALUES (:id, :u, :a, :s, :sid, NULL, :k, :t)'), [
+            {'id': 1, 'u': 1, 'a': 10, 's': 'q', 'sid': '1', 'k': None, 't': '2024-01-01'},
+            {'id': 2, 'u': 1, 'a': 10, 's': 'q', 'sid': '1', 'k': None, 't': '2024-01-02'},
+            {'id': 3, 'u': 1, 'a': 10, 's': 'q', 'sid': '1', 'k': None, 't': '2024-01-03'},
+            {'id': 4, 'u': 2, 'a': 5, 's': None, 'sid': None, 'k': 'k1', 't': '2024-01-01'},
+            {'id': 5, 'u': 2, 'a': 5, 's': None, 'sid': None, 'k': 'k1', 't': '2024-01-01'},
+            {'id': 6, 'u': 2, 'a': 7, 's': None, 'sid': None, 'k': None, 't': '2024-01-01'},
+            {'id': 7, 'u': 2, 'a': 7, 's': None, 'sid': None, 'k': None, 't': '2024-01-01'},
+        ])
+
+    checkpoint = str(tmp_path / 'dedupe.ckpt')
+    with Session(engine) as session:
+        rows = dry_run(session)
+        assert [r.id for r in rows] == [2, 3, 5]
+        # an interrupted run: only the first chunk got deleted
+        apply_actions(session, rows[:1], chunk_size=1, checkpoint=checkpoint, progress=None)
+        # the resumed run re-queries and picks up where it left off
+        rows = dry_run(session)
+        assert [r.id for r in rows] == [3, 5]
+        removed = apply_actions(session, rows, chunk_size=1, checkpoint=checkpoint, progress=None)
+        assert sorted(r[0] for r in removed) == [2, 3, 5]
+        # one appended line per removed row, not a rewrite of the whole list per chunk
+        with open(checkpoint) as f:
+            assert [json.loads(line)[0] for line in f] == [2, 3, 5]
+        assert dry_run(session) == []
+        remaining = session.execute(text('SELECT id FROM xp_events ORDER BY id')).scalars().all()
+        assert remaining == [1, 4, 6, 7]
+
+    report = tmp_path / 'report.json'
+    write_report(str(report), removed)
+    data = json.loads(report.read_text())
+    assert data['removed_ids'] == [2, 3, 5]
+    assert data['xp_delta_by_user'] == {'1': -20, '2': -5}
+    clear_checkpoint(checkpoint)
+    with Session(engine) as session:
+        assert apply_actions(session, [], checkpoint=checkpoint, progress=None) == []
@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFERRED = ('rq', 'redis', 'requests', 'alembic')
+
+
+def _importtime(statement):
+    """Run `statement` under `python -X importtime`; returns [(depth, name, cumulative_us)]."""
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=PROJECT_ROOT, env=env,
+                          capture_output=True, text=True, timeout=120, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, name.strip(), int(cumulative)))
+    return rows
+
+
+def test_app_start_up_defers_heavy_imports():
+    rows = _importtime("from backend.app import create_app; create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})")
+    loaded = {name for _, name, _ in rows}
+    assert 'backend.routes.jobs' in loaded
+    assert not [name for name in loaded if name.split('.')[0] in DEFERRED]
+
+    # only what the statement imported, not interpreter start-up (site, .pth hooks)
+    first = next(i for i, (_, name, _) in enumerate(rows) if name.startswith('backend'))
+    total_ms = sum(us for depth, _, us in rows[first:] if depth == 0) / 1000
+    budget_ms = float(os.getenv('IMPORT_TIME_BUDGET_MS', '2000'))
+    assert total_ms < budget_ms, f'app start-up imports took {total_ms:.0f}ms (budget {budget_ms:.0f}ms)'
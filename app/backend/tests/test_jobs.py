@@ -36,3 +36,118 @@ def test_list_and_cancel_jobs(test_client):
     rg2 = test_client.get(f'/api/v1/jobs/{job_id}', headers=headers)
     assert rg2.status_code == 200
     assert rg2.get_json()['job']['status'] == 'cancelled'
+
+
+def test_list_jobs_cursor_pagination(test_client):
+    from backend.auth import create_token
+    from backend.models import JobRecord, User
+    with app.app_context():
+        u = User(display_name='PagedJobs')
+        db.session.add(u)
+        db.session.commit()
+        uid = u.id
+        db.session.add_all([JobRecord(user_id=uid, status='finished') for _ in range(5)])
+        db.session.commit()
+    headers = {'Authorization': f'Bearer {create_token(uid)}'}
+
+    ids, cursor = [], None
+    while True:
+        url = '/api/v1/jobs?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        data = test_client.get(url, headers=headers).get_json()
+        ids.extend(j['id'] for j in data['jobs'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    assert len(ids) == 5 and len(set(ids)) == 5
+    assert test_client.get('/api/v1/jobs?cursor=bogus', headers=headers).status_code == 400
+
+
+def test_job_output_chunks_truncation_and_stream(test_client):
+    import sys
+    from backend import job_output
+    from backend.auth import create_token
+    from backend.models import JobRecord, User
+    from backend.scripts.worker import run_job
+    with app.app_context():
+        u = User(display_name='OutputJobs')
+        db.session.add(u)
+        db.session.commit()
+        cmd = f'{sys.executable} -c "print(\'é\' * 30)"'
+        job = JobRecord(user_id=u.id, status='queued', payload={'command': cmd})
+        db.session.add(job)
+        db.session.commit()
+        uid, job_id = u.id, job.id
+
+        # chunks never split a UTF-8 character and stop at the cap with a marker
+        writer = job_output.OutputWriter(db.session, job_id, chunk_bytes=7, max_bytes=20, preview_bytes=8)
+        writer.write_bytes('é'.encode('utf-8')[:1])
+        writer.write_bytes('é'.encode('utf-8')[1:] + b'abcdefghijklmnopqrstuvwxyz')
+        preview = writer.close()
+        db.session.commit()
+        rows = job_output.read_chunks(db.session, job_id)
+        assert [len(d.encode('utf-8')) for _s, d in rows[:-1]] == [7, 7, 6]
+        assert ''.join(d for _s, d in rows).startswith('éabcdefghijklmnopq')
+        assert 'truncated at 20 bytes' in rows[-1][1]
+        assert preview.startswith('stuvwxyz') and '28 bytes produced' in preview
+        db.session.query(job_output.JobOutputChunk).filter_by(job_id=job_id).delete()
+        db.session.commit()
+
+        run_job(job_id)
+        assert db.session.get(JobRecord, job_id).status == 'finished'
+    headers = {'Authorization': f'Bearer {create_token(uid)}'}
+
+    data = test_client.get(f'/api/v1/jobs/{job_id}/output?after=0', headers=headers).get_json()
+    assert data['done'] is True and data['status'] == 'finished'
+    assert ''.join(c['data'] for c in data['chunks']).strip() == 'é' * 30
+    again = test_client.get(f'/api/v1/jobs/{job_id}/output?after={data["next_after"]}', headers=headers).get_json()
+    assert again['chunks'] == [] and again['next_after'] == data['next_after']
+
+    body = test_client.get(f'/api/v1/jobs/{job_id}/output/stream', headers=headers).get_data(as_text=True)
+    assert 'event: output' in body and body.rstrip().endswith('data: {"status": "finished"}')
+    resumed = test_client.get(f'/api/v1/jobs/{job_id}/output/stream',
+                              headers={**headers, 'Last-Event-ID': str(data['next_after'])}).get_data(as_text=True)
+    assert 'event: output' not in resumed and 'event: end' in resumed
+    assert test_client.get(f'/api/v1/jobs/{job_id}/output').status_code == 403
+
+
+def test_cancel_running_job_and_bulk_cancel(test_client, monkeypatch):
+    import sys
+    import threading
+    import time
+    from backend.auth import create_token
+    from backend.models import JobRecord, User
+    from backend.scripts.worker import run_job
+    monkeypatch.setitem(app.config, 'JOB_CANCEL_POLL_SECONDS', 0.05)
+    with app.app_context():
+        u = User(display_name='CancelJobs')
+        db.session.add(u)
+        db.session.commit()
+        cmd = f'{sys.executable} -c "import time; print(1, flush=True); time.sleep(30)"'
+        running = JobRecord(user_id=u.id, status='queued', payload={'command': cmd})
+        db.session.add(running)
+        db.session.add_all([JobRecord(user_id=u.id, status='queued') for _ in range(3)])
+        db.session.commit()
+        uid, job_id = u.id, running.id
+    headers = {'Authorization': f'Bearer {create_token(uid)}'}
+
+    def work():
+        with app.app_context():
+            run_job(job_id)
+    t = threading.Thread(target=work)
+    t.start()
+    deadline = time.monotonic() + 5
+    while test_client.get(f'/api/v1/jobs/{job_id}', headers=headers).get_json()['job']['status'] != 'running':
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+    started = time.monotonic()
+    rv = test_client.post(f'/api/v1/jobs/{job_id}/cancel', headers=headers)
+    assert rv.get_json()['was_running'] is True
+    t.join(5)
+    assert not t.is_alive() and time.monotonic() - started < 5
+    job = test_client.get(f'/api/v1/jobs/{job_id}', headers=headers).get_json()['job']
+    assert job['status'] == 'cancelled' and job['output'].endswith('[cancelled by user]')
+
+    assert test_client.post('/api/v1/jobs/cancel', json={'status': ['finished']}, headers=headers).status_code == 400
+    rv = test_client.post('/api/v1/jobs/cancel', json={'status': 'queued'}, headers=headers)
+    assert rv.get_json()['cancelled'] == 3
+    assert test_client.post('/api/v1/jobs/cancel', headers=headers).get_json()['cancelled'] == 0
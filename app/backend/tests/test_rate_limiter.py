@@ -0,0 +1,81 @@
+import pytest
+
+from backend import rate_limiter
+
+
+@pytest.fixture
+def memory_limiter(test_client):
+    app = test_client.application
+    app.config['RATE_LIMIT_BACKEND'] = 'memory'
+    rate_limiter.reset()
+    with app.app_context():
+        yield app
+    app.config.pop('RATE_LIMIT_BACKEND', None)
+    app.config.pop('RATE_LIMIT_MAX_KEYS', None)
+    rate_limiter.reset()
+
+
+def test_token_bucket_refills_continuously(memory_limiter, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter, 'monotonic', lambda: now[0])
+
+    assert rate_limiter.check_rate_limit('k', '2:60')[0] is True
+    assert rate_limiter.check_rate_limit('k', '2:60')[0] is True
+    allowed, info = rate_limiter.check_rate_limit('k', '2:60')
+    assert allowed is False
+    assert info['reset_seconds'] == 30
+
+    # one token refills every 30s; no fixed-window reset that lets a second burst through
+    now[0] += 30
+    assert rate_limiter.check_rate_limit('k', '2:60')[0] is True
+    assert rate_limiter.check_rate_limit('k', '2:60')[0] is False
+
+
+def test_memory_store_is_bounded(memory_limiter, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter, 'monotonic', lambda: now[0])
+    memory_limiter.config['RATE_LIMIT_MAX_KEYS'] = 10
+
+    for i in range(50):
+        rate_limiter.check_rate_limit(f'user:{i}', '5:60')
+    assert len(rate_limiter._buckets) == 10
+
+    # buckets that have fully refilled are evicted on the next check
+    now[0] += 61
+    rate_limiter.check_rate_limit('fresh', '5:60')
+    assert list(rate_limiter._buckets) == ['rl:fresh:5:60']
+
+
+def test_policy_with_multiple_limits_is_all_or_nothing(memory_limiter, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter, 'monotonic', lambda: now[0])
+    memory_limiter.config['JOB_RATE_LIMIT'] = '2:60,3:86400'
+    try:
+        assert rate_limiter.check_policy('jobs', 7)[0] is True
+        assert rate_limiter.check_policy('jobs', 7)[0] is True
+        # per-minute bucket empty: denied, and the daily bucket is not charged
+        assert rate_limiter.check_policy('jobs', 7)[0] is False
+        now[0] += 60
+        allowed, info = rate_limiter.check_policy('jobs', 7)
+        assert allowed is True and info['remaining'] == 0
+        # daily limit now exhausted even though the minute bucket has refilled
+        now[0] += 60
+        allowed, info = rate_limiter.check_policy('jobs', 7)
+        assert allowed is False
+        assert info['reset_seconds'] > 60
+    finally:
+        memory_limiter.config.pop('JOB_RATE_LIMIT')
+
+
+def test_jobs_policy_reads_legacy_quota_settings(memory_limiter):
+    previous = memory_limiter.config.get('JOB_QUOTA_PER_MINUTE')
+    memory_limiter.config['JOB_QUOTA_PER_MINUTE'] = 4
+    memory_limiter.config['JOB_QUOTA_PER_DAY'] = 100
+    try:
+        assert rate_limiter.policy_limits('jobs') == [(4, 60), (100, 86400)]
+    finally:
+        memory_limiter.config.pop('JOB_QUOTA_PER_DAY')
+        if previous is None:
+            memory_limiter.config.pop('JOB_QUOTA_PER_MINUTE')
+        else:
+            memory_limiter.config['JOB_QUOTA_PER_MINUTE'] = previous
@@ -0,0 +1,135 @@
+import sys
+import time
+
+from backend.runner_pool import LocalBackend, RunnerPool
+
+
+def _wait_idle(pool, language, n, timeout=10):
+    deadline = time.monotonic() + timeout
+    while pool.stats()['idle'].get(language, 0) < n and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_pool_reuses_warm_sandboxes_and_recycles():
+    pool = RunnerPool(LocalBackend(), size=1, max_jobs=2)
+    try:
+        _wait_idle(pool, 'python', 1)
+        rc, out = pool.run('python', f'{sys.executable} -c "print(6 * 7)"')
+        assert (rc, out.strip()) == (0, '42')
+        pid_cmd = f'{sys.executable} -c "import os; print(os.getppid())"'
+        # the second job reuses the same agent process, then hits max_jobs and is recycled
+        rc, agent_pid = pool.run('python', pid_cmd)
+        _wait_idle(pool, 'python', 1)
+        rc, new_agent_pid = pool.run('python', pid_cmd)
+        assert agent_pid != new_agent_pid
+
+        rc, out = pool.run('python', f'{sys.executable} -c "import time; time.sleep(5)"', timeout=0.2)
+        assert rc == 124 and 'Timeout' in out
+        rc, out = pool.run('python', f'{sys.executable} -c "import sys; sys.exit(3)"')
+        assert rc == 3
+
+        stats = pool.stats()
+        assert stats['jobs'] == 5 and stats['warm_starts'] == 5 and stats['cold_starts'] == 0
+        assert stats['recycled'] >= 2 and stats['backend'] == 'local'
+        assert stats['exec_max'] >= stats['exec_avg'] > 0
+    finally:
+        pool.shutdown()
+
+
+def test_pool_cold_start_and_dead_sandbox_replacement():
+    pool = RunnerPool(LocalBackend(), size=1, max_jobs=100, prewarm=False)
+    try:
+        rc, out = pool.run('python', f'{sys.executable} -c "print(1)"')
+        assert rc == 0 and pool.stats()['cold_starts'] == 1
+        # kill the agent behind the pool's back; the next job fails cleanly and it is replaced
+        box = pool._idle['python'].get()
+        box.proc.kill()
+        box.proc.wait()
+        pool._idle['python'].put(box)
+        rc, out = pool.run('python', f'{sys.executable} -c "print(2)"')
+        assert rc == 1 and 'sandbox' in out
+        _wait_idle(pool, 'python', 1)
+        rc, out = pool.run('python', f'{sys.executable} -c "print(3)"')
+        assert (rc, out.strip()) == (0, '3')
+    finally:
+        pool.shutdown()
+
+
+def test_pool_cleans_up_between_jobs(tmp_path):
+    pool = RunnerPool(LocalBackend(), size=1, max_jobs=100)
+    marker = tmp_path / 'alive'
+    leave_file = tmp_path / 'leave_file.py'
+    leave_file.write_text("import os\nopen('left', 'w').write('x')\nprint(os.getcwd())\n")
+    daemonize = tmp_path / 'daemonize.py'
+    daemonize.write_text(f"import os, time\nif not os.fork():\n    os.setsid()\n    os.close(1)\n    os.close(2)\n    time.sleep(1)\n"
+                         f"    open({str(marker)!r}, 'w')\n")
+    try:
+        _wait_idle(pool, 'python', 1)
+        rc, first = pool.run('python', f'{sys.executable} {leave_file}')
+        rc, second = pool.run('python', f'{sys.executable} -c "import os; print(os.getcwd(), os.listdir())"')
+        cwd, files = second.strip().split(' ', 1)
+        assert cwd != first.strip() and files == '[]'
+        assert pool.stats()['dirty'] == 0
+
+        # the escaped process is killed and the sandbox is not reused
+        rc, out = pool.run('python', f'{sys.executable} {daemonize}')
+        assert rc == 0 and pool.stats()['dirty'] == 1
+        time.sleep(1.5)
+        assert not marker.exists()
+    finally:
+        pool.shutdown()
+
+
+def test_pool_and_container_runner_stream_output_while_the_job_runs(tmp_path, monkeypatch):
+    script = "import time; print('first', flush=True); time.sleep(0.5); print('second')"
+    pool = RunnerPool(LocalBackend(), size=1, max_jobs=100, max_output=8)
+    try:
+        _wait_idle(pool, 'python', 1)
+        got = []
+        rc, out = pool.run('python', f'{sys.executable} -c "{script}"', on_output=lambda c: got.append((time.monotonic(), c)))
+        finished = time.monotonic()
+        assert rc == 0 and got[0][1].startswith('first') and finished - got[0][0] >= 0.3
+        # only max_output bytes are forwarded; the note comes back with the result
+        assert ''.join(c for _, c in got) == 'first\nse' and out == '\n[output truncated]'
+    finally:
+        pool.shutdown()
+
+    from backend.scripts import container_runner
+    docker = tmp_path / 'docker'
+    # a stand-in for the docker CLI that runs the command on the host
+    docker.write_text(f'#!/bin/sh\nshift $(($# - 1))\nexec {sys.executable} -c "$1"\n')
+    docker.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{tmp_path}:{__import__("os").environ["PATH"]}')
+    got = []
+    rc, out = container_runner.run_in_container('img', script, on_output=lambda c: got.append((time.monotonic(), c)))
+    assert rc == 0 and out == '' and got[0][1].startswith(b'first') and time.monotonic() - got[0][0] >= 0.3
+    assert container_runner.run_in_container('img', script) == (0, 'first\nsecond\n')
+
+
+def test_pool_rejects_forged_answers_and_runs_jobs_under_their_own_uid():
+    import os
+
+    import pytest
+
+    # a job writing a fake result to the agent's stdout: without the nonce it is refused
+    forge = r"""/bin/sh -c 'id -u; echo "{\"rc\": 0, \"out\": \"forged\"}" > /proc/$PPID/fd/1; sleep 0.2'"""
+    pool = RunnerPool(LocalBackend(), size=1, max_jobs=100)
+    try:
+        _wait_idle(pool, 'python', 1)
+        rc, out = pool.run('python', forge)
+        assert rc == 1 and 'does not answer this request' in out and pool.stats()['failures'] == 1
+        _wait_idle(pool, 'python', 1)
+        assert pool.run('python', '/bin/echo ok') == (0, 'ok\n')
+    finally:
+        pool.shutdown()
+
+    if os.geteuid() != 0:
+        pytest.skip('dropping to a job uid needs root')
+    pool = RunnerPool(LocalBackend(job_uid=65534), size=1, max_jobs=100)
+    try:
+        _wait_idle(pool, 'python', 1)
+        rc, out = pool.run('python', forge)
+        assert rc == 0 and out.startswith('65534\n') and 'Permission denied' in out
+        assert pool.stats()['failures'] == 0
+    finally:
+        pool.shutdown()
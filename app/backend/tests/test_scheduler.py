@@ -0,0 +1,129 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from backend.app import app, db
+from backend import scheduler
+from backend.models import JobRecord, User
+
+
+def test_claims_are_fair_capped_and_leased(test_client):
+    with app.app_context():
+        # park queued jobs left behind by other test modules
+        JobRecord.query.filter_by(status='queued').update({'status': 'parked'})
+        heavy, light = User(display_name='SchedHeavy'), User(display_name='SchedLight')
+        db.session.add_all([heavy, light])
+        db.session.commit()
+        db.session.add_all([JobRecord(user_id=heavy.id, status='queued') for _ in range(5)])
+        db.session.add(JobRecord(user_id=light.id, status='queued', priority=1))
+        db.session.add(JobRecord(user_id=light.id, status='queued', priority=5))
+        db.session.commit()
+        heavy_id, light_id = heavy.id, light.id
+
+        # two slots: one per user, the light user's higher priority job first
+        ids = scheduler.claim(db.session, 'w1', 2)
+        jobs = [db.session.get(JobRecord, i) for i in ids]
+        assert sorted(j.user_id for j in jobs) == sorted([heavy_id, light_id])
+        assert next(j for j in jobs if j.user_id == light_id).priority == 5
+        assert all(j.status == 'running' and j.lease_owner == 'w1' and j.attempts == 1 for j in jobs)
+
+        # the global cap counts jobs running anywhere
+        assert scheduler.claim(db.session, 'w2', 10, max_concurrency=3) and \
+            scheduler.claim(db.session, 'w2', 10, max_concurrency=3) == []
+        # the capped claim went to the light user (tie on running jobs, higher priority);
+        # with a per-user cap of 2 only the heavy user may start one more
+        capped = scheduler.claim(db.session, 'w2', 10, max_per_user=2)
+        assert [db.session.get(JobRecord, i).user_id for i in capped] == [heavy_id]
+
+        # a crashed worker's leases expire and its jobs return to the queue
+        assert scheduler.renew(db.session, 'w1', ids) == 2
+        JobRecord.query.filter(JobRecord.id.in_(ids)).update(
+            {'lease_expires_at': datetime.now(timezone.utc) - timedelta(seconds=1)})
+        db.session.commit()
+        assert scheduler.requeue_expired(db.session, max_attempts=3) == 2
+        assert {db.session.get(JobRecord, i).status for i in ids} == {'queued'}
+
+    ran = []
+    done = threading.Event()
+
+    def execute(job_id):
+        ran.append(job_id)
+        if len(ran) == 5:
+            done.set()
+
+    s = scheduler.Scheduler(app, threads=8, execute=execute, owner='w3')
+    with app.app_context():
+        assert s.tick() == 5
+        assert done.wait(5)
+        assert sorted(ran) == sorted(j.id for j in JobRecord.query.filter_by(lease_owner='w3'))
+        JobRecord.query.filter_by(status='parked').update({'status': 'queued'})
+        db.session.commit()
+
+
+def test_run_job_skips_jobs_it_does_not_own(test_client):
+    from backend.scripts.worker import run_job
+    with app.app_context():
+        user = User(display_name='SchedOwner')
+        db.session.add(user)
+        db.session.commit()
+        job = JobRecord(user_id=user.id, status='queued')
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+        JobRecord.query.filter_by(status='queued').update({'status': 'parked'})
+        JobRecord.query.filter_by(id=job_id).update({'status': 'queued'})
+        db.session.commit()
+
+        assert scheduler.claim(db.session, 'w1', 1) == [job_id]
+        # an RQ worker must not start a job the scheduler already claimed
+        assert run_job(job_id).startswith('job not runnable')
+        # the lease expired and was re-claimed elsewhere: the old owner does not run it
+        JobRecord.query.filter_by(id=job_id).update({'lease_owner': 'w2'})
+        db.session.commit()
+        assert run_job(job_id, claimed=True, owner='w1').startswith('job not runnable')
+        assert run_job(job_id, claimed=True, owner='w2') == 'no command provided; execution disabled in scaffold'
+        job = db.session.get(JobRecord, job_id)
+        assert job.status == 'finished' and job.finished_at is not None
+        JobRecord.query.filter_by(status='parked').update({'status': 'queued'})
+        db.session.commit()
+
+
+def test_job_scheduler_script_drains_running_jobs_on_sigterm(tmp_path):
+    import os
+    import signal
+    import subprocess
+    import sys
+    import time
+
+    import sqlalchemy as sa
+
+    url = f'sqlite:///{tmp_path / "sched.db"}'
+    engine = sa.create_engine(url)
+    db.metadata.create_all(engine)
+    jobs = db.metadata.tables['jobs']
+    cmd = f'{sys.executable} -c "import time; time.sleep(1.5); print(42)"'
+    with engine.begin() as conn:
+        job_id = conn.execute(jobs.insert().values(status='queued', payload={'command': cmd},
+                                                   created_at=datetime.now(timezone.utc))).inserted_primary_key[0]
+
+    def status():
+        with engine.connect() as conn:
+            return conn.execute(sa.select(jobs.c.status, jobs.c.output).where(jobs.c.id == job_id)).one()
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root, DATABASE_URL=url)
+    env.pop('REDIS_URL', None)
+    proc = subprocess.Popen([sys.executable, os.path.join(root, 'backend', 'scripts', 'job_scheduler.py'),
+                             '--threads', '1'], env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        deadline = time.time() + 20
+        while status()[0] != 'running':
+            assert proc.poll() is None and time.time() < deadline
+            time.sleep(0.05)
+        proc.send_signal(signal.SIGTERM)
+        out, _ = proc.communicate(timeout=20)
+    finally:
+        proc.kill()
+    assert proc.returncode == 0, out
+    assert 'SIGTERM: stopping' in out
+    state, output = status()
+    assert state == 'finished' and '42' in output
@@ -0,0 +1,78 @@
+from backend import serve
+
+
+def test_worker_sizing_and_roles(monkeypatch):
+    for name in ('SERVE_WORKERS', 'SERVE_MAX_WORKERS', 'SERVE_THREADS', 'SERVE_STREAM_WORKERS', 'PORT', 'SERVE_BIND'):
+        monkeypatch.delenv(name, raising=False)
+    web = serve.options('web', cpus=2)
+    assert web['worker_class'] == 'gthread' and web['workers'] == 5 and web['threads'] == 4
+    assert web['preload_app'] is True and web['bind'] == '0.0.0.0:5000'
+    assert serve.options('web', cpus=32)['workers'] == 12  # SERVE_MAX_WORKERS
+
+    stream = serve.options('stream', cpus=2)
+    assert stream['worker_class'] == 'gevent' and stream['workers'] == 2 and stream['bind'] == '0.0.0.0:5001'
+
+    monkeypatch.setenv('SERVE_WORKERS', '3')
+    assert serve.options('web', cpus=2)['workers'] == 3
+
+
+def test_password_pool_takes_a_cpu_share_per_server_worker(monkeypatch):
+    from backend import passwords
+    monkeypatch.setattr(passwords.os, 'cpu_count', lambda: 8)
+    monkeypatch.setenv('SERVE_WORKER_PROCESSES', str(serve.options('web', cpus=8)['workers']))
+    assert passwords.default_workers() == 1
+    monkeypatch.setenv('SERVE_WORKER_PROCESSES', '2')
+    assert passwords.default_workers() == 4
+
+
+def test_stream_role_patches_psycopg_for_postgres(monkeypatch):
+    import sys
+    import types
+    import pytest
+    patched = []
+    green = types.ModuleType('psycogreen.gevent')
+    green.patch_psycopg = lambda: patched.append(True)
+    monkeypatch.setitem(sys.modules, 'psycogreen', types.ModuleType('psycogreen'))
+    monkeypatch.setitem(sys.modules, 'psycogreen.gevent', green)
+
+    monkeypatch.setenv('DATABASE_URL', 'sqlite:///x.db')
+    serve._patch_psycopg()
+    assert patched == []
+    monkeypatch.setenv('DATABASE_URL', 'postgresql://db/app')
+    serve._patch_psycopg()
+    assert patched == [True]
+
+    monkeypatch.setitem(sys.modules, 'psycogreen.gevent', None)  # not installed
+    with pytest.raises(SystemExit):
+        serve._patch_psycopg()
+
+
+def test_web_role_reads_redis_url_from_the_environment():
+    import os
+    import subprocess
+    import sys
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # nothing listens on port 1: the leaderboard warm-up fails fast and is logged
+    env = dict(os.environ, PYTHONPATH=root, DATABASE_URL='sqlite://', REDIS_URL='redis://127.0.0.1:1/3')
+    proc = subprocess.run([sys.executable, '-c', "from backend import serve; print(serve.load_app().config['REDIS_URL'])"],
+                          cwd=root, env=env, capture_output=True, text=True, timeout=60, check=True)
+    assert proc.stdout.strip().splitlines()[-1] == 'redis://127.0.0.1:1/3'
+
+
+def test_create_app_reads_env_settings_without_overriding_config(test_client, monkeypatch):
+    from backend.app import app, create_app
+    monkeypatch.setenv('LEADERBOARD_REFRESH_SECONDS', '7.5')
+    monkeypatch.setenv('XP_INGEST_READ_YOUR_WRITES', '0')
+    monkeypatch.setenv('RUNNER_IMAGES', '{"python": "py:slim"}')
+    monkeypatch.setenv('XP_INGEST_MODE', 'async')
+    for name in ('LEADERBOARD_REFRESH_SECONDS', 'XP_INGEST_READ_YOUR_WRITES', 'RUNNER_IMAGES', 'XP_INGEST_MODE'):
+        monkeypatch.delitem(app.config, name, raising=False)
+    create_app({'XP_INGEST_MODE': 'sync'})
+    try:
+        assert app.config['LEADERBOARD_REFRESH_SECONDS'] == 7.5
+        assert app.config['XP_INGEST_READ_YOUR_WRITES'] is False
+        assert app.config['RUNNER_IMAGES'] == {'python': 'py:slim'}
+        assert app.config['XP_INGEST_MODE'] == 'sync'
+    finally:
+        for name in ('LEADERBOARD_REFRESH_SECONDS', 'XP_INGEST_READ_YOUR_WRITES', 'RUNNER_IMAGES', 'XP_INGEST_MODE'):
+            app.config.pop(name, None)
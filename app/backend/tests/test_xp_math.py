@@ -24,3 +24,51 @@ def test_compute_new_level_boundaries():
 def test_next_level_threshold_consistent():
     for lvl in range(1, 6):
         assert schemas.next_level_threshold(lvl) == schemas.xp_for_level(lvl + 1)
+
+
+def _reference_level(current_xp):
+    # the original level-by-level walk; the table lookup must match it exactly
+    level = 1
+    while current_xp >= schemas.xp_for_level(level + 1):
+        level += 1
+    return level
+
+
+def test_compute_new_level_matches_reference():
+    probes = set(range(0, 5000))
+    for lvl in range(2, 400):
+        t = schemas.xp_for_level(lvl)
+        probes.update((t - 1, t, t + 1))
+    for xp in sorted(probes):
+        assert schemas.compute_new_level(xp) == _reference_level(xp)
+
+
+def test_compute_levels_vectorized():
+    totals = [0, 99, 282, 283, 10_000, 1_000_000, 50]
+    assert schemas.compute_levels(totals) == [schemas.compute_new_level(x) for x in totals]
+    assert schemas.compute_levels([]) == []
+
+
+def test_levels_past_the_table_use_closed_form():
+    size = len(schemas._thresholds)
+    for lvl in (schemas.TABLE_LEVELS, schemas.TABLE_LEVELS + 1, 10_000, 123_457):
+        t = schemas.xp_for_level(lvl)
+        assert [schemas.compute_new_level(xp) for xp in (t - 1, t, t + 1)] == [lvl - 1, lvl, lvl]
+    assert schemas.compute_levels([10 ** 13, 0]) == [schemas.compute_new_level(10 ** 13), 1]
+    assert len(schemas._thresholds) == size
+
+
+def test_award_xp_is_capped():
+    assert schemas.validate_award_payload({'user_id': 1, 'xp': schemas.MAX_AWARD_XP})[0] is True
+    ok, err = schemas.validate_award_payload({'user_id': 1, 'xp': schemas.MAX_AWARD_XP + 1})
+    assert ok is False and 'at most' in err
+
+
+def test_total_source_is_reserved_and_counted_once():
+    from datetime import datetime
+    from backend import rollups
+    ok, err = schemas.validate_award_payload({'user_id': 1, 'xp': 5, 'source': rollups.TOTAL_SOURCE})
+    assert ok is False and 'reserved' in err
+    acc = rollups._aggregate([(1, 5, rollups.TOTAL_SOURCE, datetime(2026, 1, 5)), (1, 3, 'quiz', datetime(2026, 1, 5))])
+    assert acc[(1, 'day', datetime(2026, 1, 5).date(), rollups.TOTAL_SOURCE)] == [8, 2]
+    assert acc[(1, 'day', datetime(2026, 1, 5).date(), 'quiz')] == [3, 1]